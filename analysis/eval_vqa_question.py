@@ -74,8 +74,9 @@ class AnswerTypeManager(object):
 
 
 class QuestionEvaluator(object):
-    def __init__(self, annotation_file, question_file):
+    def __init__(self, annotation_file, question_file, num_workers=0):
         self._filter = AnswerTypeManager(annotation_file)
+        self._num_workers = num_workers
         self._gt = VQAQuestion(question_file)
         self._types = self._filter.answer_types
         self._evaluator = None
@@ -84,7 +85,12 @@ class QuestionEvaluator(object):
 
     def evaluate(self, res_file):
         res = VQAQuestion(res_file)
-        self._evaluator = COCOEvalCap(self._gt, res)
+        if self._num_workers > 0:
+            # METEOR can not be sharded, only BLEU, ROUGE_L and CIDEr are reported
+            from sharded_caption_eval import ShardedCOCOEvalCap
+            self._evaluator = ShardedCOCOEvalCap(self._gt, res, self._num_workers)
+        else:
+            self._evaluator = COCOEvalCap(self._gt, res)
         quest_ids = res.getImgIds()
         self._types = ['all']
         for ans_type in self._types:
@@ -122,11 +128,15 @@ class QuestionEvaluator(object):
                                 'question_type': types,
                                 'score': self._scores})
 
+    def _get_overall_score(self, metric):
+        # the metrics, and their order, depend on the evaluator
+        return float(self._scores[list(self._eval_metric).index(metric)][0])
+
     def get_overall_cider(self):
-        return float(self._scores[0][0])
+        return self._get_overall_score('CIDEr')
 
     def get_overall_blue4(self):
-        return float(self._scores[2][0])
+        return self._get_overall_score('Bleu_4')
 
 
 def load_questions(question_file):
@@ -1,8 +1,8 @@
-from nltk.tokenize import word_tokenize
 from inference_utils import vocabulary
 
 
 def _tokenize_sentence(sentence):
+    from nltk.tokenize import word_tokenize
     return word_tokenize(str(sentence).lower())
 
 
@@ -0,0 +1,188 @@
+"""
+Checkpointing off the training thread.
+
+The training loop only pays for copying the variables out of the session
+(and the sampler / replay buffer state into numpy arrays or dicts); the
+copy is written to disk by a background thread, at most one save being in
+flight. Checkpoints are written under a temporary name and renamed once
+complete, so a crash never leaves a partial checkpoint behind the
+'checkpoint' state file, and only the last max_to_keep ones are kept.
+"""
+import os
+import glob
+import threading
+from Queue import Queue
+from time import time, sleep
+import numpy as np
+import tensorflow as tf
+
+
+class BackgroundWriter(object):
+    """Runs write functions on a background thread, in submission order."""
+
+    def __init__(self):
+        self._queue = Queue()
+        self._errors = []
+        thread = threading.Thread(target=self._loop)
+        thread.daemon = True
+        thread.start()
+
+    def _loop(self):
+        while True:
+            write_fn, args = self._queue.get()
+            try:
+                write_fn(*args)
+            except Exception as e:
+                tf.logging.error('Background write failed: %s' % e)
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def _check_errors(self):
+        if self._errors:
+            raise self._errors.pop(0)
+
+    def submit(self, write_fn, *args):
+        self._check_errors()
+        self._queue.put((write_fn, args))
+
+    def wait(self):
+        """Blocks until everything submitted so far is written."""
+        self._queue.join()
+        self._check_errors()
+
+
+def _saved_variables(saver):
+    """
+    (name, variable) pairs of the variables saved by saver, all the global
+    variables when it was built without a var_list.
+    """
+    var_list = saver._var_list
+    if var_list is None:
+        var_list = tf.global_variables()
+    if isinstance(var_list, dict):
+        return sorted(var_list.items())
+    return [(var.op.name, var) for var in var_list]
+
+
+class AsyncCheckpointSaver(object):
+    """
+    Drop-in for saver.save(sess, sv_path, global_step=global_step) in the
+    feed_train loops. The variables of saver are snapshotted with one
+    session run, and assigned to placeholder-initialised copies in a
+    separate graph, which a background thread saves under the names used
+    by saver, next to the meta graph of the training graph and the
+    saver_def. The copies are kept on the CPU.
+    """
+
+    def __init__(self, graph, sv_path, saver):
+        self._sv_path = sv_path
+        self._train_dir = os.path.dirname(sv_path)
+        self._max_to_keep = saver.saver_def.max_to_keep
+        ckpt = tf.train.get_checkpoint_state(self._train_dir)
+        self._kept = [] if ckpt is None else list(ckpt.all_model_checkpoint_paths)
+        self._writer = BackgroundWriter()
+        with graph.as_default():
+            named_vars = _saved_variables(saver)
+            self._meta_graph_def = tf.train.export_meta_graph(saver_def=saver.saver_def)
+        self._variables = [var for _, var in named_vars]
+        self._shadow_graph = tf.Graph()
+        with self._shadow_graph.as_default(), tf.device('/cpu:0'):
+            self._placeholders = []
+            shadow_vars = {}
+            for name, var in named_vars:
+                pl = tf.placeholder(var.dtype.base_dtype, shape=var.get_shape())
+                shadow_vars[name] = tf.Variable(pl, trainable=False,
+                                                collections=[])
+                self._placeholders.append(pl)
+            self._init_op = tf.variables_initializer(shadow_vars.values())
+            # saved under the names of the training graph variables
+            self._saver = tf.train.Saver(shadow_vars, max_to_keep=None,
+                                         write_version=tf.train.SaverDef.V2)
+        config = tf.ConfigProto(device_count={'GPU': 0})
+        self._shadow_sess = tf.Session(graph=self._shadow_graph, config=config)
+        self.last_stall = 0.
+
+    @property
+    def writer(self):
+        return self._writer
+
+    def save(self, sess, global_step):
+        """Returns the time the training thread was blocked, in sec."""
+        t = time()
+        # at most one save in flight
+        self._writer.wait()
+        values, step = sess.run([self._variables, global_step])
+        self._writer.submit(self._write, values, int(step))
+        self.last_stall = time() - t
+        return self.last_stall
+
+    def _write(self, values, step):
+        t = time()
+        feed_dict = dict(zip(self._placeholders, values))
+        self._shadow_sess.run(self._init_op, feed_dict=feed_dict)
+        ckpt_path = '%s-%d' % (self._sv_path, step)
+        tmp_path = os.path.join(self._train_dir, '.tmp-%s' % os.path.basename(ckpt_path))
+        self._saver.save(self._shadow_sess, tmp_path, write_meta_graph=False,
+                         write_state=False)
+        with open(tmp_path + '.meta', 'wb') as fs:
+            fs.write(self._meta_graph_def.SerializeToString())
+        for tmp_file in glob.glob(tmp_path + '.*'):
+            os.rename(tmp_file, ckpt_path + tmp_file[len(tmp_path):])
+        self._kept = [p for p in self._kept if p != ckpt_path] + [ckpt_path]
+        # like tf.train.Saver, a falsy max_to_keep keeps every checkpoint
+        while self._max_to_keep and len(self._kept) > self._max_to_keep:
+            for old_file in glob.glob(self._kept.pop(0) + '.*'):
+                os.remove(old_file)
+        tf.train.update_checkpoint_state(self._train_dir, ckpt_path,
+                                         all_model_checkpoint_paths=self._kept)
+        tf.logging.info('Saved model %s in background (%0.2f sec)' %
+                        (os.path.basename(ckpt_path), time() - t))
+
+    def close(self):
+        self._writer.wait()
+        self._shadow_sess.close()
+
+
+def benchmark_async_checkpoint(num_params=200000000, num_saves=3, interval=10.,
+                               train_dir='/tmp/async_ckpt_benchmark'):
+    """
+    Training thread stall of saver.save versus AsyncCheckpointSaver.save,
+    with interval seconds of (simulated) training between two saves.
+    """
+    if not tf.gfile.IsDirectory(train_dir):
+        tf.gfile.MakeDirs(train_dir)
+    sv_path = os.path.join(train_dir, 'model.ckpt')
+    graph = tf.Graph()
+    with graph.as_default():
+        num_vars = 20
+        for i in range(num_vars):
+            tf.Variable(tf.random_uniform([num_params // num_vars]), name='w%d' % i)
+        global_step = tf.Variable(0, name='global_step', trainable=False)
+        incr = tf.assign_add(global_step, 1)
+        saver = tf.train.Saver(max_to_keep=2)
+        init_op = tf.global_variables_initializer()
+    sess = tf.Session(graph=graph)
+    sess.run(init_op)
+
+    sync_stalls = []
+    for _ in range(num_saves):
+        sess.run(incr)
+        t = time()
+        saver.save(sess, sv_path, global_step=global_step)
+        sync_stalls.append(time() - t)
+
+    async_saver = AsyncCheckpointSaver(graph, sv_path, saver)
+    async_stalls = []
+    for _ in range(num_saves):
+        sess.run(incr)
+        async_stalls.append(async_saver.save(sess, global_step))
+        sleep(interval)
+    async_saver.close()
+    sess.close()
+    print('%d parameters, mean stall: saver.save %0.2f sec, async %0.2f sec' %
+          (num_params, np.mean(sync_stalls), np.mean(async_stalls)))
+
+
+if __name__ == '__main__':
+    benchmark_async_checkpoint()
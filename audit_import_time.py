@@ -0,0 +1,79 @@
+"""
+Reports the import cost of modules, e.g.
+
+    python audit_import_time.py var_ivqa_rewards readers.ivqa_reader_creater
+
+Each target is imported in a fresh interpreter, with __import__ wrapped to
+record the inclusive and self time of every module it pulls in.
+"""
+from __future__ import print_function
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+def _profile_import(module_name):
+    records = {}
+    stack = []
+    orig_import = builtins.__import__
+
+    def _timed_import(name, *args, **kwargs):
+        if name in sys.modules or name in records:
+            return orig_import(name, *args, **kwargs)
+        stack.append(0.)
+        start = time.time()
+        try:
+            return orig_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            records.setdefault(name, (elapsed, elapsed - children))
+
+    builtins.__import__ = _timed_import
+    start = time.time()
+    try:
+        __import__(module_name)
+    finally:
+        builtins.__import__ = orig_import
+    records['<total>'] = (time.time() - start, 0.)
+    return records
+
+
+def audit(module_name, top_k=20):
+    output = subprocess.check_output([sys.executable, __file__,
+                                      '--child', module_name])
+    records = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+    total = records.pop('<total>')[0]
+    print('==== %s: %0.2f sec ====' % (module_name, total))
+    print('%10s %10s  %s' % ('self(s)', 'cumul(s)', 'module'))
+    items = sorted(records.items(), key=lambda x: -x[1][1])
+    for name, (cumul, self_time) in items[:top_k]:
+        print('%10.3f %10.3f  %s' % (self_time, cumul, name))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit module import time.')
+    parser.add_argument('modules', nargs='+')
+    parser.add_argument('--top_k', type=int, default=20)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(_profile_import(args.modules[0])))
+        return
+    for module_name in args.modules:
+        audit(module_name, args.top_k)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,8 @@ decoded_sparse, decoded_logprobs = beam_decoder(
 ```
 
 See the `beam_decoder` function for complete documentation. (Only the
-`beam_decoder` function is part of the public API here.)
+`beam_decoder` and `nbest_beam_decoder` functions are part of the public
+API here.)
 """
 import tensorflow as tf
 import numpy as np
@@ -387,6 +388,52 @@ class BeamSearchHelper(object):
     def tokens_to_inputs_fn(self, symbols):
         return tf.expand_dims(symbols, -1)
 
+    def expand_beam(self, cell_output, cell_state, past_beam_logprobs):
+        """
+        Scores all the one token extensions of the beam, and keeps the best
+        beam_size ones that do not end with the stop token.
+
+        Returns logprobs_batched [batch_size, beam_size * num_classes],
+        num_classes, the new beam logprobs, symbols and parent beam indices
+        (all [batch_size, beam_size]), and the reordered cell state and next
+        cell input.
+        """
+        logprobs = self.outputs_to_score_fn(cell_output)
+
+        try:
+            num_classes = int(logprobs.get_shape()[-1])
+        except:
+            # Shape inference failed
+            num_classes = tf.shape(logprobs)[-1]
+
+        logprobs_batched = tf.reshape(
+            logprobs + tf.expand_dims(tf.reshape(past_beam_logprobs, [self.batch_size, self.beam_size]), 2),
+            [self.batch_size, self.beam_size * num_classes])
+
+        # TODO(nikita): consider using slice+fill+concat instead of adding a mask
+        nondone_mask = tf.reshape(
+            tf.cast(tf.equal(tf.range(num_classes), self.stop_token), tf.float32) * self.INVALID_SCORE,
+            [1, 1, num_classes])  # disable the stop token slice
+
+        nondone_mask = tf.reshape(tf.tile(nondone_mask, [1, self.beam_size, 1]),
+                                  [-1, self.beam_size * num_classes])
+
+        beam_logprobs, indices = tf.nn.top_k(logprobs_batched + nondone_mask, self.beam_size)
+
+        # For continuing to the next symbols
+        symbols = indices % num_classes  # [batch_size, self.beam_size]
+        parent_refs = indices // num_classes  # [batch_size, self.beam_size]
+
+        # Handle the output and the cell state shuffling
+        next_cell_state = nest_map(
+            lambda element: batch_gather(element, parent_refs, batch_size=self.batch_size, options_size=self.beam_size),
+            cell_state
+        )
+
+        next_input = self.tokens_to_inputs_fn(tf.reshape(symbols, [-1, self.beam_size]))
+        return (logprobs_batched, num_classes, beam_logprobs, symbols,
+                parent_refs, next_cell_state, next_input)
+
     def beam_setup(self, time):
         emit_output = None
         next_cell_state = self.initial_state
@@ -440,49 +487,17 @@ class BeamSearchHelper(object):
         emit_output = cell_output
 
         # 1. Get scores for all candidate sequences
-
-        logprobs = self.outputs_to_score_fn(cell_output)
-
-        try:
-            num_classes = int(logprobs.get_shape()[-1])
-        except:
-            # Shape inference failed
-            num_classes = tf.shape(logprobs)[-1]
-
-        logprobs_batched = tf.reshape(
-            logprobs + tf.expand_dims(tf.reshape(past_beam_logprobs, [self.batch_size, self.beam_size]), 2),
-            [self.batch_size, self.beam_size * num_classes])
-
         # 2. Determine which states to pass to next iteration
-
-        # TODO(nikita): consider using slice+fill+concat instead of adding a mask
-        nondone_mask = tf.reshape(
-            tf.cast(tf.equal(tf.range(num_classes), self.stop_token), tf.float32) * self.INVALID_SCORE,
-            [1, 1, num_classes])  # disable the stop token slice
-
-        nondone_mask = tf.reshape(tf.tile(nondone_mask, [1, self.beam_size, 1]),
-                                  [-1, self.beam_size * num_classes])
-
-        beam_logprobs, indices = tf.nn.top_k(logprobs_batched + nondone_mask, self.beam_size)
+        (logprobs_batched, num_classes, beam_logprobs, symbols,
+         parent_refs, next_cell_state, next_input) = self.expand_beam(cell_output, cell_state,
+                                                                      past_beam_logprobs)
         min_beam_logprobs = tf.reduce_min(beam_logprobs, 1)
         beam_logprobs = tf.reshape(beam_logprobs, [-1])
 
-        # For continuing to the next symbols
-        symbols = indices % num_classes  # [batch_size, self.beam_size]
-        parent_refs = indices // num_classes  # [batch_size, self.beam_size]
-
         symbols_history = flat_batch_gather(past_beam_symbols, parent_refs, batch_size=self.batch_size,
                                             options_size=self.beam_size)
         beam_symbols = concat_op([symbols_history, tf.reshape(symbols, [-1, 1])], 1)
 
-        # Handle the output and the cell state shuffling
-        next_cell_state = nest_map(
-            lambda element: batch_gather(element, parent_refs, batch_size=self.batch_size, options_size=self.beam_size),
-            cell_state
-        )
-
-        next_input = self.tokens_to_inputs_fn(tf.reshape(symbols, [-1, self.beam_size]))
-
         # 3. Update the candidate pool to include entries that just ended with a stop token
         logprobs_done = tf.reshape(logprobs_batched, [-1, self.beam_size, num_classes])[:, :, self.stop_token]
         done_parent_refs = tf.argmax(logprobs_done, 1)
@@ -573,6 +588,144 @@ class BeamSearchHelper(object):
         return sparse_boolean_mask(dense_symbols, mask), logprobs
 
 
+class NBestBeamSearchHelper(BeamSearchHelper):
+    """
+    Beam search keeping back-pointers instead of the symbol history.
+
+    Every step writes the chosen symbols and the beam index they extend to
+    TensorArrays, together with the score of ending each beam with the stop
+    token, so a step costs the same whatever the length of the sequences.
+    The num_best best finished hypotheses over all the steps are rebuilt by
+    a single backtrace once the search is over.
+    """
+
+    def __init__(self, cell, beam_size, stop_token, initial_state, initial_input,
+                 num_best=1, **kwargs):
+        super(NBestBeamSearchHelper, self).__init__(cell, beam_size, stop_token,
+                                                    initial_state, initial_input,
+                                                    **kwargs)
+        # the num_best hypotheses are drawn from all steps, so the search has
+        # to run to max_len rather than stop when the best one is found
+        if self.max_len is None:
+            raise ValueError("N-best beam search needs max_len.")
+        if num_best > self.beam_size * self.max_len:
+            raise ValueError("num_best can not exceed beam_size * max_len.")
+        self.num_best = num_best
+
+    def beam_setup(self, time):
+        next_cell_state = self.initial_state
+        next_input = self.initial_input
+
+        first_in_beam_mask = tf.equal(tf.range(self.batch_size_times_beam_size) % self.beam_size, 0)
+        beam_logprobs = select_op(
+            first_in_beam_mask,
+            tf.fill([self.batch_size_times_beam_size], 0.0),
+            tf.fill([self.batch_size_times_beam_size], self.INVALID_SCORE)
+        )
+        beam_logprobs.set_shape(tf.TensorShape((self.inferred_batch_size_times_beam_size,)))
+
+        # one [batch_size, beam_size] entry per step
+        next_loop_state = (
+            tf.TensorArray(dtype=tf.int32, size=0, dynamic_size=True),  # symbols
+            tf.TensorArray(dtype=tf.int32, size=0, dynamic_size=True),  # parent beams
+            tf.TensorArray(dtype=tf.float32, size=0, dynamic_size=True),  # stop scores
+            beam_logprobs,
+        )
+
+        emit_output = tf.zeros(self.cell.output_size)
+        elements_finished = tf.zeros([self.batch_size], dtype=tf.bool)
+
+        return (elements_finished, next_input, next_cell_state,
+                emit_output, next_loop_state)
+
+    def beam_loop(self, time, cell_output, cell_state, loop_state):
+        (
+            symbols_ta,
+            parents_ta,
+            done_logprobs_ta,
+            past_beam_logprobs,  # [batch_size*beam_size]
+        ) = loop_state
+
+        emit_output = cell_output
+
+        (logprobs_batched, num_classes, beam_logprobs, symbols,
+         parent_refs, next_cell_state, next_input) = self.expand_beam(cell_output, cell_state,
+                                                                      past_beam_logprobs)
+        beam_logprobs = tf.reshape(beam_logprobs, [-1])
+
+        # score of ending each beam of the previous step here, the hypothesis
+        # stopping at step t are the beams of step t-1
+        logprobs_done = tf.reshape(logprobs_batched, [-1, self.beam_size, num_classes])[:, :, self.stop_token]
+
+        symbols_ta = symbols_ta.write(time - 1, symbols)
+        parents_ta = parents_ta.write(time - 1, parent_refs)
+        done_logprobs_ta = done_logprobs_ta.write(time - 1, logprobs_done)
+
+        elements_finished = tf.zeros([self.batch_size], dtype=tf.bool) | (time >= self.max_len)
+
+        for tensor in list(nest.flatten(next_input)) + list(nest.flatten(next_cell_state)):
+            tensor.set_shape(
+                tf.TensorShape((self.inferred_batch_size, self.beam_size)).concatenate(tensor.get_shape()[2:]))
+        elements_finished.set_shape(tf.TensorShape((self.inferred_batch_size,)))
+        beam_logprobs.set_shape(tf.TensorShape((self.inferred_batch_size_times_beam_size,)))
+
+        next_loop_state = (
+            symbols_ta,
+            parents_ta,
+            done_logprobs_ta,
+            beam_logprobs,
+        )
+
+        return (elements_finished, next_input, next_cell_state,
+                emit_output, next_loop_state)
+
+    def backtrace(self, step_symbols, step_parents, lengths, beam_refs):
+        """
+        Rebuilds the hypotheses ending with beam beam_refs[b, n] after
+        lengths[b, n] steps, from step_symbols and step_parents
+        ([max_steps, batch_size, beam_size]). Returns [batch_size, num_best,
+        max_steps] symbols, padded with the stop token.
+        """
+        num_steps = tf.shape(step_symbols)[0]
+        steps = tf.range(num_steps - 1, -1, -1)
+
+        def _step_back(acc, elems):
+            beam_refs, _ = acc
+            symbols, parents, step = elems
+            in_sequence = tf.less(step, lengths)
+            tokens = select_op(in_sequence,
+                               batch_gather(symbols, beam_refs, batch_size=self.batch_size,
+                                            options_size=self.beam_size),
+                               tf.fill(tf.shape(beam_refs), self.stop_token))
+            beam_refs = select_op(in_sequence,
+                                  batch_gather(parents, beam_refs, batch_size=self.batch_size,
+                                               options_size=self.beam_size),
+                                  beam_refs)
+            return beam_refs, tokens
+
+        _, tokens = tf.scan(_step_back,
+                            (tf.reverse(step_symbols, [0]), tf.reverse(step_parents, [0]), steps),
+                            initializer=(beam_refs, tf.zeros_like(beam_refs)))
+        # tokens were emitted last step first
+        return tf.transpose(tf.reverse(tokens, [0]), [1, 2, 0])
+
+    def decode_nbest(self):
+        emit_ta, final_state, final_loop_state = tf.nn.raw_rnn(self.cell, self.loop_fn, scope=self.scope)
+        symbols_ta, parents_ta, done_logprobs_ta, _ = final_loop_state
+        step_symbols = symbols_ta.stack()  # [max_steps, batch_size, beam_size]
+        step_parents = parents_ta.stack()
+        done_logprobs = done_logprobs_ta.stack()
+
+        # pick the best stop events over (step, beam)
+        done_logprobs = tf.reshape(tf.transpose(done_logprobs, [1, 0, 2]), [self.batch_size, -1])
+        nbest_logprobs, indices = tf.nn.top_k(done_logprobs, self.num_best)
+        lengths = indices // self.beam_size
+        beam_refs = indices % self.beam_size
+
+        nbest_symbols = self.backtrace(step_symbols, step_parents, lengths, beam_refs)
+        return nbest_symbols, nbest_logprobs
+
+
 # %%
 
 def beam_decoder(
@@ -673,3 +826,48 @@ def beam_decoder(
             return helper.decode_dense()
         else:
             return helper.decode_sparse()
+
+
+def nbest_beam_decoder(
+        cell,
+        beam_size,
+        stop_token,
+        initial_state,
+        initial_input,
+        tokens_to_inputs_fn,
+        max_len,
+        num_best=None,
+        outputs_to_score_fn=None,
+        cell_transform='default',
+        scope=None
+):
+    """Beam search decoder returning the num_best best finished hypotheses
+
+    The arguments are the same as for beam_decoder, but the search always
+    runs for max_len steps (there is no score_upper_bound), and num_best
+    defaults to beam_size.
+
+    Returns:
+        A tuple of the form (decoded, log_probabilities) where:
+        decoded: a [batch_size, num_best, max_len] int32 tensor of the
+            hypotheses, best first, without start token and padded with the
+            stop token
+        log_probability: a [batch_size, num_best] tensor of sequence
+            log-probabilities. When fewer than num_best hypotheses finished,
+            the remaining ones score BeamSearchHelper.INVALID_SCORE
+    """
+    with tf.variable_scope(scope or "RNN") as varscope:
+        helper = NBestBeamSearchHelper(
+            cell=cell,
+            beam_size=beam_size,
+            stop_token=stop_token,
+            initial_state=initial_state,
+            initial_input=initial_input,
+            num_best=beam_size if num_best is None else num_best,
+            tokens_to_inputs_fn=tokens_to_inputs_fn,
+            outputs_to_score_fn=outputs_to_score_fn,
+            max_len=max_len,
+            cell_transform=cell_transform,
+            scope=varscope
+        )
+        return helper.decode_nbest()
@@ -1,7 +1,7 @@
 import tensorflow as tf
 from tensorflow.python.platform import test
 import numpy as np
-from tf_beam_decoder import beam_decoder, BeamSearchHelper
+from tf_beam_decoder import beam_decoder, nbest_beam_decoder, BeamSearchHelper
 
 # %%
 
@@ -222,5 +222,66 @@ class BeamSearchTest(test.TestCase):
                 assert np.isclose(np.exp(candidate_logprobs[13]), 0.1 * 0.9 * 0.9)
                 assert all(np.isclose(np.exp(candidate_logprobs[14:]), 0.0))
 
+    def test5(self):
+        """
+        test the n-best decoder against the beam decoder
+        """
+        def _strip(seq):
+            seq = list(seq)
+            return tuple(seq[:seq.index(2)] if 2 in seq else seq)
+
+        with self.test_session() as sess:
+            table = np.array([[[0.9, 0.1, 0],
+                               [0, 0.9, 0.1],
+                               [0, 0, 1.0]]] * 3)
+
+            for cell_transform in ['default', 'flatten', 'replicate']:
+                cell = MarkovChainCell(table)
+                initial_state = cell.zero_state(1, tf.int32)
+                initial_input = initial_state[0]
+
+                with tf.variable_scope('test5_{}'.format(cell_transform)) as scope:
+                    best_dense, best_logprobs = beam_decoder(
+                        cell=cell,
+                        beam_size=4,
+                        stop_token=2,
+                        initial_state=initial_state,
+                        initial_input=initial_input,
+                        tokens_to_inputs_fn=lambda x:tf.expand_dims(x, -1),
+                        max_len=4,
+                        cell_transform=cell_transform,
+                        output_dense=True,
+                        scope=scope
+                        )
+
+                with tf.variable_scope(scope, reuse=True) as varscope:
+                    nbest, nbest_logprobs = nbest_beam_decoder(
+                        cell=cell,
+                        beam_size=4,
+                        stop_token=2,
+                        initial_state=initial_state,
+                        initial_input=initial_input,
+                        tokens_to_inputs_fn=lambda x:tf.expand_dims(x, -1),
+                        max_len=4,
+                        num_best=3,
+                        cell_transform=cell_transform,
+                        scope=varscope
+                        )
+
+                tf.variables_initializer([cell.log_table_var]).run()
+                best, best_lp, paths, path_lps = sess.run(
+                    (best_dense, best_logprobs, nbest, nbest_logprobs))
+
+                assert paths.shape[:2] == (1, 3)
+                paths = [_strip(p) for p in paths[0]]
+                # k distinct paths, best first
+                assert len(set(paths)) == 3
+                assert all(np.diff(path_lps[0]) <= 1e-6)
+                # the best one is the one of the beam decoder
+                assert paths[0] == _strip(best[0]) == (1,)
+                assert np.isclose(path_lps[0, 0], best_lp[0])
+                assert np.isclose(np.exp(path_lps[0, 0]), 0.1 * 0.1)
+                assert np.isclose(np.exp(path_lps[0, 1]), 0.9 * 0.1 * 0.1)
+
 if __name__ == '__main__':
     test.main()
\ No newline at end of file
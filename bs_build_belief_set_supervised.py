@@ -1,6 +1,7 @@
-from time import time
 import os
-from util import load_json, save_json
+from util import load_json
+from bs_result_util import ResultSink, ProgressReporter, part_file_of
+from build_cache import derive, checkpoint_files
 from bs_score_final_candidates_mlb_vqa2 import AttentionModel as MLB2AttModel
 try:
     from n2mn_wrapper import N2MNWrapper as N2NMNModel
@@ -20,14 +21,18 @@ def compare_answer(a1, a2):
     return a1.lower().strip() == a2.lower().strip()
 
 
-def load_lm_outputs(method, inf_type='rand'):
+def lm_outputs_file(method, inf_type='rand'):
     method = 'SL'  # override
     assert (inf_type in ['beam', 'rand'])
     if inf_type == 'rand':
         res_file = 'result/bs_RL2_cands_LM_%s.json' % method
     else:
         res_file = 'result/bs_RL2_cands_LM_%s_BEAM.json' % method
-    return load_json(res_file)
+    return res_file
+
+
+def load_lm_outputs(method, inf_type='rand'):
+    return load_json(lm_outputs_file(method, inf_type))
 
 
 def process(method, inf_type='rand'):
@@ -35,55 +40,58 @@ def process(method, inf_type='rand'):
         res_file = 'result/bs_SL_final_%s.json' % method
     else:
         res_file = 'result/bs_SL_final_%s_BEAM.json' % method
-    if os.path.exists(res_file):
-        print('File %s already exist, skipped' % res_file)
-        return
+    # rebuilt only when the candidates of the language model or the VQA
+    # model changed
+    derive('bs_build_belief_set_supervised.%s' % method, [res_file],
+           [lm_outputs_file(method, inf_type)] +
+           checkpoint_files(_TYPE2Model[method].CKPT_FILE),
+           lambda: _build_belief_set(method, inf_type, res_file),
+           params={'inf_type': inf_type},
+           partial_outputs=[part_file_of(res_file)])
+
 
+def _build_belief_set(method, inf_type, res_file):
     # cands = load_results()
     model = _TYPE2Model[method]()
     mc_ctx = MultiChoiceQuestionManger(subset='val')
 
     task_data = load_lm_outputs(method, inf_type)
 
-    belief_sets = []
-    t = time()
-    num = len(task_data)
-    for i, quest_id_key in enumerate(task_data.keys()):
-        # time it
-        avg_time = (time() - t)
-        print('%d/%d (%0.2f sec/sample)' % (i, num, avg_time))
-        t = time()
-
-        # extract basis info
-        quest_id = int(quest_id_key)
-        gt_answer = mc_ctx.get_gt_answer(quest_id)
-        image_id = mc_ctx.get_image_id(quest_id)
-        image = mc_ctx.get_image_file(quest_id)
-
-        # process
-        cands = task_data[quest_id_key]
-        gt_question = mc_ctx.get_question(quest_id)
-
-        i_scores, i_questions = [], []
-        for item in cands:
-            target = item['question']
-            pred_ans, vqa_score = model.get_score(image_id, target)
-            # inset check
-            is_valid = compare_answer(pred_ans, gt_answer)
-            if not is_valid:
-                continue
-            i_questions.append(target)
-            i_scores.append([float(vqa_score), item['score']])
-        print('%d/%d' % (len(i_questions), len(cands)))
-        bs_i = {'image': image,
-                'image_id': image_id,
-                'question': gt_question,
-                'answer': gt_answer,
-                'belief_sets': i_questions,
-                'belief_strength': i_scores}
-
-        belief_sets.append(bs_i)
-    save_json(res_file, belief_sets)
+    with ResultSink(res_file, flush_every=10) as sink:
+        todo = [k for k in task_data.keys() if not sink.is_done(k)]
+        progress = ProgressReporter(len(todo), interval=10, name=method)
+        for quest_id_key in todo:
+            # extract basis info
+            quest_id = int(quest_id_key)
+            gt_answer = mc_ctx.get_gt_answer(quest_id)
+            image_id = mc_ctx.get_image_id(quest_id)
+            image = mc_ctx.get_image_file(quest_id)
+
+            # process
+            cands = task_data[quest_id_key]
+            gt_question = mc_ctx.get_question(quest_id)
+
+            # score all candidates against the image in one run
+            targets = [item['question'] for item in cands]
+            pred_answers, vqa_scores = model.get_scores(image_id, targets)
+            i_scores, i_questions = [], []
+            for item, pred_ans, vqa_score in zip(cands, pred_answers, vqa_scores):
+                target = item['question']
+                # inset check
+                is_valid = compare_answer(pred_ans, gt_answer)
+                if not is_valid:
+                    continue
+                i_questions.append(target)
+                i_scores.append([float(vqa_score), item['score']])
+            bs_i = {'image': image,
+                    'image_id': image_id,
+                    'question': gt_question,
+                    'answer': gt_answer,
+                    'belief_sets': i_questions,
+                    'belief_strength': i_scores}
+
+            sink.add(quest_id_key, bs_i)
+            progress.update()
 
 
 if __name__ == '__main__':
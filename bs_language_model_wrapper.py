@@ -2,7 +2,7 @@ from __future__ import division
 import tensorflow as tf
 import numpy as np
 from config import VOCAB_CONFIG
-from post_process_variation_questions import wrap_samples_for_language_model
+from post_process_variation_questions import wrap_samples_for_language_model, PaddedBatchBuilder
 from models.language_model import LanguageModel
 
 END_TOKEN = VOCAB_CONFIG.end_token_id
@@ -83,11 +83,13 @@ class LanuageModelWrapper(object):
         self.min_gt_count = min_count
         self.nn_lm = NNLanguageModel()
         self.eg_lm = ExemplarLanguageModel()
+        self._batch_builder = PaddedBatchBuilder()
 
     def inference(self, ivqa_pathes):
         language_model_inputs = wrap_samples_for_language_model([ivqa_pathes],
                                                                 pad_token=self.pad_token - 1,
-                                                                max_length=20)
+                                                                max_length=20,
+                                                                builder=self._batch_builder)
         match_gt = self.eg_lm.query(ivqa_pathes, self.min_gt_count)
         legality_scores = self.nn_lm.inference(language_model_inputs)
         legality_scores[match_gt] = 1.0
@@ -0,0 +1,116 @@
+import json
+import os
+from time import time
+from util import save_json
+
+
+def load_jsonl(fpath):
+    with open(fpath, 'r') as fs:
+        for line in fs:
+            try:
+                yield json.loads(line)
+            except ValueError:  # line truncated by a crash
+                continue
+
+
+def merge_results(part_file, as_dict=False):
+    """Converts the lines written by ResultSink to the usual output format."""
+    items = [(key, res) for key, res in load_jsonl(part_file) if res is not None]
+    if as_dict:
+        return {key: res for key, res in items}
+    return [res for _, res in items]
+
+
+def part_file_of(res_file):
+    """The JSON-Lines file ResultSink streams the results of res_file to."""
+    return os.path.splitext(res_file)[0] + '.part.jsonl'
+
+
+class ResultSink(object):
+    """
+    Streams the results of a bs_* script to a JSON-Lines file next to
+    res_file, one [key, result] line per processed sample, flushed to disk
+    every flush_every samples. Keys found in an existing part file are
+    reported by is_done, so a restarted script resumes where it crashed.
+    close() merges the lines into res_file, as a list of results, or a dict
+    keyed by sample when as_dict is set, and removes the part file.
+    """
+
+    def __init__(self, res_file, as_dict=False, flush_every=100):
+        self._res_file = res_file
+        self._part_file = part_file_of(res_file)
+        self._as_dict = as_dict
+        self._flush_every = flush_every
+        self._num_pending = 0
+        self._done = set()
+        truncated = False
+        if os.path.exists(self._part_file):
+            self._done = {key for key, _ in load_jsonl(self._part_file)}
+            with open(self._part_file, 'r') as fs:
+                truncated = not fs.read().endswith('\n')
+            print('ResultSink: resume %s, %d samples done' % (self._part_file,
+                                                               len(self._done)))
+        self._fs = open(self._part_file, 'a')
+        if truncated:
+            self._fs.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:  # keep the part file for resuming
+            self.flush()
+            self._fs.close()
+
+    def is_done(self, key):
+        return key in self._done
+
+    def add(self, key, result=None):
+        """Records key as processed, a None result is dropped at merge."""
+        self._fs.write(json.dumps([key, result]) + '\n')
+        self._done.add(key)
+        self._num_pending += 1
+        if self._num_pending >= self._flush_every:
+            self.flush()
+
+    def flush(self):
+        self._fs.flush()
+        os.fsync(self._fs.fileno())
+        self._num_pending = 0
+
+    def close(self):
+        self.flush()
+        self._fs.close()
+        results = merge_results(self._part_file, self._as_dict)
+        save_json(self._res_file, results)
+        os.remove(self._part_file)
+        return results
+
+
+class ProgressReporter(object):
+    def __init__(self, num, interval=100, name='Progress'):
+        self._num = num
+        self._interval = interval
+        self._name = name
+        self._count = 0
+        self._last_count = 0
+        self._start = self._last_time = time()
+
+    def update(self, n=1):
+        self._count += n
+        if self._count - self._last_count >= self._interval or \
+                self._count == self._num:
+            self.report()
+
+    def report(self):
+        now = time()
+        sec_per_sample = (now - self._last_time) / max(self._count - self._last_count, 1)
+        throughput = self._count / max(now - self._start, 1e-6)
+        eta = (self._num - self._count) / max(throughput, 1e-6)
+        print('%s: %d/%d (%0.3f sec/sample, %0.1f samples/sec, ETA %0.1f min)' %
+              (self._name, self._count, self._num, sec_per_sample,
+               throughput, eta / 60.))
+        self._last_count = self._count
+        self._last_time = now
@@ -1,5 +1,5 @@
-from time import time
-from util import load_json, save_json
+from util import load_json
+from bs_result_util import ResultSink, ProgressReporter
 # from n2mn_wrapper import N2MNWrapper
 from bs_score_final_candidates_mlb_vqa2 import AttentionModel
 from w2v_answer_encoder import MultiChoiceQuestionManger
@@ -18,31 +18,29 @@ def process():
     model = AttentionModel()
     mc_ctx = MultiChoiceQuestionManger(subset='val')
 
-    results = []
-    t = time()
-    for i, res_i in enumerate(cands):
-        if i % 100 == 0:
-            avg_time = (time() - t) / 100.
-            print('%d/%d (%0.2f sec/sample)' % (i, len(cands), avg_time))
-            t = time()
-
-        image_id = res_i['image_id']
-        aug_id = res_i['question_id']
-        question = res_i['question']
-        question_id = int(aug_id / 1000)
-        gt_answer = mc_ctx.get_gt_answer(question_id)
-        pred_ans, sc = model.get_score(image_id, question)
-        is_valid = compare_answer(pred_ans, gt_answer)
-        # import pdb
-        # pdb.set_trace()
-        if not is_valid:
-            continue
-        t_i = {'image_id': int(image_id),
-               'question_id': aug_id,
-               'question': question,
-               'score': float(sc)}
-        results.append(t_i)
-    save_json('result/vae_ia_van_mlbvqa2_flt_full.json', results)
+    with ResultSink('result/vae_ia_van_mlbvqa2_flt_full.json') as sink:
+        todo = [res_i for res_i in cands if not sink.is_done(res_i['question_id'])]
+        progress = ProgressReporter(len(todo))
+        for res_i in todo:
+            image_id = res_i['image_id']
+            aug_id = res_i['question_id']
+            question = res_i['question']
+            question_id = int(aug_id / 1000)
+            gt_answer = mc_ctx.get_gt_answer(question_id)
+            pred_ans, sc = model.get_score(image_id, question)
+            is_valid = compare_answer(pred_ans, gt_answer)
+            # import pdb
+            # pdb.set_trace()
+            if not is_valid:
+                sink.add(aug_id)
+                progress.update()
+                continue
+            t_i = {'image_id': int(image_id),
+                   'question_id': aug_id,
+                   'question': question,
+                   'score': float(sc)}
+            sink.add(aug_id, t_i)
+            progress.update()
 
 
 if __name__ == '__main__':
@@ -1,5 +1,5 @@
-from time import time
-from util import load_json, save_json
+from util import load_json
+from bs_result_util import ResultSink, ProgressReporter
 from n2mn_wrapper import N2MNWrapper
 from w2v_answer_encoder import MultiChoiceQuestionManger
 
@@ -12,40 +12,40 @@ def compare_answer(a1, a2):
     return a1.lower().strip() == a2.lower().strip()
 
 
-def process():
+def process(chunk_size=1000):
     cands = load_results()
     model = N2MNWrapper()
     mc_ctx = MultiChoiceQuestionManger(subset='val')
 
-    results = []
-    t = time()
-    for i, res_i in enumerate(cands):
-        if i % 100 == 0:
-            avg_time = (time() - t) / 100.
-            print('%d/%d (%0.2f sec/sample)' % (i, len(cands), avg_time))
-            t = time()
-
-        image_id = res_i['image_id']
-        aug_id = res_i['aug_id']
-        question = res_i['target']
-        # question_id = int(aug_id / 1000)
-        question_id = res_i['question_id']
-        gt_answer = mc_ctx.get_gt_answer(question_id)
-        pred_answers, scores = model.inference(image_id, [question])
-        sc = scores[0]
-        pred_ans = pred_answers[0]
-        is_valid = compare_answer(pred_ans, gt_answer)
-        # import pdb
-        # pdb.set_trace()
-        if not is_valid:
-            continue
-        t_i = {'image_id': int(image_id),
-               'aug_id': aug_id,
-               'question_id': question_id,
-               'question': question,
-               'score': float(sc)}
-        results.append(t_i)
-    save_json('result/bs_vis_scores_n2mn.json', results)
+    with ResultSink('result/bs_vis_scores_n2mn.json', flush_every=chunk_size) as sink:
+        todo = [res_i for res_i in cands if not sink.is_done(res_i['aug_id'])]
+        progress = ProgressReporter(len(todo), interval=chunk_size)
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            image_ids = [res_i['image_id'] for res_i in chunk]
+            questions = [res_i['target'] for res_i in chunk]
+            all_pred_answers, all_scores = model.inference_batch(image_ids, questions)
+
+            for res_i, pred_ans, sc in zip(chunk, all_pred_answers, all_scores):
+                image_id = res_i['image_id']
+                aug_id = res_i['aug_id']
+                question = res_i['target']
+                # question_id = int(aug_id / 1000)
+                question_id = res_i['question_id']
+                gt_answer = mc_ctx.get_gt_answer(question_id)
+                is_valid = compare_answer(pred_ans, gt_answer)
+                # import pdb
+                # pdb.set_trace()
+                if not is_valid:
+                    sink.add(aug_id)
+                    continue
+                t_i = {'image_id': int(image_id),
+                       'aug_id': aug_id,
+                       'question_id': question_id,
+                       'question': question,
+                       'score': float(sc)}
+                sink.add(aug_id, t_i)
+            progress.update(len(chunk))
 
 
 if __name__ == '__main__':
@@ -1,5 +1,5 @@
-from time import time
-from util import load_json, save_json
+from util import load_json
+from bs_result_util import ResultSink, ProgressReporter
 # from n2mn_wrapper import N2MNWrapper
 import tensorflow as tf
 import os
@@ -10,11 +10,14 @@ from w2v_answer_encoder import MultiChoiceQuestionManger
 
 
 class AttentionModel(BaseVQAModel):
+    broadcast_image = True
+    MODEL_DIR = '/usr/data/fl302/code/inverse_vqa/model/mlb_attention_v2/'
+    CKPT_FILE = MODEL_DIR + 'model.ckpt-170000'
+
     def __init__(self, subset='val'):
         BaseVQAModel.__init__(self)
-        model_dir = '/usr/data/fl302/code/inverse_vqa/model/mlb_attention_v2/'
-        top_ans_file = model_dir + 'vqa_trainval_top2000_answers.txt'
-        ckpt_file = model_dir + 'model.ckpt-170000'
+        top_ans_file = self.MODEL_DIR + 'vqa_trainval_top2000_answers.txt'
+        ckpt_file = self.CKPT_FILE
         self.to_sentence = SentenceGenerator(trainset='trainval',
                                              top_ans_file=top_ans_file)
         self.g = tf.Graph()
@@ -55,29 +58,26 @@ def process(model_type='mlb_v2'):
     model = AttentionModel()
     mc_ctx = MultiChoiceQuestionManger(subset='val')
 
-    results = {}
-    t = time()
     print('Number items: %d' % len(cands))
-    for i, res_key in enumerate(cands):
-        if i % 100 == 0:
-            avg_time = (time() - t) / 100.
-            print('%d/%d (%0.2f sec/sample)' % (i, len(cands), avg_time))
-            t = time()
-        res_i = cands[res_key]
-        image_id = res_i['image_id']
-        question = res_i['target']
-        question_id = res_i['question_id']
-        gt_answer = mc_ctx.get_gt_answer(question_id)
-        pred_ans, scores = model.get_score(image_id, question)
-        sc = float(scores)
-        is_valid = compare_answer(pred_ans, gt_answer)
-        # if not is_valid:
-        #     continue
-        results[res_key] = {'pred_answer': pred_ans,
-                            'pred_score': sc,
-                            'gt_answer': gt_answer,
-                            'is_valid': is_valid}
-    save_json('result/%s_scores_final_v2.json' % model_type, results)
+    with ResultSink('result/%s_scores_final_v2.json' % model_type, as_dict=True) as sink:
+        todo = [res_key for res_key in cands if not sink.is_done(res_key)]
+        progress = ProgressReporter(len(todo))
+        for res_key in todo:
+            res_i = cands[res_key]
+            image_id = res_i['image_id']
+            question = res_i['target']
+            question_id = res_i['question_id']
+            gt_answer = mc_ctx.get_gt_answer(question_id)
+            pred_ans, scores = model.get_score(image_id, question)
+            sc = float(scores)
+            is_valid = compare_answer(pred_ans, gt_answer)
+            # if not is_valid:
+            #     continue
+            sink.add(res_key, {'pred_answer': pred_ans,
+                               'pred_score': sc,
+                               'gt_answer': gt_answer,
+                               'is_valid': is_valid})
+            progress.update()
 
 
 if __name__ == '__main__':
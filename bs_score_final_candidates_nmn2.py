@@ -1,5 +1,5 @@
-from time import time
-from util import load_json, save_json
+from util import load_json
+from bs_result_util import ResultSink, ProgressReporter
 from n2mn_wrapper import N2MNWrapper
 from w2v_answer_encoder import MultiChoiceQuestionManger
 
@@ -12,34 +12,34 @@ def compare_answer(a1, a2):
     return a1.lower().strip() == a2.lower().strip()
 
 
-def process():
+def process(chunk_size=1000):
     cands = load_results()
     model = N2MNWrapper()
     mc_ctx = MultiChoiceQuestionManger(subset='val')
 
-    results = {}
-    t = time()
-    for i, res_key in enumerate(cands):
-        if i % 100 == 0:
-            avg_time = (time() - t) / 100.
-            print('%d/%d (%0.2f sec/sample)' % (i, len(cands), avg_time))
-            t = time()
-        res_i = cands[res_key]
-        image_id = res_i['image_id']
-        question = res_i['target']
-        question_id = res_i['question_id']
-        gt_answer = mc_ctx.get_gt_answer(question_id)
-        pred_answers, scores = model.inference(image_id, [question])
-        sc = float(scores[0])
-        pred_ans = pred_answers[0]
-        is_valid = compare_answer(pred_ans, gt_answer)
-        # if not is_valid:
-        #     continue
-        results[res_key] = {'pred_answer': pred_ans,
-                            'pred_score': sc,
-                            'gt_answer': gt_answer,
-                            'is_valid': is_valid}
-    save_json('result/n2mn_scores_final_v2.json', results)
+    with ResultSink('result/n2mn_scores_final_v2.json', as_dict=True,
+                    flush_every=chunk_size) as sink:
+        res_keys = [res_key for res_key in cands if not sink.is_done(res_key)]
+        progress = ProgressReporter(len(res_keys), interval=chunk_size)
+        for start in range(0, len(res_keys), chunk_size):
+            chunk = res_keys[start:start + chunk_size]
+            image_ids = [cands[res_key]['image_id'] for res_key in chunk]
+            questions = [cands[res_key]['target'] for res_key in chunk]
+            all_pred_answers, all_scores = model.inference_batch(image_ids, questions)
+
+            for res_key, pred_ans, sc in zip(chunk, all_pred_answers, all_scores):
+                res_i = cands[res_key]
+                question_id = res_i['question_id']
+                gt_answer = mc_ctx.get_gt_answer(question_id)
+                sc = float(sc)
+                is_valid = compare_answer(pred_ans, gt_answer)
+                # if not is_valid:
+                #     continue
+                sink.add(res_key, {'pred_answer': pred_ans,
+                                   'pred_score': sc,
+                                   'gt_answer': gt_answer,
+                                   'is_valid': is_valid})
+            progress.update(len(chunk))
 
 
 if __name__ == '__main__':
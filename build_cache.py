@@ -0,0 +1,266 @@
+"""
+A small build-graph layer for the derived files under data/.
+
+A derivation declares its output files, the files it reads and the
+parameters it depends on. A manifest records, for each output path, the
+hash of the inputs and parameters it was built from, and the derivation is
+only rebuilt when an input or parameter changed, or an output went missing
+or was edited by hand. Outputs that already exist but were never recorded,
+e.g. the results of runs made before the cache existed, are adopted as they
+are. Outputs of one derivation can be inputs of the next one, which chains
+the scripts of the pipeline.
+
+The outputs are also hard linked into a content addressed store, and the
+last keep_versions versions of each derivation are kept (0 disables the
+store), so going back to inputs that were built before restores the
+outputs instead of rebuilding them.
+
+Files a build writes to resume from after a crash, e.g. the part file of a
+ResultSink, are declared as partial_outputs: they are kept when the same
+derivation is built again, and removed with the outputs when its inputs or
+parameters changed.
+"""
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+from time import time
+
+_STORE_DIR = 'data/build_store'
+_MANIFEST = 'manifest.json'
+_SECTIONS = ['outputs', 'hashes', 'store']
+_KEEP_VERSIONS = 2
+
+
+def md5_file(fpath, block_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(fpath, 'rb') as fs:
+        for block in iter(lambda: fs.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def checkpoint_files(ckpt_path):
+    """The files standing for a checkpoint in the inputs of a derivation."""
+    if os.path.exists(ckpt_path):  # v1
+        return [ckpt_path]
+    # v2, the index holds the checksums of all the tensors of the data files
+    return [ckpt_path + '.index']
+
+
+def _fingerprint(fpath):
+    st = os.stat(fpath)
+    return [st.st_size, st.st_mtime]
+
+
+def _link(src, dst):
+    dst_dir = os.path.dirname(dst)
+    if dst_dir and not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    tmp_file = '%s.%d' % (dst, os.getpid())
+    try:
+        os.link(src, tmp_file)
+    except OSError:  # the store is on another device
+        shutil.copy2(src, tmp_file)
+    os.rename(tmp_file, dst)
+
+
+class _FileLock(object):
+    def __init__(self, lock_file):
+        self._lock_file = lock_file
+        self._fs = None
+
+    def __enter__(self):
+        self._fs = open(self._lock_file, 'a')
+        fcntl.flock(self._fs, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self._fs, fcntl.LOCK_UN)
+        self._fs.close()
+
+
+class BuildCache(object):
+    def __init__(self, store_dir=_STORE_DIR, keep_versions=_KEEP_VERSIONS):
+        self._store_dir = store_dir
+        self._keep_versions = keep_versions
+        self._manifest_file = os.path.join(store_dir, _MANIFEST)
+        self._manifest = self._load_manifest()
+        # entries changed by this process, merged into the manifest on disk
+        # under the lock so that concurrent derivations don't drop each other
+        self._changes = {k: {} for k in _SECTIONS}
+
+    def _load_manifest(self):
+        manifest = {k: {} for k in _SECTIONS}
+        if os.path.exists(self._manifest_file):
+            with open(self._manifest_file, 'r') as fs:
+                manifest.update(json.load(fs))
+        return manifest
+
+    def _set(self, section, key, value):
+        # None removes the entry
+        if value is None:
+            self._manifest[section].pop(key, None)
+        else:
+            self._manifest[section][key] = value
+        self._changes[section][key] = value
+
+    def _save_manifest(self):
+        if not os.path.exists(self._store_dir):
+            os.makedirs(self._store_dir)
+        with _FileLock(self._manifest_file + '.lock'):
+            manifest = self._load_manifest()
+            for section in _SECTIONS:
+                for key, value in self._changes[section].items():
+                    if value is None:
+                        manifest[section].pop(key, None)
+                    else:
+                        manifest[section][key] = value
+            tmp_file = '%s.%d' % (self._manifest_file, os.getpid())
+            with open(tmp_file, 'w') as fs:
+                json.dump(manifest, fs, indent=1, sort_keys=True)
+            os.rename(tmp_file, self._manifest_file)
+        self._manifest = manifest
+        self._changes = {k: {} for k in _SECTIONS}
+
+    def file_hash(self, fpath):
+        """md5 of the file content, only recomputed when size or mtime changed."""
+        fpath = os.path.abspath(fpath)
+        fp = _fingerprint(fpath)
+        entry = self._manifest['hashes'].get(fpath)
+        if entry is None or entry['fingerprint'] != fp:
+            entry = {'fingerprint': fp, 'md5': md5_file(fpath)}
+            self._set('hashes', fpath, entry)
+        return entry['md5']
+
+    def derivation_key(self, name, inputs, params):
+        md5 = hashlib.md5(name)
+        for fpath in sorted(inputs):
+            md5.update('%s:%s;' % (os.path.basename(fpath), self.file_hash(fpath)))
+        md5.update(json.dumps(params, sort_keys=True))
+        return md5.hexdigest()
+
+    def _store_path(self, key, output):
+        return os.path.join(self._store_dir, key, os.path.basename(output))
+
+    def _output_entry(self, output):
+        return self._manifest['outputs'].get(os.path.abspath(output))
+
+    def _is_current(self, key, outputs):
+        for output in outputs:
+            entry = self._output_entry(output)
+            if entry is None or entry['key'] != key or not os.path.exists(output):
+                return False
+            if self.file_hash(output) != entry['md5']:
+                return False
+        return True
+
+    def _is_adoptable(self, outputs):
+        return all([os.path.exists(output) and self._output_entry(output) is None
+                    for output in outputs])
+
+    def _is_resumable(self, key, outputs):
+        # a build of the same derivation that stopped before finishing,
+        # scripts writing through a ResultSink pick it up where it stopped
+        for output in outputs:
+            entry = self._output_entry(output)
+            if entry is None or entry['key'] != key or entry['md5'] is not None:
+                return False
+        return True
+
+    def _restore(self, key, outputs):
+        entry = self._manifest['store'].get(key)
+        if entry is None:
+            return False
+        stored = [self._store_path(key, output) for output in outputs]
+        # stored files are hard links, an output edited in place changes
+        # them too
+        for fpath in stored:
+            if not os.path.exists(fpath) or \
+                    self.file_hash(fpath) != entry['md5'].get(os.path.basename(fpath)):
+                self._drop_version(key)
+                return False
+        for src, output in zip(stored, outputs):
+            _link(src, output)
+        entry = dict(entry, used=time())
+        self._set('store', key, entry)
+        return True
+
+    def _drop_version(self, key):
+        shutil.rmtree(os.path.join(self._store_dir, key), ignore_errors=True)
+        self._set('store', key, None)
+
+    def _prune_store(self, name):
+        versions = [(entry['used'], key) for key, entry in self._manifest['store'].items()
+                    if entry['name'] == name]
+        for _, key in sorted(versions, reverse=True)[self._keep_versions:]:
+            self._drop_version(key)
+
+    def _record(self, key, name, inputs, params, outputs, store=True):
+        for output in outputs:
+            self._set('outputs', os.path.abspath(output), {
+                'key': key, 'name': name, 'md5': self.file_hash(output),
+                'inputs': sorted([os.path.abspath(f) for f in inputs]),
+                'params': params})
+        if store and self._keep_versions > 0:
+            for output in outputs:
+                _link(output, self._store_path(key, output))
+            self._set('store', key, {
+                'name': name, 'used': time(),
+                'md5': {os.path.basename(f): self.file_hash(f) for f in outputs}})
+            self._prune_store(name)
+
+    def _mark_building(self, key, name, outputs):
+        for output in outputs:
+            self._set('outputs', os.path.abspath(output),
+                      {'key': key, 'name': name, 'md5': None})
+        self._save_manifest()
+
+    def derive(self, name, outputs, inputs, build_fn, params=None,
+               partial_outputs=None):
+        """
+        Makes sure outputs are the result of build_fn on inputs and params,
+        calling build_fn() only when they are not. build_fn must write all
+        the files listed in outputs. Returns True if build_fn was called.
+        """
+        params = {} if params is None else params
+        partial_outputs = [] if partial_outputs is None else partial_outputs
+        key = self.derivation_key(name, inputs, params)
+        if self._is_current(key, outputs):
+            print('[%s] up to date, skipped' % name)
+            self._save_manifest()
+            return False
+        if self._is_adoptable(outputs):
+            print('[%s] %s already exist, adopted' % (name, ', '.join(outputs)))
+            self._record(key, name, inputs, params, outputs)
+            self._save_manifest()
+            return False
+        if self._restore(key, outputs):
+            print('[%s] restored from %s' % (name, os.path.join(self._store_dir, key)))
+            self._record(key, name, inputs, params, outputs, store=False)
+            self._save_manifest()
+            return False
+        if not self._is_resumable(key, outputs):
+            # stale outputs must not pass for the result of a build that
+            # failed to write them, nor be resumed by a build on new inputs
+            for output in outputs + partial_outputs:
+                if os.path.exists(output):
+                    os.remove(output)
+        print('[%s] building %s' % (name, ', '.join(outputs)))
+        t = time()
+        self._mark_building(key, name, outputs)
+        build_fn()
+        missing = [output for output in outputs if not os.path.exists(output)]
+        if missing:
+            raise IOError('[%s] build did not write %s' % (name, ', '.join(missing)))
+        self._record(key, name, inputs, params, outputs)
+        self._save_manifest()
+        print('[%s] built in %0.1f sec' % (name, time() - t))
+        return True
+
+
+def derive(name, outputs, inputs, build_fn, params=None, store_dir=_STORE_DIR,
+           keep_versions=_KEEP_VERSIONS, partial_outputs=None):
+    cache = BuildCache(store_dir, keep_versions)
+    return cache.derive(name, outputs, inputs, build_fn, params, partial_outputs)
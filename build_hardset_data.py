@@ -3,7 +3,6 @@ import sys
 import os
 import numpy as np
 import h5py
-from nltk.tokenize import word_tokenize
 import json
 from collections import namedtuple, Counter
 import tensorflow as tf
@@ -12,6 +11,7 @@ from scipy.io import loadmat
 from datetime import datetime
 from util import load_hdf5, save_hdf5
 from word2vec_util import Word2VecEncoder
+from tokenize_util import tokenize_sentence, cached_tokenize
 from collections import defaultdict
 
 tf.flags.DEFINE_string("annotation_dir", "data/annotations",
@@ -37,6 +37,10 @@ tf.flags.DEFINE_string("word_counts_output_file", "data/%s_word_counts.txt",
                        "Output vocabulary file of word counts.")
 tf.flags.DEFINE_string("top_answer_output_file", "data/%s_top%d_answers.txt",
                        "Output vocabulary file of word counts.")
+tf.flags.DEFINE_integer("num_tokenize_workers", 8,
+                        "Number of processes used to tokenize the annotations.")
+tf.flags.DEFINE_string("token_cache_dir", "data/token_cache",
+                       "Directory caching the tokenized annotations.")
 
 FLAGS = tf.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -46,10 +50,15 @@ ImageMetadata = namedtuple("ImageMetadata",
 
 
 def _tokenize_sentence(sentence):
-    tokenized = [FLAGS.start_word]
-    tokenized.extend(word_tokenize(str(sentence).lower()))
-    tokenized.append(FLAGS.end_word)
-    return tokenized
+    return tokenize_sentence(sentence, FLAGS.start_word, FLAGS.end_word)
+
+
+def _tokenize_questions_and_answers(source_files, questions, answers, name=''):
+    tokenized = cached_tokenize(source_files, questions + answers, name,
+                                FLAGS.start_word, FLAGS.end_word,
+                                cache_dir=FLAGS.token_cache_dir,
+                                num_workers=FLAGS.num_tokenize_workers)
+    return tokenized[:len(questions)], tokenized[len(questions):]
 
 
 def _int64_feature(value):
@@ -457,12 +466,14 @@ def _load_and_process_metadata(subset):
     dataset = _read_json('data', 'hardset_dataset.json', subset)
     IMFORMAT = '%s/COCO_%s_%012d.jpg'
 
+    answers = [info['answer'] for info in dataset]
+    quest_tokens, ans_tokens = _tokenize_questions_and_answers(
+        ['data/hardset_dataset.json'], [info['question'] for info in dataset], answers,
+        name=subset)
+
     meta = []
     image2question_id = {}
-    for info in dataset:
-        ans = info['answer']
-        print(ans)
-        token_ans = _tokenize_sentence(ans)
+    for info, ans, question, token_ans in zip(dataset, answers, quest_tokens, ans_tokens):
         image_id = info['image_id']
         if image_id in image2question_id:
             image2question_id[image_id] += 1
@@ -470,7 +481,6 @@ def _load_and_process_metadata(subset):
             image2question_id[image_id] = 0
         quest_id = image_id * 100 + image2question_id[image_id]
         filename = IMFORMAT % ('val2014', 'val2014', info['image_id'])
-        question = _tokenize_sentence(info['question'])
         mc_ans = []
         meta.append(ImageMetadata(image_id, filename, quest_id, question, ans, token_ans, mc_ans))
     tf.logging.info('Time %0.2f sec.' % (time() - t))
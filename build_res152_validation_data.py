@@ -1,22 +1,24 @@
 import os
 import numpy as np
 from util import load_hdf5, save_hdf5
+from build_cache import derive
 
+_SEED_FILE = 'data/capt1k_std_mscoco_val.data'
+_FEAT_FILE = '/import/vision-ephemeral/fl302/code/text-to-image/mscoco_res152_%s.h5'
+_SETS = ['val', 'test', 'restval']
+_DATA_FILE = 'data/res152_std_mscoco_%s.data' % 'val'
 
 
 def get_image_ids():
-    seed_path = 'data/capt1k_std_mscoco_val.data'
-    d = load_hdf5(seed_path)
+    d = load_hdf5(_SEED_FILE)
     return d['image_ids']
 
 
 def load_res152_feature():
-    sets = ['val', 'test', 'restval']
-    fdir = '/import/vision-ephemeral/fl302/code/text-to-image/'
     feats = []
     image_ids = []
-    for subset in sets:
-        d = load_hdf5(os.path.join(fdir, 'mscoco_res152_%s.h5' % subset))
+    for subset in _SETS:
+        d = load_hdf5(_FEAT_FILE % subset)
         image_ids.append(d['image_ids'].flatten())
         feats.append(d['features'])
     feats = np.concatenate(feats)
@@ -26,9 +28,8 @@ def load_res152_feature():
     vertify_image_ids(image_ids)
 
     # save
-    data_file = 'data/res152_std_mscoco_%s.data' % 'val'
-    save_hdf5(data_file, {'att_arr': feats.astype(np.float32),
-                          'image_ids': np.array(image_ids, dtype=np.int32)})
+    save_hdf5(_DATA_FILE, {'att_arr': feats.astype(np.float32),
+                           'image_ids': np.array(image_ids, dtype=np.int32)})
 
 
 def vertify_image_ids(image_ids):
@@ -44,5 +45,7 @@ def vertify_image_ids(image_ids):
 
 
 if __name__ == '__main__':
-    load_res152_feature()
+    derive('build_res152_validation_data', [_DATA_FILE],
+           [_SEED_FILE] + [_FEAT_FILE % subset for subset in _SETS],
+           load_res152_feature)
 
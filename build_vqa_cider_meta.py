@@ -3,6 +3,7 @@ import cPickle
 from collections import defaultdict
 from extract_vqa_question_ngram_data import load_and_process_metadata, split_data_by_seed
 from nltk.tokenize import word_tokenize
+from build_cache import derive
 
 _ADD_END = True
 _END_TOKEN = '</S>'
@@ -121,24 +122,38 @@ def get_document_stastic(meta, vocab):
     return ngram_words, ngram_idxs
 
 
-def _process_subset(meta, subset):
-    images = split_data_by_seed(meta, subset)
-    vocab = _load_vocab('data/vqa_trainval_question_word_counts.txt')
-
-    ngram_words, ngram_idxs = get_document_stastic(images, vocab)
-
+def _process_subset(load_meta, subset):
     end_suffix = '_end' if _ADD_END else ''
     word_file = 'data/cider/vqa_%s_words%s.p' % (subset, end_suffix)
-    cPickle.dump(ngram_words, open(word_file, 'w'),
-                 protocol=cPickle.HIGHEST_PROTOCOL)
     idx_file = 'data/cider/vqa_%s_idxs%s.p' % (subset, end_suffix)
-    cPickle.dump(ngram_idxs, open(idx_file, 'w'),
-                 protocol=cPickle.HIGHEST_PROTOCOL)
+    vocab_file = 'data/vqa_trainval_question_word_counts.txt'
+    split_file = 'data/vqa_std_mscoco_%s.meta' % subset
+
+    def _build():
+        images = split_data_by_seed(load_meta(), subset)
+        vocab = _load_vocab(vocab_file)
+
+        ngram_words, ngram_idxs = get_document_stastic(images, vocab)
+
+        with open(word_file, 'wb') as fs:
+            cPickle.dump(ngram_words, fs, protocol=cPickle.HIGHEST_PROTOCOL)
+        with open(idx_file, 'wb') as fs:
+            cPickle.dump(ngram_idxs, fs, protocol=cPickle.HIGHEST_PROTOCOL)
+
+    derive('build_vqa_cider_meta.%s' % subset, [word_file, idx_file],
+           [vocab_file, split_file], _build,
+           params={'add_end': _ADD_END, 'end_token': _END_TOKEN})
 
 
 if __name__ == '__main__':
-    train = load_and_process_metadata('train')
-    val = load_and_process_metadata('val')
-    meta = train + val
-    _process_subset(meta, 'kptrain')
-    _process_subset(meta, 'kprestval')
+    meta = []
+
+    def load_meta():
+        # annotations are only parsed if a subset needs rebuilding
+        if not meta:
+            meta.extend(load_and_process_metadata('train') +
+                        load_and_process_metadata('val'))
+        return meta
+
+    _process_subset(load_meta, 'kptrain')
+    _process_subset(load_meta, 'kprestval')
@@ -3,7 +3,6 @@ import sys
 import os
 import numpy as np
 import h5py
-from nltk.tokenize import word_tokenize
 import json
 from collections import namedtuple, Counter
 import tensorflow as tf
@@ -12,6 +11,8 @@ from scipy.io import loadmat
 from datetime import datetime
 from util import load_hdf5, save_hdf5
 from word2vec_util import Word2VecEncoder
+from tokenize_util import tokenize_sentence, cached_tokenize, encode_tokens
+from build_cache import derive
 from collections import defaultdict
 
 tf.flags.DEFINE_string("annotation_dir", "data/annotations",
@@ -37,6 +38,10 @@ tf.flags.DEFINE_string("word_counts_output_file", "data/%s_word_counts.txt",
                        "Output vocabulary file of word counts.")
 tf.flags.DEFINE_string("top_answer_output_file", "data/%s_top%d_answers.txt",
                        "Output vocabulary file of word counts.")
+tf.flags.DEFINE_integer("num_tokenize_workers", 8,
+                        "Number of processes used to tokenize the annotations.")
+tf.flags.DEFINE_string("token_cache_dir", "data/token_cache",
+                       "Directory caching the tokenized annotations.")
 
 FLAGS = tf.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -46,10 +51,15 @@ ImageMetadata = namedtuple("ImageMetadata",
 
 
 def _tokenize_sentence(sentence):
-    tokenized = [FLAGS.start_word]
-    tokenized.extend(word_tokenize(str(sentence).lower()))
-    tokenized.append(FLAGS.end_word)
-    return tokenized
+    return tokenize_sentence(sentence, FLAGS.start_word, FLAGS.end_word)
+
+
+def _tokenize_questions_and_answers(source_files, questions, answers, name=''):
+    tokenized = cached_tokenize(source_files, questions + answers, name,
+                                FLAGS.start_word, FLAGS.end_word,
+                                cache_dir=FLAGS.token_cache_dir,
+                                num_workers=FLAGS.num_tokenize_workers)
+    return tokenized[:len(questions)], tokenized[len(questions):]
 
 
 def _int64_feature(value):
@@ -93,6 +103,11 @@ class VQADataEncoder(object):
             res.append(data)
         return res
 
+    def encode_batch(self, images):
+        """Encodes all images at once, None if an encoder can't do so."""
+        res = [enc.encode_batch(images) for enc in self._encoders]
+        return None if any([data is None for data in res]) else res
+
     def finalize(self):
         print('\n')
         for enc in self._encoders:
@@ -116,6 +131,9 @@ class Encoder(object):
     def encode(self, image):
         pass
 
+    def encode_batch(self, images):
+        return None
+
     @property
     def target(self):
         return self._target
@@ -319,6 +337,10 @@ class QuestionEncoder(Encoder):
         ids = [self._vocab.word_to_id(word) for word in image.question]
         return ids
 
+    def encode_batch(self, images):
+        return encode_tokens([image.question for image in images],
+                             self._vocab.word_to_id)
+
 
 class AnswerEncoder(Encoder):
     def __init__(self, coding, vocab_file=None):
@@ -365,6 +387,12 @@ class AnswerEncoder(Encoder):
         else:
             raise Exception('unknown coding')
 
+    def encode_batch(self, images):
+        if self._coding != 'one_hot':
+            return None
+        return np.array([self.encode_one_hot(image.answer) for image in images],
+                        dtype=np.int32)
+
 
 def create_sample_encoder(trainset='trainval'):
     encoder = VQADataEncoder()
@@ -457,18 +485,23 @@ def _load_and_process_metadata(subset):
     datatype = 'test2015' if is_test else subtype
     IMFORMAT = '%s/COCO_%s_%012d.jpg'
     # tf.logging.info('Loading annotations and questions...')
-    questions = _read_json(ann_root, 'MultipleChoice_mscoco_%s_questions.json' % subtype, 'questions')
+    quest_file = 'MultipleChoice_mscoco_%s_questions.json' % subtype
+    ann_file = quest_file if is_test else 'mscoco_%s_annotations.json' % subtype
+    questions = _read_json(ann_root, quest_file, 'questions')
     dataset = questions if is_test \
-        else _read_json(ann_root, 'mscoco_%s_annotations.json' % subtype, 'annotations')
+        else _read_json(ann_root, ann_file, 'annotations')
+
+    answers = [None if is_test else info['multiple_choice_answer'] for info in dataset]
+    source_files = set([os.path.join(ann_root, f) for f in [quest_file, ann_file]])
+    quest_tokens, ans_tokens = _tokenize_questions_and_answers(
+        source_files, [quest['question'] for quest in questions], answers)
 
     meta = []
-    for info, quest in zip(dataset, questions):
-        ans = None if is_test else info['multiple_choice_answer']
-        token_ans = None if is_test else _tokenize_sentence(ans)
+    for info, quest, ans, question, token_ans in zip(dataset, questions, answers,
+                                                     quest_tokens, ans_tokens):
         quest_id = info['question_id']
         image_id = info['image_id']
         filename = IMFORMAT % (datatype, datatype, info['image_id'])
-        question = _tokenize_sentence(quest['question'])
         mc_ans = quest['multiple_choices']
         meta.append(ImageMetadata(image_id, filename, quest_id, question, ans, token_ans, mc_ans))
     tf.logging.info('Time %0.2f sec.' % (time() - t))
@@ -486,9 +519,11 @@ def _load_and_process_metadata_v2(subset):
     datatype = 'test2015' if is_test else subtype
     IMFORMAT = '%s/COCO_%s_%012d.jpg'
     # tf.logging.info('Loading annotations and questions...')
-    questions = _read_json(ann_root, 'v2_OpenEnded_mscoco_%s_questions.json' % subtype, 'questions')
+    quest_file = 'v2_OpenEnded_mscoco_%s_questions.json' % subtype
+    ann_file = quest_file if is_test else 'v2_mscoco_%s_annotations.json' % subtype
+    questions = _read_json(ann_root, quest_file, 'questions')
     dataset = questions if is_test \
-        else _read_json(ann_root, 'v2_mscoco_%s_annotations.json' % subtype, 'annotations')
+        else _read_json(ann_root, ann_file, 'annotations')
 
     def prepare_complementary_pairs():
         pairs = _read_json(ann_root, 'v2_mscoco_%s_complementary_pairs.json' % subtype)
@@ -508,14 +543,16 @@ def _load_and_process_metadata_v2(subset):
         else:
             return None
 
+    answers = [None if is_test else info['multiple_choice_answer'] for info in dataset]
+    source_files = set([os.path.join(ann_root, f) for f in [quest_file, ann_file]])
+    quest_tokens, ans_tokens = _tokenize_questions_and_answers(
+        source_files, [quest['question'] for quest in questions], answers)
+
     meta = []
-    for info, quest in zip(dataset, questions):
-        ans = None if is_test else info['multiple_choice_answer']
-        token_ans = None if is_test else _tokenize_sentence(ans)
+    for info, ans, question, token_ans in zip(dataset, answers, quest_tokens, ans_tokens):
         quest_id = info['question_id']
         image_id = info['image_id']
         filename = IMFORMAT % (datatype, datatype, info['image_id'])
-        question = _tokenize_sentence(quest['question'])
         # mc_ans = quest['multiple_choices']
         counter_example = find_counter_example(quest_id)
         meta.append(ImageMetadata(image_id, filename, quest_id, question, ans, token_ans, counter_example))
@@ -603,19 +640,12 @@ def _create_answer_vocab(images, trainset):
     return _create_vocab(answers, 'vqa_%s_answer' % trainset)
 
 
-def _process_dataset(subset, images, encoder):
-    meta_filename = os.path.join(FLAGS.output_dir, 'vqa_std_mscoco_%s.meta' % subset)
-    data_filename = os.path.join(FLAGS.output_dir, 'vqa_std_mscoco_%s.data' % subset)
-
+def _encode_one_by_one(images, encoder):
     num_images = len(images)
     quests = []
     labels = []
-    image_names = []
-    quest_ids = []
     for i in range(num_images):
         image = images[i]
-        image_names.append(image.filename)
-        quest_ids.append(image.question_id)
         res = encoder.encode(image)
         if res is None:
             continue
@@ -637,6 +667,33 @@ def _process_dataset(subset, images, encoder):
         x[:quest_len[i]] = quests[i]
     quest_len = np.array(quest_len, dtype=np.int32)
     answer_arr = np.array(labels, dtype=np.int32)
+    return quest_arr, quest_len, answer_arr
+
+
+def _encode_batch(images, encoder):
+    res = encoder.encode_batch(images)
+    if res is None:
+        return None
+    (quest_arr, quest_len), answer_arr = res
+    # remove start and end word
+    quest_len = quest_len - 2
+    quest_arr = quest_arr[:, 1:]
+    quest_arr[np.arange(quest_len.size), quest_len] = 0
+    quest_arr = quest_arr[:, :quest_len.max()]
+    return quest_arr, quest_len, answer_arr
+
+
+def _process_dataset(subset, images, encoder):
+    meta_filename = os.path.join(FLAGS.output_dir, 'vqa_std_mscoco_%s.meta' % subset)
+    data_filename = os.path.join(FLAGS.output_dir, 'vqa_std_mscoco_%s.data' % subset)
+
+    num_images = len(images)
+    image_names = [image.filename for image in images]
+    quest_ids = [image.question_id for image in images]
+    res = _encode_batch(images, encoder)
+    if res is None:  # some encoder works per image only
+        res = _encode_one_by_one(images, encoder)
+    quest_arr, quest_len, answer_arr = res
     # save data file
     save_hdf5(data_filename, {'quest_arr': quest_arr,
                               'quest_len': quest_len,
@@ -762,11 +819,24 @@ def get_document_stastic(meta, vocab):
 
 def main(_):
     subset = 'val'
+    trainset = 'trainval'
     # train = _load_and_process_metadata_v2('train')
-    val = _load_and_process_metadata('val')
-    encoder = create_sample_encoder('trainval')
-    tf.logging.info('converting subset set %s' % subset.upper())
-    _process_dataset(subset, val, encoder)
+    ann_files = [os.path.join(FLAGS.annotation_dir, f) for f in
+                 ['MultipleChoice_mscoco_%s2014_questions.json' % subset,
+                  'mscoco_%s2014_annotations.json' % subset]]
+    vocab_files = [FLAGS.word_counts_output_file % ('vqa_%s_question' % trainset),
+                   FLAGS.top_answer_output_file % ('vqa_%s' % trainset, FLAGS.num_top_answers)]
+    outputs = [os.path.join(FLAGS.output_dir, 'vqa_std_mscoco_%s.%s' % (subset, ext))
+               for ext in ['data', 'meta']]
+
+    def _build():
+        val = _load_and_process_metadata(subset)
+        encoder = create_sample_encoder(trainset)
+        tf.logging.info('converting subset set %s' % subset.upper())
+        _process_dataset(subset, val, encoder)
+
+    derive('build_vqa_standard_data.%s' % subset, outputs, ann_files + vocab_files,
+           _build, params={'start_word': FLAGS.start_word, 'end_word': FLAGS.end_word})
 
 
 
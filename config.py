@@ -106,6 +106,9 @@ class TrainConfig(object):
         # self.initial_learning_rate = 0.0001
         self.max_checkpoints_to_keep = 3
         self.optimizer = 'Adam'
+        # batches of questions sampled at most per RL step to replace
+        # the duplicate questions of the first one
+        self.max_sampling_rounds = 2
         # self.optimizer = 'SGD'
 
 
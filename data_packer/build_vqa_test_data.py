@@ -3,7 +3,6 @@ import sys
 import os
 import numpy as np
 import h5py
-from nltk.tokenize import word_tokenize
 import json
 from collections import namedtuple, Counter
 import tensorflow as tf
@@ -12,6 +11,7 @@ from scipy.io import loadmat
 from datetime import datetime
 from util import load_hdf5, save_hdf5
 from word2vec_util import Word2VecEncoder
+from tokenize_util import tokenize_sentence, cached_tokenize
 
 tf.flags.DEFINE_string("annotation_dir", "data/annotations",
                        "Directory containing all annotation files.")
@@ -36,6 +36,10 @@ tf.flags.DEFINE_string("word_counts_output_file", "data/%s_word_counts.txt",
                        "Output vocabulary file of word counts.")
 tf.flags.DEFINE_string("top_answer_output_file", "data/%s_top%d_answers.txt",
                        "Output vocabulary file of word counts.")
+tf.flags.DEFINE_integer("num_tokenize_workers", 8,
+                        "Number of processes used to tokenize the annotations.")
+tf.flags.DEFINE_string("token_cache_dir", "data/token_cache",
+                       "Directory caching the tokenized annotations.")
 
 FLAGS = tf.flags.FLAGS
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -45,10 +49,15 @@ ImageMetadata = namedtuple("ImageMetadata",
 
 
 def _tokenize_sentence(sentence):
-    tokenized = [FLAGS.start_word]
-    tokenized.extend(word_tokenize(str(sentence).lower()))
-    tokenized.append(FLAGS.end_word)
-    return tokenized
+    return tokenize_sentence(sentence, FLAGS.start_word, FLAGS.end_word)
+
+
+def _tokenize_questions_and_answers(source_files, questions, answers, name=''):
+    tokenized = cached_tokenize(source_files, questions + answers, name,
+                                FLAGS.start_word, FLAGS.end_word,
+                                cache_dir=FLAGS.token_cache_dir,
+                                num_workers=FLAGS.num_tokenize_workers)
+    return tokenized[:len(questions)], tokenized[len(questions):]
 
 
 def _int64_feature(value):
@@ -446,18 +455,23 @@ def _load_and_process_metadata(subset):
     datatype = 'test2015' if is_test else subtype
     IMFORMAT = '%s/COCO_%s_%012d.jpg'
     # tf.logging.info('Loading annotations and questions...')
-    questions = _read_json(ann_root, 'MultipleChoice_mscoco_%s_questions.json' % subtype, 'questions')
+    quest_file = 'MultipleChoice_mscoco_%s_questions.json' % subtype
+    ann_file = quest_file if is_test else 'mscoco_%s_annotations.json' % subtype
+    questions = _read_json(ann_root, quest_file, 'questions')
     dataset = questions if is_test \
-        else _read_json(ann_root, 'mscoco_%s_annotations.json' % subtype, 'annotations')
+        else _read_json(ann_root, ann_file, 'annotations')
+
+    answers = [None if is_test else info['multiple_choice_answer'] for info in dataset]
+    source_files = set([os.path.join(ann_root, f) for f in [quest_file, ann_file]])
+    quest_tokens, ans_tokens = _tokenize_questions_and_answers(
+        source_files, [quest['question'] for quest in questions], answers)
 
     meta = []
-    for info, quest in zip(dataset, questions):
-        ans = None if is_test else info['multiple_choice_answer']
-        token_ans = None if is_test else _tokenize_sentence(ans)
+    for info, quest, ans, question, token_ans in zip(dataset, questions, answers,
+                                                     quest_tokens, ans_tokens):
         quest_id = info['question_id']
         image_id = info['image_id']
         filename = IMFORMAT % (datatype, datatype, info['image_id'])
-        question = _tokenize_sentence(quest['question'])
         mc_ans = quest['multiple_choices']
         meta.append(ImageMetadata(image_id, filename, quest_id, question, ans, token_ans, mc_ans))
     tf.logging.info('Time %0.2f sec.' % (time() - t))
@@ -217,7 +217,15 @@ def dump_results(results, res_file):
     save_json(dump_file, score_list)
 
 
-def evaluate_oracle(res_file, K=None, eval_multiple=False, split='val'):
+def create_evaluator(gt, res, num_workers=0):
+    if num_workers > 0:
+        from sharded_caption_eval import ShardedCOCOEvalCap
+        return ShardedCOCOEvalCap(gt, res, num_workers=num_workers)
+    return COCOEvalCap(gt, res)
+
+
+def evaluate_oracle(res_file, K=None, eval_multiple=False, split='val',
+                    num_workers=0):
     def parse_evaluator_scores(_evaluator):
         metrics = ['Bleu_4', 'CIDEr']
         scores = np.array([_evaluator.eval[m] for m in metrics])
@@ -234,7 +242,7 @@ def evaluate_oracle(res_file, K=None, eval_multiple=False, split='val'):
     gt.replicate_annotations(quest_ids)
 
     # average test
-    evaluator = COCOEvalCap(gt, res)
+    evaluator = create_evaluator(gt, res, num_workers)
     evaluator.setup_scorer(['Bleu', 'CIDEr'])
     evaluator.evaluate()
     results = evaluator.evalImgs
@@ -250,7 +258,7 @@ def evaluate_oracle(res_file, K=None, eval_multiple=False, split='val'):
     gt_ = VQAAnnotation(anno_file)
     gt_.replicate_annotations(flt_res.image_ids)
 
-    evaluator = COCOEvalCap(gt_, flt_res)
+    evaluator = create_evaluator(gt_, flt_res, num_workers)
     evaluator.setup_scorer(['Bleu', 'CIDEr'])
     evaluator.evaluate()
     oracle_scores = parse_evaluator_scores(evaluator)
@@ -1,5 +1,5 @@
 from config import ModelConfig, VOCAB_CONFIG
-from post_process_variation_questions import put_to_array
+from post_process_variation_questions import PaddedBatchBuilder
 import numpy as np
 
 END_TOKEN = VOCAB_CONFIG.end_token_id
@@ -35,6 +35,8 @@ class ReplayBuffer(object):
                           dtype=np.float32)
         labels[:self.num_pos_in_batch] = 1.0
         self.labels = labels
+        self._real_builder = PaddedBatchBuilder(self.pad_token)
+        self._fake_builder = PaddedBatchBuilder(self.pad_token)
 
     def _init_exemplars(self, subset):
         from util import load_hdf5
@@ -63,8 +65,8 @@ class ReplayBuffer(object):
     def get_batch(self):
         # random sample #bs positive
         real_pathes = self.random_pick_from_set(self.pos_data, self.num_pos_in_batch)
-        real_arr, real_arr_len = put_to_array(real_pathes, pad_token=self.pad_token,
-                                              max_length=20)
+        real_arr, real_arr_len = self._real_builder.from_lists(real_pathes,
+                                                               max_length=20)
         # random sample from other negatives
         fake_pathes = []
         num_in_policy = min(len(self.policy_neg_data), self.neg_in_policy)
@@ -74,8 +76,8 @@ class ReplayBuffer(object):
         num_in_init = max(self.neg_in_init, self.num_neg_in_batch-num_in_policy)
         # print('Samping %d from Neg Init' % num_in_init)
         fake_pathes += self.random_pick_from_set(self.init_neg_data, num_in_init)
-        fake_arr, fake_arr_len = put_to_array(fake_pathes, pad_token=self.pad_token,
-                                              max_length=20)
+        fake_arr, fake_arr_len = self._fake_builder.from_lists(fake_pathes,
+                                                               max_length=20)
         return [fake_arr, fake_arr_len, real_arr, real_arr_len]
 
     @staticmethod
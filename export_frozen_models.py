@@ -0,0 +1,111 @@
+"""
+Export the VQA scoring models as frozen inference graphs, and compare the
+startup time of their wrappers built from the checkpoint and from the
+frozen graph.
+
+    python export_frozen_models.py --model_names=attention_broadcast,vanilla
+    python export_frozen_models.py --benchmark
+
+The MCB model is a Caffe net, and N2MNWrapper assembles its network in
+Python between two partial runs, so neither has a standalone graph to
+export.
+"""
+import os
+from time import time
+import tensorflow as tf
+from frozen_graph_util import freeze_model
+
+tf.flags.DEFINE_string("model_names", "attention_broadcast,vanilla",
+                       "Comma separated models to export.")
+tf.flags.DEFINE_string("output_dir", "model/frozen",
+                       "Directory of the frozen graphs.")
+tf.flags.DEFINE_boolean("benchmark", False,
+                        "Measure the startup time of the wrappers instead.")
+FLAGS = tf.flags.FLAGS
+
+_ATT_CKPT = 'model/v1_vqa_VQA/v1_vqa_VQA_best2/model.ckpt-135000'
+_VANILLA_CKPT = 'model/kprestval_VQA-BaseNorm/model.ckpt-26000'
+
+
+def _build_attention_broadcast():
+    from models.vqa_soft_attention import AttentionModel
+    from vqa_config import ModelConfig
+    model = AttentionModel(ModelConfig(), phase='test_broadcast')
+    model.build()
+    return model
+
+
+def _build_vanilla():
+    from models.vqa_base import BaseModel
+    from vqa_config import ModelConfig
+    model = BaseModel(ModelConfig(), phase='test')
+    model.build()
+    return model
+
+
+# name: (build function, checkpoint), used by AttentionVQARewards and
+# vqa_interactive_ui.AttentionModel, and VQARewards and VanillaModel
+_MODELS = {'attention_broadcast': (_build_attention_broadcast, _ATT_CKPT),
+           'vanilla': (_build_vanilla, _VANILLA_CKPT)}
+
+
+def frozen_file(name):
+    return os.path.join(FLAGS.output_dir, '%s.pb' % name)
+
+
+def export_models(names):
+    if not tf.gfile.IsDirectory(FLAGS.output_dir):
+        tf.gfile.MakeDirs(FLAGS.output_dir)
+    for name in names:
+        build_fn, ckpt_file = _MODELS[name]
+        freeze_model(build_fn, ckpt_file, frozen_file(name))
+
+
+def _time_startup(create_fn):
+    t = time()
+    wrapper = create_fn()
+    elapsed = time() - t
+    num_nodes = len(wrapper.g.as_graph_def().node)
+    wrapper.sess.close()
+    return elapsed, num_nodes
+
+
+def benchmark_startup():
+    from var_ivqa_rewards import AttentionVQARewards, VQARewards
+    from vqa_interactive_ui import AttentionModel, VanillaModel
+    att_file = frozen_file('attention_broadcast')
+    vanilla_file = frozen_file('vanilla')
+    wrappers = [
+        ('AttentionVQARewards',
+         lambda: AttentionVQARewards(_ATT_CKPT),
+         lambda: AttentionVQARewards(_ATT_CKPT, frozen_file=att_file)),
+        ('VQARewards',
+         lambda: VQARewards(_VANILLA_CKPT),
+         lambda: VQARewards(_VANILLA_CKPT, frozen_file=vanilla_file)),
+        ('AttentionModel',
+         lambda: AttentionModel(_ATT_CKPT),
+         lambda: AttentionModel(_ATT_CKPT, frozen_file=att_file)),
+        # both include loading the image features cache
+        ('VanillaModel',
+         lambda: VanillaModel(_VANILLA_CKPT),
+         lambda: VanillaModel(_VANILLA_CKPT, frozen_file=vanilla_file))]
+    lines = ['%-20s%14s%14s%12s%12s' % ('wrapper', 'ckpt (sec)', 'frozen (sec)',
+                                        'ckpt nodes', 'frozen nodes')]
+    for name, from_ckpt, from_frozen in wrappers:
+        t_ckpt, n_ckpt = _time_startup(from_ckpt)
+        t_frozen, n_frozen = _time_startup(from_frozen)
+        lines.append('%-20s%14.2f%14.2f%12d%12d' % (name, t_ckpt, t_frozen,
+                                                    n_ckpt, n_frozen))
+    print('\n'.join(lines))
+
+
+def main(_):
+    if FLAGS.benchmark:
+        benchmark_startup()
+    else:
+        export_models(FLAGS.model_names.split(','))
+
+
+if __name__ == '__main__':
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
@@ -25,15 +25,14 @@ def process_dataset(mc, subset):
     print('Processing %s' % subset)
     quest_ids = load_dataset(subset)
     im_encoder = FeatureEncoder(subset)
-    answer_enc = []
+    answers = [mc.get_gt_answer(quest_id) for quest_id in quest_ids]
+    answer_enc = mc.encoder.encode_by_answer(answers)
     image_enc = []
     for quest_id in quest_ids:
-        _, w2v = mc.get_gt_answer_and_word2vec(quest_id)
-        answer_enc.append(w2v)
         im_feat = im_encoder.get_feature(mc.get_image_id(quest_id))
         image_enc.append(im_feat[np.newaxis, :])
     quest_ids = np.array(quest_ids, dtype=np.int32)
-    answer_enc = np.concatenate(answer_enc, axis=0).astype(np.float32)
+    answer_enc = answer_enc.astype(np.float32)
     image_enc = np.concatenate(image_enc, axis=0).astype(np.float32)
     save_hdf5('data/image_answer_coding_%s.h5' % subset, {'quest_ids': quest_ids,
                                                           'answer_enc': answer_enc,
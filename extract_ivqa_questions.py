@@ -8,6 +8,7 @@ from models.model_creater import get_model_creation_fn
 from config import ModelConfig, VOCAB_CONFIG
 from inference_utils.question_generator_util import SentenceGenerator
 from restorer import Restorer
+from watch_model import checkpoint_file_name, eval_session_config
 from eval_vqa_question_oracle import evaluate_oracle
 import pdb
 
@@ -32,6 +33,9 @@ tf.flags.DEFINE_string("checkpoint_dir", "model/%s_var_ivqa_restval_%s",
                        "Directory for saving and loading model checkpoints.")
 tf.flags.DEFINE_boolean("use_var", True,
                         "Use variational VQA or VQA.")
+tf.flags.DEFINE_integer("eval_workers", 4,
+                        "Processes computing BLEU, ROUGE_L and CIDEr over shards of "
+                        "the questions, 0 for a single process also reporting METEOR.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -67,7 +71,8 @@ def convert_to_unique_questions(scores, pathes):
     return post_process_prediction(scores, pathes[:, 1:])
 
 
-def evaluate_question(result_file, subset='kpval', version='v1'):
+def evaluate_question(result_file, subset='kpval', version='v1',
+                      num_workers=FLAGS.eval_workers):
     from analysis.eval_vqa_question import QuestionEvaluator
     from util import get_dataset_root
     vqa_data_root, _ = get_dataset_root()
@@ -83,7 +88,7 @@ def evaluate_question(result_file, subset='kpval', version='v1'):
     else:
         raise Exception('unknown version, v1 or v2')
 
-    evaluator = QuestionEvaluator(annotation_file, question_file)
+    evaluator = QuestionEvaluator(annotation_file, question_file, num_workers)
     evaluator.evaluate(result_file)
     evaluator.save_results()
     # return evaluator.get_overall_blue4()
@@ -139,6 +144,8 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
     model_config = ModelConfig()
     _model_suffix = 'var_' if FLAGS.use_var else ''
     res_file = 'data4/%sivqa_%s_questions.json' % (_model_suffix, FLAGS.subset)
+    token_file = 'data4/%sivqa_%s_question_tokens.data' % (_model_suffix,
+                                                         FLAGS.subset)
     # Get model
     model_fn = get_model_creation_fn(FLAGS.model_type)
     create_fn = create_reader('VAQ-Var', phase='test')
@@ -159,6 +166,10 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
         # ckpt_dir = '/import/vision-ephemeral/fl302/models/v2_kpvaq_VAQ-RL/'
         ckpt = tf.train.get_checkpoint_state(ckpt_dir)
         checkpoint_path = ckpt.model_checkpoint_path
+    else:
+        # checkpoints of the watcher may be evaluated in parallel
+        res_file = checkpoint_file_name(res_file, checkpoint_path)
+        token_file = checkpoint_file_name(token_file, checkpoint_path)
 
     mode = 'sampling' if FLAGS.use_var else 'beam'
 
@@ -170,7 +181,7 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
         model.build()
         # Restore from checkpoint
         restorer = Restorer(g)
-        sess = tf.Session()
+        sess = tf.Session(config=eval_session_config())
         restorer.restore(sess, checkpoint_path)
 
     num_batches = reader.num_batches
@@ -193,6 +204,7 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
         _this_batch_size = quest_ids.shape[0]
         num_sampled = int(len(pathes) / _this_batch_size)
         _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
+        batch_results, batch_questions = [], []
         for _s_id in range(_this_batch_size):
             _index = _noise_offset + _s_id
             try:
@@ -207,20 +219,25 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
             image_id = image_ids[_s_id]
 
             for _pid, path in enumerate(cur_pathes):
-                sentence = to_sentence.index_to_question(path)
                 extended_question_ids.append([question_id, _pid])
                 aug_quest_id = question_id * 1000 + _pid
                 res_i = {'image_id': int(image_id),
-                         'question_id': aug_quest_id,
-                         'question': sentence}
-                results.append(res_i)
-            extend_questions += cur_pathes
+                         'question_id': aug_quest_id}
+                batch_results.append(res_i)
+            batch_questions += cur_pathes
+
+        # decode the questions of the whole batch at once
+        quest_arr, quest_len = put_to_array(batch_questions)
+        sentences = to_sentence.index_to_questions(quest_arr, quest_len)
+        for res_i, sentence in zip(batch_results, sentences):
+            res_i['question'] = sentence
+        results += batch_results
+        extend_questions += batch_questions
 
     save_json(res_file, results)
     ext_quest_arr, ext_quest_len = put_to_array(extend_questions)
     ext_quest_ids = np.array(extended_question_ids, dtype=np.int32)
-    save_hdf5('data4/%sivqa_%s_question_tokens.data' % (_model_suffix,
-                                                        FLAGS.subset),
+    save_hdf5(token_file,
               {'ext_quest_arr': ext_quest_arr,
                'ext_quest_len': ext_quest_len,
                'ext_quest_ids': ext_quest_ids})
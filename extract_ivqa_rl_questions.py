@@ -193,6 +193,7 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
         _this_batch_size = quest_ids.shape[0]
         num_sampled = int(len(pathes) / _this_batch_size)
         _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
+        batch_results, batch_questions = [], []
         for _s_id in range(_this_batch_size):
             _index = _noise_offset + _s_id
             try:
@@ -207,14 +208,20 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset=FLAGS.subset):
             image_id = image_ids[_s_id]
 
             for _pid, path in enumerate(cur_pathes):
-                sentence = to_sentence.index_to_question(path)
                 extended_question_ids.append([question_id, _pid])
                 aug_quest_id = question_id * 1000 + _pid
                 res_i = {'image_id': int(image_id),
-                         'question_id': aug_quest_id,
-                         'question': sentence}
-                results.append(res_i)
-            extend_questions += cur_pathes
+                         'question_id': aug_quest_id}
+                batch_results.append(res_i)
+            batch_questions += cur_pathes
+
+        # decode the questions of the whole batch at once
+        quest_arr, quest_len = put_to_array(batch_questions)
+        sentences = to_sentence.index_to_questions(quest_arr, quest_len)
+        for res_i, sentence in zip(batch_results, sentences):
+            res_i['question'] = sentence
+        results += batch_results
+        extend_questions += batch_questions
 
     save_json(res_file, results)
     ext_quest_arr, ext_quest_len = put_to_array(extend_questions)
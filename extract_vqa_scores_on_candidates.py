@@ -27,6 +27,9 @@ tf.flags.DEFINE_string("result_format", "result/%s_vqa_OpenEnded_mscoco_%s2015_b
                        "of image files.")
 tf.flags.DEFINE_boolean("use_var", True,
                         "Use variational VQA or VQA.")
+tf.flags.DEFINE_integer("num_prefetch_workers", 2,
+                        "Threads loading the next test batches, 0 to load them "
+                        "synchronously.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -44,7 +47,8 @@ def test(checkpoint_path=None):
                               subset=FLAGS.testset,
                               feat_type=config.feat_type,
                               version=FLAGS.version,
-                              var_suffix=_model_suffix)
+                              var_suffix=_model_suffix,
+                              num_workers=FLAGS.num_prefetch_workers)
     if checkpoint_path is None:
         ckpt = tf.train.get_checkpoint_state(FLAGS.checkpoint_dir % (FLAGS.version,
                                                                      FLAGS.model_type))
@@ -92,6 +96,7 @@ def test(checkpoint_path=None):
         ans_scores.append(top_scores)
         quest_id = outputs[-2]
         quest_ids.append(quest_id)
+    reader.stop()
 
     quest_ids = np.concatenate(quest_ids)
     ans_ids = np.concatenate(ans_ids)
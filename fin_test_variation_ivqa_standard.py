@@ -8,6 +8,7 @@ from models.model_creater import get_model_creation_fn
 from config import ModelConfig, VOCAB_CONFIG
 from inference_utils.question_generator_util import SentenceGenerator
 from restorer import Restorer
+from watch_model import checkpoint_file_name, eval_session_config
 from eval_vqa_question_oracle import evaluate_oracle
 from post_process_variation_questions import post_process_variation_questions_with_count
 import pdb
@@ -28,12 +29,16 @@ tf.flags.DEFINE_string("test_version", "v1",
                        "for VQA 2.0.")
 tf.flags.DEFINE_string("checkpoint_dir", "model/%s_var_kptrain_%s",
                        "Directory for saving and loading model checkpoints.")
+tf.flags.DEFINE_integer("eval_workers", 4,
+                        "Processes computing BLEU, ROUGE_L and CIDEr over shards of "
+                        "the questions, 0 for a single process also reporting METEOR.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
-def evaluate_question_standard(result_file, subset='kptest', version='v1'):
+def evaluate_question_standard(result_file, subset='kptest', version='v1',
+                               num_workers=0):
     from analysis.eval_vqa_question import QuestionEvaluator
     from util import get_dataset_root
     vqa_data_root, _ = get_dataset_root()
@@ -49,7 +54,7 @@ def evaluate_question_standard(result_file, subset='kptest', version='v1'):
     else:
         raise Exception('unknown version, v1 or v2')
 
-    evaluator = QuestionEvaluator(annotation_file, question_file)
+    evaluator = QuestionEvaluator(annotation_file, question_file, num_workers)
     evaluator.evaluate(result_file)
     evaluator.save_results()
     # return evaluator.get_overall_blue4()
@@ -85,6 +90,9 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset='kptest'):
         # ckpt_dir = '/import/vision-ephemeral/fl302/models/v2_kpvaq_VAQ-RL/'
         ckpt = tf.train.get_checkpoint_state(ckpt_dir)
         checkpoint_path = ckpt.model_checkpoint_path
+    else:
+        # checkpoints of the watcher may be evaluated in parallel
+        res_file = checkpoint_file_name(res_file, checkpoint_path)
 
     # Build model
     g = tf.Graph()
@@ -94,7 +102,7 @@ def ivqa_decoding_beam_search(checkpoint_path=None, subset='kptest'):
         model.build()
         # Restore from checkpoint
         restorer = Restorer(g)
-        sess = tf.Session()
+        sess = tf.Session(config=eval_session_config())
         restorer.restore(sess, checkpoint_path)
 
     num_batches = reader.num_batches
@@ -157,7 +165,8 @@ def main(_):
             if FLAGS.mode == 'full':
                 cider = evaluate_oracle(res_file, split=target_split)
             else:
-                cider = evaluate_question_standard(res_file)
+                cider = evaluate_question_standard(res_file,
+                                                   num_workers=FLAGS.eval_workers)
 
         return float(cider[0])
 
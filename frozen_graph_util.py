@@ -0,0 +1,127 @@
+"""
+Frozen inference graphs of the VQA scoring models.
+
+freeze_model builds a model the way its wrapper does, records the tensors
+that model.inference(sess, inputs) feeds and fetches, and writes the
+subgraph computing those outputs, with the checkpoint weights folded into
+constants, as a standalone GraphDef. The names of the input and output
+tensors are written next to it, in <graph file>.json.
+
+FrozenInferenceModel loads such a file through
+InferenceWrapperBase.build_graph_from_frozen_proto and exposes the same
+inference(sess, inputs) as the model it was exported from, so the reward
+and scoring wrappers can use it in place of building the Python model and
+restoring the training checkpoint.
+"""
+import json
+from time import time
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+from inference_utils.inference_wrapper_base import InferenceWrapperBase
+
+
+class _Sentinel(object):
+    def __init__(self, index):
+        self.index = index
+
+
+class _Recorded(Exception):
+    def __init__(self, fetches, feed_dict):
+        Exception.__init__(self, 'recorded session run')
+        self.fetches = fetches
+        self.feed_dict = feed_dict
+
+
+class _RecordingSession(object):
+    def run(self, fetches, feed_dict=None, **kwargs):
+        raise _Recorded(fetches, feed_dict or {})
+
+
+def _as_tensor(graph, t):
+    return graph.as_graph_element(t) if isinstance(t, str) else t
+
+
+def record_inference(model, num_inputs):
+    """
+    Returns the input tensors, in the order of the inputs argument, and the
+    output tensors of model.inference(sess, inputs), and whether it fetches
+    a list.
+    """
+    try:
+        model.inference(_RecordingSession(), [_Sentinel(i) for i in range(num_inputs)])
+    except _Recorded as r:
+        fetches, feed_dict = r.fetches, r.feed_dict
+    else:
+        raise ValueError('model.inference did not run the session')
+    graph = tf.get_default_graph()
+    inputs = [None] * num_inputs
+    for key, value in feed_dict.items():
+        if not isinstance(value, _Sentinel):
+            raise ValueError('model.inference feeds %s with a value that is not '
+                             'one of its inputs' % key)
+        inputs[value.index] = _as_tensor(graph, key)
+    fetch_list = isinstance(fetches, (list, tuple))
+    outputs = [_as_tensor(graph, t) for t in (fetches if fetch_list else [fetches])]
+    return inputs, outputs, fetch_list
+
+
+def freeze_model(build_fn, ckpt_file, output_file, num_inputs=3):
+    """
+    build_fn() builds the model in the default graph and returns it, the
+    trainable variables are restored from ckpt_file like in the wrappers.
+    """
+    g = tf.Graph()
+    with g.as_default():
+        model = build_fn()
+        inputs, outputs, fetch_list = record_inference(model, num_inputs)
+        saver = tf.train.Saver(var_list=tf.trainable_variables())
+        with tf.Session() as sess:
+            saver.restore(sess, ckpt_file)
+            frozen = graph_util.convert_variables_to_constants(
+                sess, g.as_graph_def(), [t.op.name for t in outputs])
+    with tf.gfile.FastGFile(output_file, 'wb') as f:
+        f.write(frozen.SerializeToString())
+    signature = {'inputs': [t.name for t in inputs],
+                 'outputs': [t.name for t in outputs],
+                 'fetch_list': fetch_list,
+                 'checkpoint': ckpt_file}
+    with open(output_file + '.json', 'w') as f:
+        json.dump(signature, f, indent=2)
+    tf.logging.info('Froze %s to %s (%d nodes)' % (ckpt_file, output_file,
+                                                   len(frozen.node)))
+    return signature
+
+
+class FrozenInferenceModel(InferenceWrapperBase):
+    def __init__(self, frozen_file):
+        super(FrozenInferenceModel, self).__init__()
+        self._frozen_file = frozen_file
+        with open(frozen_file + '.json', 'r') as f:
+            self._signature = json.load(f)
+        self._inputs = None
+        self._outputs = None
+
+    def build(self):
+        restore_fn = self.build_graph_from_frozen_proto(self._frozen_file)
+        g = tf.get_default_graph()
+        self._inputs = [g.get_tensor_by_name(n) for n in self._signature['inputs']]
+        self._outputs = [g.get_tensor_by_name(n) for n in self._signature['outputs']]
+        return restore_fn
+
+    def inference(self, sess, inputs):
+        feed_dict = {k: v for (k, v) in zip(self._inputs, inputs)}
+        outputs = sess.run(self._outputs, feed_dict=feed_dict)
+        return outputs if self._signature['fetch_list'] else outputs[0]
+
+
+def load_frozen_model(frozen_file):
+    """Returns the graph, a session and the FrozenInferenceModel."""
+    t = time()
+    g = tf.Graph()
+    with g.as_default():
+        model = FrozenInferenceModel(frozen_file)
+        restore_fn = model.build()
+        sess = tf.Session(graph=g)
+        restore_fn(sess)
+    tf.logging.info('Loaded frozen model %s in %0.2f sec' % (frozen_file, time() - t))
+    return g, sess, model
@@ -1,8 +1,8 @@
-import networkx as nx
 import numpy as np
 
 
 def find_connected_components(points):
+    import networkx as nx
     g = nx.Graph()
     g.add_edges_from(points)
     return [list(c) for c in nx.connected_components(g)]
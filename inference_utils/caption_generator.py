@@ -23,6 +23,9 @@ import math
 
 import numpy as np
 
+# words of probability below 1e-12 are not considered
+_MIN_LOGPROB = math.log(1e-12)
+
 
 class Caption(object):
     """Represents a complete or partial caption."""
@@ -110,8 +113,8 @@ class CaptionGenerator(object):
 
         Args:
           model: Object encapsulating a trained image-to-text model. Must have
-            methods feed_image() and inference_step(). For example, an instance of
-            InferenceWrapperBase.
+            methods feed_image() and inference_step_topk(). For example, an
+            instance of InferenceWrapperBase.
           vocab: A Vocabulary object.
           beam_size: Beam size to use when generating captions.
           max_caption_length: The maximum caption length before stopping the search.
@@ -157,23 +160,18 @@ class CaptionGenerator(object):
             input_feed = np.array([c.sentence[-1] for c in partial_captions_list])
             state_feed = np.array([c.state for c in partial_captions_list])
 
-            softmax, new_states, metadata = self.model.inference_step(sess,
-                                                                      input_feed,
-                                                                      state_feed)
+            # For each partial caption, get the beam_size most probable next words.
+            word_ids, word_logprobs, new_states, metadata = self.model.inference_step_topk(
+                sess, input_feed, state_feed, self.beam_size)
 
             for i, partial_caption in enumerate(partial_captions_list):
-                word_probabilities = softmax[i]
                 state = new_states[i]
-                # For this partial caption, get the beam_size most probable next words.
-                words_and_probs = list(enumerate(word_probabilities))
-                words_and_probs.sort(key=lambda x: -x[1])
-                words_and_probs = words_and_probs[0:self.beam_size]
                 # Each next word gives a new partial caption.
-                for w, p in words_and_probs:
-                    if p < 1e-12:
+                for w, logp in zip(word_ids[i], word_logprobs[i]):
+                    if logp < _MIN_LOGPROB:
                         continue  # Avoid log(0).
-                    sentence = partial_caption.sentence + [w]
-                    logprob = partial_caption.logprob + math.log(p)
+                    sentence = partial_caption.sentence + [int(w)]
+                    logprob = partial_caption.logprob + float(logp)
                     score = logprob
                     if metadata:
                         metadata_list = partial_caption.metadata + [metadata[i]]
@@ -32,9 +32,14 @@ Subclasses must implement the following methods:
     Optionally also returns metadata about the current inference step, e.g. a
     serialized numpy array containing activations from a particular model layer.
 
+  inference_step_topk() (optional):
+    Same as inference_step(), but returns only the k most probable words of
+    each input and their log-probabilities. Defaults to inference_step()
+    followed by a top k in numpy.
+
 Client usage:
-  1. Build the model inference graph via build_graph_from_config() or
-     build_graph_from_proto().
+  1. Build the model inference graph via build_graph_from_config(),
+     build_graph_from_proto() or build_graph_from_frozen_proto().
   2. Call the resulting restore_fn to load the model checkpoint.
   3. For each image in a batch of images:
      a) Call feed_image() once to get the initial state.
@@ -47,6 +52,7 @@ from __future__ import print_function
 
 import os.path
 
+import numpy as np
 import tensorflow as tf
 
 
@@ -120,6 +126,33 @@ class InferenceWrapperBase(object):
             saver = tf.train.Saver()
         return self._create_restore_fn(checkpoint_path, saver)
 
+    def _import_graph_def(self, graph_def_file):
+        tf.logging.info("Loading GraphDef from file: %s", graph_def_file)
+        graph_def = tf.GraphDef()
+        with tf.gfile.FastGFile(graph_def_file, "rb") as f:
+            graph_def.ParseFromString(f.read())
+        tf.import_graph_def(graph_def, name="")
+
+    def build_graph_from_frozen_proto(self, graph_def_file):
+        """Builds the inference graph from a frozen GraphDef proto.
+
+        The weights are constants of the graph (see frozen_graph_util), so
+        there is no checkpoint to restore.
+
+        Args:
+          graph_def_file: File containing a serialized frozen GraphDef proto.
+
+        Returns:
+          restore_fn: A function such that restore_fn(sess) does nothing, for
+            clients written against build_graph_from_proto().
+        """
+        self._import_graph_def(graph_def_file)
+
+        def _restore_fn(sess):
+            pass
+
+        return _restore_fn
+
     def build_graph_from_proto(self, graph_def_file, saver_def_file,
                                checkpoint_path):
         """Builds the inference graph from serialized GraphDef and SaverDef protos.
@@ -135,11 +168,7 @@ class InferenceWrapperBase(object):
             from the checkpoint file.
         """
         # Load the Graph.
-        tf.logging.info("Loading GraphDef from file: %s", graph_def_file)
-        graph_def = tf.GraphDef()
-        with tf.gfile.FastGFile(graph_def_file, "rb") as f:
-            graph_def.ParseFromString(f.read())
-        tf.import_graph_def(graph_def, name="")
+        self._import_graph_def(graph_def_file)
 
         # Load the Saver.
         tf.logging.info("Loading SaverDef from file: %s", saver_def_file)
@@ -181,4 +210,31 @@ class InferenceWrapperBase(object):
         """
         tf.logging.fatal("Please implement inference_step in subclass")
 
+    def inference_step_topk(self, sess, input_feed, state_feed, k):
+        """Runs one step of inference, keeping the k best words of each input.
+
+        Wrappers whose graph computes the top k words can override this to
+        avoid fetching the whole softmax.
+
+        Args:
+          sess: TensorFlow Session object.
+          input_feed: A numpy array of shape [batch_size].
+          state_feed: A numpy array of shape [batch_size, state_size].
+          k: Number of words to keep.
+
+        Returns:
+          word_ids: A numpy array of shape [batch_size, k], best first.
+          logprobs: A numpy array of shape [batch_size, k].
+          new_state: A numpy array of shape [batch_size, state_size].
+          metadata: See inference_step().
+        """
+        softmax, new_state, metadata = self.inference_step(sess, input_feed,
+                                                           state_feed)
+        # stable, ties are kept in word id order
+        word_ids = np.argsort(-softmax, axis=1, kind='mergesort')[:, :k]
+        probs = softmax[np.arange(softmax.shape[0])[:, np.newaxis], word_ids]
+        with np.errstate(divide='ignore'):
+            logprobs = np.log(probs)
+        return word_ids, logprobs, new_state, metadata
+
 # pylint: enable=unused-argument
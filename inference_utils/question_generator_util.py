@@ -1,5 +1,5 @@
 from inference_utils import vocabulary
-import tensorflow as tf
+import numpy as np
 
 
 def _index_to_sentence(vocab, index):
@@ -10,6 +10,27 @@ def _index_to_sentence(vocab, index):
     return ' '.join(tokens)
 
 
+def _index_to_sentences(vocab, word_table, index, lengths=None):
+    # batch version of _index_to_sentence for a padded [N, T] array
+    index = np.asarray(index)
+    num, max_len = index.shape
+    if lengths is None:
+        lengths = np.ones(num, dtype=np.int32) * max_len
+    lengths = np.minimum(np.asarray(lengths), max_len)
+    # out of vocabulary ids map to unk, as id_to_word does
+    index = np.where(index >= len(vocab.reverse_vocab), vocab.unk_id, index)
+    # strip start and end tokens of sentences starting with <S>
+    has_start = (index[:, 0] == vocab.start_id) & (lengths > 0)
+    begin = has_start.astype(np.int32)
+    end = np.maximum(lengths - begin, begin)
+    cols = np.arange(max_len)[np.newaxis, :]
+    mask = (cols >= begin[:, np.newaxis]) & (cols < end[:, np.newaxis])
+    # gather the kept words of all rows at once, then join row by row
+    words = word_table[index[mask]].tolist()
+    offsets = np.concatenate([[0], np.cumsum(end - begin)]).tolist()
+    return [' '.join(words[offsets[i]:offsets[i + 1]]) for i in range(num)]
+
+
 class SentenceGenerator(object):
     def __init__(self, trainset='train', ans_vocab_file=None, quest_vocab_file=None,
                  top_ans_file=None):
@@ -19,11 +40,14 @@ class SentenceGenerator(object):
             quest_vocab_file = 'data/vqa_%s_question_word_counts.txt' % trainset
         self._answer_vocab = vocabulary.Vocabulary(ans_vocab_file)
         self._quest_vocab = vocabulary.Vocabulary(quest_vocab_file)
+        self._answer_word_table = np.array(self._answer_vocab.reverse_vocab, dtype=object)
+        self._quest_word_table = np.array(self._quest_vocab.reverse_vocab, dtype=object)
         if top_ans_file is None:
             top_ans_file = 'data/vqa_%s_top2000_answers.txt' % trainset
         self._load_top_answers(top_ans_file)
 
     def _load_top_answers(self, vocab_file):
+        import tensorflow as tf
         with tf.gfile.GFile(vocab_file, mode="r") as f:
             reverse_vocab = list(f.readlines())
             self._top_ans_vocab = [line.strip() for line in reverse_vocab]
@@ -34,6 +58,14 @@ class SentenceGenerator(object):
     def index_to_question(self, sequence):
         return _index_to_sentence(self._quest_vocab, sequence)
 
+    def index_to_answers(self, index, lengths=None):
+        return _index_to_sentences(self._answer_vocab, self._answer_word_table,
+                                   index, lengths)
+
+    def index_to_questions(self, index, lengths=None):
+        return _index_to_sentences(self._quest_vocab, self._quest_word_table,
+                                   index, lengths)
+
     def index_to_top_answer(self, id):
         return self._top_ans_vocab[id]
 
@@ -42,14 +74,6 @@ class SentenceGenerator(object):
         return self._quest_vocab
 
 
-def _extract_gt(capt, capt_len):
-    gt = []
-    for c, c_len in zip(capt, capt_len):
-        tmp = c[:c_len].tolist()
-        gt.append(tmp)
-    return gt
-
-
 class DataPreviewer(object):
     def __init__(self):
         top_ans_file = '/import/vision-ephemeral/fl302/code/' \
@@ -58,9 +82,9 @@ class DataPreviewer(object):
                                              top_ans_file=top_ans_file)
 
     def display(self, quest, quest_len, ans, ans_len):
-        gt_quests = _extract_gt(quest, quest_len)
-        gt_answers = _extract_gt(ans, ans_len)
+        gt_quests = self.to_sentence.index_to_questions(quest, quest_len)
+        gt_answers = self.to_sentence.index_to_answers(ans, ans_len)
         for i, (q, a) in enumerate(zip(gt_quests, gt_answers)):
-            print('Q: %s' % self.to_sentence.index_to_question(q))
-            print('A: %s' % self.to_sentence.index_to_answer(a))
+            print('Q: %s' % q)
+            print('A: %s' % a)
         print('\n')
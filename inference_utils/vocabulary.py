@@ -18,8 +18,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import tensorflow as tf
-
 
 class Vocabulary(object):
     """Vocabulary class for an image-to-text model."""
@@ -39,6 +37,7 @@ class Vocabulary(object):
           end_word: Special word denoting sentence end.
           unk_word: Special word denoting unknown words.
         """
+        import tensorflow as tf
         if not tf.gfile.Exists(vocab_file):
             tf.logging.fatal("Vocab file %s not found.", vocab_file)
         tf.logging.info("Initializing vocabulary from file: %s", vocab_file)
@@ -0,0 +1,27 @@
+"""
+A module with no dependencies, so that modules deferring their heavy
+imports can use LazyObject without pulling them in.
+"""
+
+
+class LazyObject(object):
+    """
+    Proxy of a module level object, which is only constructed on first
+    attribute access. This keeps importing the module (and spawning
+    workers that import it) cheap.
+    """
+
+    def __init__(self, create_fn, *args, **kwargs):
+        self._create_fn = create_fn
+        self._args = args
+        self._kwargs = kwargs
+        self._obj = None
+
+    def __getattr__(self, name):
+        # only called for names missing on the proxy, e.g. on instances
+        # made by copy or unpickling without running __init__
+        if name == '_obj' or (name.startswith('__') and name.endswith('__')):
+            raise AttributeError(name)
+        if self._obj is None:
+            self._obj = self._create_fn(*self._args, **self._kwargs)
+        return getattr(self._obj, name)
@@ -5,8 +5,9 @@ import time
 from post_process_variation_questions import post_process_variation_questions_noise, \
     wrap_samples_for_language_model, _parse_gt_questions
 from inference_utils.question_generator_util import SentenceGenerator
+from lazy_object import LazyObject
 
-_SENT = SentenceGenerator(trainset='trainval')
+_SENT = LazyObject(SentenceGenerator, trainset='trainval')
 
 
 class QuestionContext(object):
@@ -50,7 +51,7 @@ class QuestionContext(object):
         return np.concatenate([arr1, arr2], 0)
 
 
-_Q_CTX = QuestionContext(batch_size=12)
+_Q_CTX = LazyObject(QuestionContext, batch_size=12)
 
 
 def lm_trainstep(train_step, global_step, reader, model, sampler, sess):
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+def padding_sequence(coding):
+    ans_len = np.array([len(e) for e in coding], dtype=np.int64)
+    num = ans_len.size
+    ans_seq = np.zeros([num, ans_len.max()], dtype=np.int64)
+    for a_row, seq in zip(ans_seq, coding):
+        a_row[:len(seq)] = seq
+    return ans_seq, ans_len
+
+
+def iterate_mc_batches(reader, get_candidates_fn, num_quest_per_batch):
+    """
+    Reads questions until the reader hits eof, and groups them into batches
+    of num_quest_per_batch questions of the same length, so the decoder
+    states of a packed batch are not affected by question padding. Each
+    item is (reader_outs, candidates), candidates[1] being the answer
+    coding of the candidates.
+    """
+    buckets = {}
+    while not reader.eof():
+        outputs = reader.pop_batch()
+        quest_id, quest_ids = outputs[1], outputs[4]
+        bucket = buckets.setdefault(len(quest_ids), [])
+        bucket.append((outputs, get_candidates_fn(quest_id)))
+        if len(bucket) == num_quest_per_batch:
+            yield buckets.pop(len(quest_ids))
+    for bucket in buckets.values():
+        yield bucket
+
+
+def pack_mc_batch(items, ans_coding):
+    """
+    Packs the candidate answers of many questions into one padded batch.
+    Candidates of a question are contiguous, num_cands gives the size of
+    each segment and quest_len the number of question targets per row.
+    """
+    num_cands = np.array([len(cands[1]) for _, cands in items], dtype=np.int32)
+    segment = np.repeat(np.arange(len(items)), num_cands)
+
+    im_feat = np.concatenate([outs[2].reshape([1, -1]) for outs, _ in items])
+    quests = [outs[4] for outs, _ in items]
+    quest_len = np.array([len(q) - 1 for q in quests], dtype=np.int64)
+    quest_in = np.zeros([len(items), quest_len.max()], dtype=np.int64)
+    quest_targ = np.zeros_like(quest_in)
+    for i, q in enumerate(quests):
+        quest_in[i, :quest_len[i]] = q[:-1]
+        quest_targ[i, :quest_len[i]] = q[1:]
+    quest_mask = np.arange(quest_in.shape[1])[np.newaxis, :] < quest_len[:, np.newaxis]
+    quest_mask = quest_mask.astype(np.int64)
+    # duplicate question data for every candidate
+    im_feat, quest_in, quest_targ, quest_mask = [x[segment] for x in [im_feat, quest_in,
+                                                                      quest_targ, quest_mask]]
+    if ans_coding == 'word2vec':
+        word_vec = np.concatenate([cands[1] for _, cands in items])
+        inputs = [im_feat, word_vec, quest_in, quest_targ, quest_mask]
+    elif ans_coding == 'sequence':
+        ans_seq, ans_len = padding_sequence([seq for _, cands in items for seq in cands[1]])
+        inputs = [im_feat, ans_seq, ans_len, quest_in, quest_targ, quest_mask]
+    else:
+        raise Exception('unknown coding')
+    return inputs, num_cands, quest_len[segment]
+
+
+def question_loss(perplexity, quest_len):
+    # mean perplexity of each row, the last target (end token) excluded
+    num_valid = quest_len - 1
+    mask = np.arange(perplexity.shape[1])[np.newaxis, :] < num_valid[:, np.newaxis]
+    return (perplexity * mask).sum(axis=1) / np.maximum(num_valid, 1)
+
+
+def segment_offsets(num_cands):
+    return np.cumsum(num_cands) - num_cands
+
+
+def segment_argmin(values, num_cands):
+    """Returns, for each segment, the position of its minimum inside it."""
+    offsets = segment_offsets(num_cands)
+    segment = np.repeat(np.arange(num_cands.size), num_cands)
+    order = np.lexsort((values, segment))
+    return order[offsets] - offsets
+
+
+def segment_normalise(values, num_cands):
+    """l1 normalises values within each segment."""
+    segment = np.repeat(np.arange(num_cands.size), num_cands)
+    return values / np.add.reduceat(values, segment_offsets(num_cands))[segment]
+
+
+def slice_rows(state, start, end):
+    """Slices rows [start, end) of a fetched tensor or tuple of tensors."""
+    if isinstance(state, tuple):
+        sliced = [slice_rows(s, start, end) for s in state]
+        return type(state)(*sliced) if hasattr(state, '_fields') else tuple(sliced)
+    return state[start:end]
@@ -21,6 +21,9 @@ _module_output_type = {
 
 INVALID_EXPR = 'INVALID_EXPR'
 
+# the layout cache is cleared once it holds this many layouts
+_MAX_LAYOUT_CACHE_SIZE = 100000
+
 
 # decoding validity: maintaining a state x of [#att, #ans, T_remain]
 # when T_remain is T_decoder when decoding the first module token
@@ -117,6 +120,9 @@ class Assembler:
 
         self.P, self.W, self.b = _build_validity_mats(self.module_names)
 
+        # layout token tuple -> expression template without batch_idx
+        self._layout_cache = {}
+
     def module_list2tokens(self, module_list, T=None):
         layout_tokens = [self.name2idx_dict[name] for name in module_list]
         if T is not None:
@@ -133,7 +139,7 @@ class Assembler:
                 'expr_str': self._layout_tokens2str(layout_tokens),
                 'error': error_str}
 
-    def _assemble_layout_tokens(self, layout_tokens, batch_idx):
+    def _assemble_layout_tokens(self, layout_tokens, batch_idx, has_eos=None):
         # All modules takes a time_idx as the index from LSTM hidden states
         # (even if it doesn't need it, like _And), and different arity of
         # attention inputs. The output type can be either attention or answer
@@ -152,7 +158,9 @@ class Assembler:
         #
 
         # A valid layout must contain <eos>. Assembly fails if it doesn't.
-        if not np.any(layout_tokens == self.EOS_idx):
+        if has_eos is None:
+            has_eos = np.any(layout_tokens == self.EOS_idx)
+        if not has_eos:
             return self._invalid_expr(layout_tokens, 'cannot find <eos>')
 
         # Decoding Reverse Polish Notation with a stack
@@ -165,7 +173,9 @@ class Assembler:
             module_name = self.module_names[module_idx]
             expr = {'module': module_name,
                     'output_type': _module_output_type[module_name],
-                    'time_idx': t, 'batch_idx': batch_idx}
+                    'time_idx': t}
+            if batch_idx is not None:
+                expr['batch_idx'] = batch_idx
 
             input_num = _module_input_num[module_name]
             # Check if there are enough input in the stack
@@ -195,12 +205,36 @@ class Assembler:
             return self._invalid_expr(layout_tokens, 'result type must be ans, not att')
         return result
 
+    def _instantiate_expr(self, template, batch_idx):
+        # copy a cached template and fill in the batch index of every module
+        expr = dict(template)
+        if expr['module'] == INVALID_EXPR:
+            return expr
+        expr['batch_idx'] = batch_idx
+        for n_input in range(_module_input_num[expr['module']]):
+            key = 'input_%d' % n_input
+            expr[key] = self._instantiate_expr(template[key], batch_idx)
+        return expr
+
     def assemble(self, layout_tokens_batch):
         # layout_tokens_batch is a numpy array with shape [T, N],
         # containing module tokens and <eos>, in Reverse Polish Notation.
+        # Predicted layouts come from a small set of token sequences, so the
+        # decoded expressions are cached (without batch_idx) per layout.
         _, N = layout_tokens_batch.shape
-        expr_list = [self._assemble_layout_tokens(layout_tokens_batch[:, n], n)
-                     for n in range(N)]
+        has_eos = np.any(layout_tokens_batch == self.EOS_idx, axis=0)
+        if len(self._layout_cache) > _MAX_LAYOUT_CACHE_SIZE:
+            self._layout_cache = {}
+        expr_list = []
+        for n in range(N):
+            layout_tokens = layout_tokens_batch[:, n]
+            key = tuple(layout_tokens.tolist())
+            template = self._layout_cache.get(key)
+            if template is None:
+                template = self._assemble_layout_tokens(layout_tokens, None,
+                                                        has_eos[n])
+                self._layout_cache[key] = template
+            expr_list.append(self._instantiate_expr(template, n))
         expr_validity = np.array([expr['module'] != INVALID_EXPR
                                   for expr in expr_list], np.bool)
         return expr_list, expr_validity
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 import os
+from collections import OrderedDict
 import numpy as np
 import tensorflow as tf
 
@@ -69,10 +70,17 @@ class VocabDict:
 
 # ------------------------------      MODEL WRAPPER     ------------------------------
 class N2MNWrapper(object):
-    def __init__(self):
+    CKPT_FILE = '/usr/data/fl302/code/n2nmn/exp_vqa/tfmodel/vqa_rl_gt_layout/00040000'
+
+    # a cached res5c feature map is 14x14x2048 float32, 1.6 MB, so 64
+    # images take about 100 MB (1000 took 1.6 GB); candidates come grouped
+    # by image, so a few recent images are enough
+    def __init__(self, max_cached_images=64):
         self.T_encoder = 26
+        self._max_cached_images = max_cached_images
+        self._image_cache = OrderedDict()
         data_root = '/usr/data/fl302/code/n2nmn/exp_vqa/data'
-        snapshot_file = '/usr/data/fl302/code/n2nmn/exp_vqa/tfmodel/vqa_rl_gt_layout/00040000'
+        snapshot_file = self.CKPT_FILE
         self.vocab_question_file = os.path.join(data_root, 'vocabulary_vqa.txt')
         self.vocab_layout_file = os.path.join(data_root, 'vocabulary_layout.txt')
         self.vocab_answer_file = os.path.join(data_root, 'answers_vqa.txt')
@@ -108,6 +116,9 @@ class N2MNWrapper(object):
                 num_choices=num_choices,
                 use_qpn=use_qpn, qpn_dropout=False,
                 reduce_visfeat_dim=reduce_visfeat_dim)
+            # the modules only see the image through image_feat_grid, so an
+            # image is encoded once and its grid is fed for every question
+            self.image_embed_batch = self.nmn3_model_tst.image_feat_grid
 
             self.sess = tf.Session(config=tf.ConfigProto(
                 gpu_options=tf.GPUOptions(allow_growth=True),
@@ -129,32 +140,43 @@ class N2MNWrapper(object):
             seq_length_batch[n] = seq_length
         return input_seq_batch, seq_length_batch
 
+    def encode_image(self, image_id):
+        # bounded LRU cache of the [H, W, D] image embeddings
+        if image_id in self._image_cache:
+            f = self._image_cache.pop(image_id)
+        else:
+            FEAT_ROOT = '/usr/data/fl302/data/VQA/ResNet152/resnet_res5c'
+            filename = '%s2014/COCO_%s2014_%012d.jpg' % ('val', 'val', image_id)
+            f = np.load(os.path.join(FEAT_ROOT, filename + '.npz'))['x']
+            f = f.transpose((1, 2, 0))
+            if reduce_visfeat_dim:
+                f = self.sess.run(self.image_embed_batch,
+                                  feed_dict={self.image_feat_batch: f[np.newaxis, ::]})[0]
+            if len(self._image_cache) >= self._max_cached_images:
+                self._image_cache.popitem(last=False)
+        self._image_cache[image_id] = f
+        return f
+
     def _prepare_images(self, image_id, questions):
         num_tiles = len(questions)
-        FEAT_ROOT = '/usr/data/fl302/data/VQA/ResNet152/resnet_res5c'
-        filename = '%s2014/COCO_%s2014_%012d.jpg' % ('val', 'val', image_id)
-        f = np.load(os.path.join(FEAT_ROOT, filename + '.npz'))['x']
-        f = f.transpose((1, 2, 0))[np.newaxis, ::]
+        f = self.encode_image(image_id)[np.newaxis, ::]
         return np.tile(f, [num_tiles, 1, 1, 1])
 
-    def inference(self, image_id, questions):
+    def _run_model(self, image_batch, questions):
         nmn3_model_tst = self.nmn3_model_tst
-        # image batch
-        image_batch = self._prepare_images(image_id, questions)
         # question batch
         seq, seq_length = self._prepare_question(questions)
-        # pdb.set_trace()
         # set up input and output tensors
         h = self.sess.partial_run_setup(
             [nmn3_model_tst.predicted_tokens, nmn3_model_tst.scores],
-            [self.input_seq_batch, self.seq_length_batch, self.image_feat_batch,
+            [self.input_seq_batch, self.seq_length_batch, self.image_embed_batch,
              nmn3_model_tst.compiler.loom_input_tensor, self.expr_validity_batch])
 
         # Part 0 & 1: Run Convnet and generate module layout
         tokens = self.sess.partial_run(h, nmn3_model_tst.predicted_tokens,
                                        feed_dict={self.input_seq_batch: seq,
                                                   self.seq_length_batch: seq_length,
-                                                  self.image_feat_batch: image_batch})
+                                                  self.image_embed_batch: image_batch})
 
         # Assemble the layout tokens into network structure
         expr_list, expr_validity_array = self.assembler.assemble(tokens)
@@ -163,7 +185,9 @@ class N2MNWrapper(object):
         expr_feed[self.expr_validity_batch] = expr_validity_array
 
         # Part 2: Run NMN and learning steps
-        scores_val = self.sess.partial_run(h, nmn3_model_tst.scores, feed_dict=expr_feed)
+        return self.sess.partial_run(h, nmn3_model_tst.scores, feed_dict=expr_feed)
+
+    def _scores_to_answers(self, scores_val):
         scores_val[:, 0] = -1e10  # remove <unk> answer
 
         # compute accuracy
@@ -172,6 +196,41 @@ class N2MNWrapper(object):
         pred_answers = [self.answer_word_list[p] for p in predictions]
         return pred_answers, scores
 
+    def inference(self, image_id, questions):
+        # image batch
+        image_batch = self._prepare_images(image_id, questions)
+        scores_val = self._run_model(image_batch, questions)
+        return self._scores_to_answers(scores_val)
+
+    def inference_batch(self, image_ids, questions, batch_size=64):
+        """
+        Answer (image_id, question) pairs across many images. Pairs are
+        grouped by image so that each image feature is loaded once, and
+        packed into batches of batch_size questions. The outputs follow
+        the input order.
+        """
+        assert (len(image_ids) == len(questions))
+        num = len(questions)
+        order = sorted(range(num), key=lambda i: image_ids[i])
+        pred_answers = [None] * num
+        scores = np.zeros(num, np.float32)
+        for start in range(0, num, batch_size):
+            if start % (100 * batch_size) == 0:
+                print('%d/%d' % (start, num))
+            index = order[start:start + batch_size]
+            batch_questions = [questions[i] for i in index]
+            image_batch = np.stack([self.encode_image(image_ids[i])
+                                    for i in index])
+            scores_val = self._run_model(image_batch, batch_questions)
+            batch_answers, batch_scores = self._scores_to_answers(scores_val)
+            for i, ans, sc in zip(index, batch_answers, batch_scores):
+                pred_answers[i] = ans
+                scores[i] = sc
+        return pred_answers, scores
+
+    def get_scores(self, image_id, questions):
+        return self.inference(image_id, questions)
+
     def get_score(self, image_id, question):
         pred_answers, scores = self.inference(image_id, [question])
         sc = scores[0]
@@ -183,33 +242,10 @@ class N2MNWrapper(object):
         if question_new != question:
             print('Rephrase')
         question = question_new
-        nmn3_model_tst = self.nmn3_model_tst
         # image batch
         questions = [question]
         image_batch = self._prepare_images(image_id, questions)
-        # question batch
-        seq, seq_length = self._prepare_question(questions)
-        # pdb.set_trace()
-        # set up input and output tensors
-        h = self.sess.partial_run_setup(
-            [nmn3_model_tst.predicted_tokens, nmn3_model_tst.scores],
-            [self.input_seq_batch, self.seq_length_batch, self.image_feat_batch,
-             nmn3_model_tst.compiler.loom_input_tensor, self.expr_validity_batch])
-
-        # Part 0 & 1: Run Convnet and generate module layout
-        tokens = self.sess.partial_run(h, nmn3_model_tst.predicted_tokens,
-                                       feed_dict={self.input_seq_batch: seq,
-                                                  self.seq_length_batch: seq_length,
-                                                  self.image_feat_batch: image_batch})
-
-        # Assemble the layout tokens into network structure
-        expr_list, expr_validity_array = self.assembler.assemble(tokens)
-        # Build TensorFlow Fold input for NMN
-        expr_feed = nmn3_model_tst.compiler.build_feed_dict(expr_list)
-        expr_feed[self.expr_validity_batch] = expr_validity_array
-
-        # Part 2: Run NMN and learning steps
-        scores_val = self.sess.partial_run(h, nmn3_model_tst.scores, feed_dict=expr_feed)
+        scores_val = self._run_model(image_batch, questions)
         scores = scores_val.flatten()
         idx = self.answer_dict.word2idx(answer)
         return float(scores[idx])
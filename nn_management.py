@@ -7,18 +7,13 @@ class IrrelevantManager(object):
         self.image_ids = np.array(image_ids, dtype=np.int32)
         # load image neighbours
         self._load_nn_info()
-        self._build_image_id2index()
+        self._build_image_quest_index()
         # load blacklist
         self._load_black_list()
 
-    def _build_image_id2index(self):
-        image_id2index = {}
-        for i, image_id in enumerate(self.image_ids):
-            if image_id in image_id2index:
-                image_id2index[image_id].append(i)
-            else:
-                image_id2index[image_id] = [i]
-        self.image_id2index = image_id2index
+    def _build_image_quest_index(self):
+        from readers.csr_index import CSRIndex
+        self.image_quest_index = CSRIndex.from_keys(self.image_ids)
 
     def _load_nn_info(self):
         print('%s: Loading nearest neighbours' % self.name)
@@ -49,15 +44,13 @@ class IrrelevantManager(object):
         return np.array(neg_quest_inds, dtype=np.int32)
 
     def _query_by_image_ids(self, image_ids):
-        neg_quest_inds = []
+        neg_image_ids = []
         for image_id in image_ids:
             assert (image_id not in self.black_list)
             # sample a negative image
-            neg_image_id = self._sample_negative_image(image_id)
-            # sample a question given image_id
-            qindex = self._sample_question_for_image(neg_image_id)
-            neg_quest_inds.append(qindex)
-        return neg_quest_inds
+            neg_image_ids.append(self._sample_negative_image(image_id))
+        # sample a question given each negative image
+        return self._sample_question_for_images(neg_image_ids)
 
     def _sample_negative_image(self, image_id):
         nn_ids = self.image_id2nn[image_id]
@@ -68,9 +61,9 @@ class IrrelevantManager(object):
             if _idx not in self.black_list:
                 return _idx
 
-    def _sample_question_for_image(self, image_id):
-        inds = self.image_id2index[image_id]
-        return np.random.choice(inds)
+    def _sample_question_for_images(self, image_ids):
+        groups = self.image_quest_index.lookup(image_ids)
+        return self.image_quest_index.sample(groups)
 
 
 def test_irrelevant_management():
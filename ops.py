@@ -59,6 +59,13 @@ def _get_tensor_shape(x):
     return [i if i is not None else -1 for i in s]
 
 
+def _get_dynamic_shape(x):
+    # static dims where known, scalar tensors of tf.shape(x) otherwise
+    s = x.get_shape().as_list()
+    dyn = tf.shape(x)
+    return [i if i is not None else dyn[k] for k, i in enumerate(s)]
+
+
 def _get_tensor_rank(x):
     s = x.get_shape().as_list()
     return len(s)
@@ -196,12 +203,13 @@ def _soft_attention_pool_with_map(im, im_ctx):
 def _spatial_aggregate(im, att_map, normalize=True):
     assert (_get_tensor_rank(im) == 4)
     assert (_get_tensor_rank(att_map) == 4)
-    # expand dims
-    im = tf.expand_dims(im, dim=3)  # Nx14x14x1x2048
-    att_map = tf.expand_dims(att_map, dim=4)  # Nx14x14xCx1
-    # pooling over features
-    im_att = tf.mul(att_map, im)
-    im_feat = tf.reduce_sum(im_att, reduction_indices=[1, 2])
+    _, h, w, d = _get_dynamic_shape(im)
+    n_maps = _get_dynamic_shape(att_map)[-1]
+    # pooling over features, as a product of Nx196xC and Nx196x2048
+    # matrices rather than through a Nx14x14xCx2048 broadcast
+    im = tf.reshape(im, [-1, h * w, d])
+    att_map = tf.reshape(att_map, [-1, h * w, n_maps])
+    im_feat = batch_matmul_op(att_map, im, adj_x=True)  # NxCx2048
     if normalize:
         im_feat = tf.nn.l2_normalize(im_feat, dim=-1)
     return im_feat
@@ -210,18 +218,63 @@ def _spatial_aggregate(im, att_map, normalize=True):
 def _spatial_aggregate_static(im, att_map, normalize=True):
     assert (_get_tensor_rank(im) == 4)
     assert (_get_tensor_rank(att_map) == 3)
-    # expand dims
-    im = tf.expand_dims(im, dim=3)  # Nx14x14x1x2048
-    att_map = tf.expand_dims(att_map, dim=0)  # Nx14x14xCx1
-    att_map = tf.expand_dims(att_map, dim=4)  # Nx14x14xCx1
-    # pooling over features
-    im_att = tf.mul(att_map, im)
-    im_feat = tf.reduce_sum(im_att, reduction_indices=[1, 2])
+    _, h, w, d = _get_dynamic_shape(im)
+    n_maps = _get_dynamic_shape(att_map)[-1]
+    # the maps are shared by the batch, pool all images with one product
+    im = tf.transpose(tf.reshape(im, [-1, h * w, d]), perm=[1, 0, 2])
+    im = tf.reshape(im, [h * w, -1])  # 196x(N*2048)
+    att_map = tf.reshape(att_map, [h * w, n_maps])
+    im_feat = tf.matmul(att_map, im, transpose_a=True)  # Cx(N*2048)
+    im_feat = tf.transpose(tf.reshape(im_feat, [n_maps, -1, d]), perm=[1, 0, 2])
     if normalize:
         im_feat = tf.nn.l2_normalize(im_feat, dim=-1)
     return im_feat
 
 
+def _batch_gather_experts(experts, indices):
+    """
+    experts: NxUxD, indices: NxK, returns the NxKxD selected experts
+    """
+    num_units, dim = _get_dynamic_shape(experts)[1:]
+    batch_size = tf.shape(indices)[0]
+    offsets = tf.expand_dims(tf.range(batch_size) * num_units, 1)
+    flat_experts = tf.reshape(experts, [-1, dim])
+    return tf.gather(flat_experts, indices + offsets)
+
+
+def _sparse_moe_attention(im, im_ctx, gate_logits, num_units, num_active,
+                          scope='sp_logits'):
+    """
+    The attention banks and gated sum of moe_attention, restricted to the
+    num_active units with the largest gates of each sample: only their
+    attention maps are computed and pooled, and the gates are normalised
+    over them. Uses the variables of the dense 1x1 conv.
+    """
+    # the channels of im_ctx size the variables, the grid may be dynamic
+    ctx_dim = _get_tensor_shape(im_ctx)[-1]
+    _, h, w, _ = _get_dynamic_shape(im_ctx)
+    d = _get_dynamic_shape(im)[-1]
+    with tf.variable_scope(scope):
+        weights = slim.model_variable('weights', shape=[1, 1, ctx_dim, num_units],
+                                      initializer=tf.contrib.layers.xavier_initializer())
+        biases = slim.model_variable('biases', shape=[num_units],
+                                     initializer=tf.constant_initializer(0.0))
+    # select experts
+    active_logits, active_inds = tf.nn.top_k(gate_logits, num_active, sorted=False)
+    gates = tf.expand_dims(tf.nn.softmax(active_logits), 2)  # NxKx1
+    active_w = tf.gather(tf.transpose(tf.reshape(weights, [ctx_dim, num_units])),
+                         active_inds)  # NxKxC
+    active_b = tf.expand_dims(tf.gather(biases, active_inds), 2)  # NxKx1
+    # attention maps of the active units, softmax over space
+    im_ctx = tf.reshape(im_ctx, [-1, h * w, ctx_dim])
+    s_logits = batch_matmul_op(active_w, im_ctx, adj_y=True) + active_b  # NxKx196
+    att_maps = tf.reshape(tf.nn.softmax(tf.reshape(s_logits, [-1, h * w])),
+                          [-1, num_active, h * w])
+    # aggregate visual features
+    att_basis = batch_matmul_op(att_maps, tf.reshape(im, [-1, h * w, d]))  # NxKx2048
+    return tf.reduce_sum(tf.mul(att_basis, gates), reduction_indices=1)
+
+
 def _create_attention_map(im_ctx, reg_fn=_spatial_softmax,
                           scope=''):
     s_logits = slim.conv2d(im_ctx, 1, [1, 1], activation_fn=None,
@@ -316,9 +369,27 @@ def debug_gated_attention():
 
 
 def moe_attention(im, quest, embed_dim, keep_prob=1.0,
-                  num_units=4, reuse=False, scope="MoeAttention"):
+                  num_units=4, reuse=False, scope="MoeAttention",
+                  num_active=None):
+    """
+    Mixture of num_units soft attention maps. With num_active set, only
+    the num_active units with the largest gates are computed for each
+    sample (see _sparse_moe_attention).
+    """
     with tf.variable_scope(scope, reuse=reuse):
         im_ctx = mlb(im, quest, embed_dim, keep_prob)
+        # compute gate
+        with tf.variable_scope('Gate'):
+            im_mean = tf.reduce_mean(im, reduction_indices=[1, 2])
+            vq_embed = mlb(im_mean, quest, embed_dim / 4, keep_prob, 'gate_prelogit')
+            # vq_ctx = tf.concat(concat_dim=1, values=[im_ctx, quest])
+            # vq_embed = slim.fully_connected(vq_ctx, embed_dim, scope='vq_embed')
+            # vq_embed = slim.dropout(vq_embed, keep_prob)
+            gate_logits = slim.fully_connected(vq_embed, num_units, activation_fn=None,
+                                               scope='gate')
+        if num_active is not None:
+            return _sparse_moe_attention(im, im_ctx, gate_logits, num_units,
+                                         num_active)
         # soft attention
         s_logits = slim.conv2d(im_ctx, num_units, [1, 1], activation_fn=None,
                                scope='sp_logits')
@@ -326,16 +397,7 @@ def moe_attention(im, quest, embed_dim, keep_prob=1.0,
         att_maps = _spatial_softmax(s_logits)
         # aggregate visual features
         att_basis = _spatial_aggregate(im, att_maps, normalize=False)
-        # compute gate
-        with tf.variable_scope('Gate'):
-            im_ctx = tf.reduce_mean(im, reduction_indices=[1, 2])
-            vq_embed = mlb(im_ctx, quest, embed_dim / 4, keep_prob, 'gate_prelogit')
-            # vq_ctx = tf.concat(concat_dim=1, values=[im_ctx, quest])
-            # vq_embed = slim.fully_connected(vq_ctx, embed_dim, scope='vq_embed')
-            # vq_embed = slim.dropout(vq_embed, keep_prob)
-            gates = slim.fully_connected(vq_embed, num_units, activation_fn=None,
-                                         scope='gate')
-            gates = tf.expand_dims(slim.softmax(gates), 2)
+        gates = tf.expand_dims(slim.softmax(gate_logits), 2)
         output = tf.reduce_sum(tf.mul(att_basis, gates), reduction_indices=1)
         return output
 
@@ -466,17 +528,17 @@ def compute_sparse_moe_gated_features(att_banks, q_embed, embed_dim, num_active,
         gate_logits = tf.squeeze(gate_logits + noise_add, squeeze_dims=[2])
         gate_logits = tf.exp(gate_logits)
 
-        # compute top k activations
-        max_val, _ = tf.nn.top_k(gate_logits, num_active, False)
-        mask = tf.gradients(max_val, gate_logits)[0]
-        mask = tf.stop_gradient(mask)
-
-        # apply mask
-        gate_logits = gate_logits * mask
-
-        # compute softmax
-        den = tf.expand_dims(tf.reduce_sum(gate_logits, reduction_indices=1), 1)
-        gates = tf.div(gate_logits, den)
+        # compute top k activations, normalised over the active experts
+        active_gates, active_inds = tf.nn.top_k(gate_logits, num_active, False)
+        den = tf.reduce_sum(active_gates, reduction_indices=1, keep_dims=True)
+        active_gates = tf.div(active_gates, den)
+
+        # dense gates, for the summaries and the regularizer
+        _, num_units = _get_tensor_shape(gate_logits)
+        active_one_hot = tf.one_hot(active_inds, depth=num_units)  # NxKxU
+        mask = tf.reduce_sum(active_one_hot, reduction_indices=1)
+        gates = tf.reduce_sum(tf.mul(active_one_hot, tf.expand_dims(active_gates, 2)),
+                              reduction_indices=1)
         add_vector_summaries('gates', gates)
         add_count_summaries('act_counts', mask)
 
@@ -489,10 +551,11 @@ def compute_sparse_moe_gated_features(att_banks, q_embed, embed_dim, num_active,
         tf.scalar_summary('gate_reg_loss', loss)
         add_gradient_summaries('cv_gate_grad', loss, gates)
 
-        # visual pooling
-        gates = tf.expand_dims(gates, 2)
-        att_pool = tf.reduce_sum(tf.mul(gates, att_banks), reduction_indices=1)
-    return att_pool, gates
+        # visual pooling, over the active experts only
+        active_banks = _batch_gather_experts(att_banks, active_inds)
+        att_pool = tf.reduce_sum(tf.mul(tf.expand_dims(active_gates, 2), active_banks),
+                                 reduction_indices=1)
+    return att_pool, tf.expand_dims(gates, 2)
 
 
 def seq_moe_attention(im, quest, embed_dim, keep_prob=1.0,
@@ -553,15 +616,56 @@ def qmoe_attention(im, quest, embed_dim, keep_prob=1.0,
         return output
 
 
-def debug_moe_attention():
+def debug_moe_attention(num_units=8, num_active=8):
+    """
+    Compares the sparse dispatch of moe_attention to the dense one on the
+    same variables, the outputs match when all the units are active.
+    """
     import numpy.random as nr
     im_arr = nr.rand(2, 14, 14, 2048)
     quest_arr = nr.rand(2, 1024)
-    im = tf.convert_to_tensor(im_arr, dtype=tf.float32)
-    quest = tf.convert_to_tensor(quest_arr, dtype=tf.float32)
-    coding = moe_attention(im, quest, 512, num_units=8)
-    sess.run(tf.initialize_all_variables())
-    print(coding.eval())
+    with tf.Graph().as_default():
+        im = tf.placeholder(tf.float32, [None, None, None, 2048])
+        quest = tf.placeholder(tf.float32, [None, 1024])
+        dense = moe_attention(im, quest, 512, num_units=num_units)
+        sparse = moe_attention(im, quest, 512, num_units=num_units,
+                               reuse=True, num_active=num_active)
+        with tf.Session() as sess:
+            sess.run(tf.initialize_all_variables())
+            dense_v, sparse_v = sess.run([dense, sparse],
+                                         feed_dict={im: im_arr, quest: quest_arr})
+    print('max abs difference: %g' % np.abs(dense_v - sparse_v).max())
+    return dense_v, sparse_v
+
+
+def benchmark_moe_attention(settings=((20, 2), (20, 4), (100, 5), (100, 10)),
+                            batch_size=64, embed_dim=512, num_iters=20):
+    """
+    Time per batch of moe_attention, dense versus sparse dispatch, for
+    (num_units, num_active) settings.
+    """
+    from time import time
+    import numpy.random as nr
+    im_arr = nr.rand(batch_size, 14, 14, 2048).astype(np.float32)
+    quest_arr = nr.rand(batch_size, 2048).astype(np.float32)
+    print('%10s%12s%12s%12s' % ('units', 'active', 'dense(s)', 'sparse(s)'))
+    for num_units, num_active in settings:
+        times = []
+        for active in [None, num_active]:
+            with tf.Graph().as_default():
+                im = tf.placeholder(tf.float32, [None, 14, 14, 2048])
+                quest = tf.placeholder(tf.float32, [None, 2048])
+                output = moe_attention(im, quest, embed_dim, num_units=num_units,
+                                       num_active=active)
+                with tf.Session() as sess:
+                    sess.run(tf.initialize_all_variables())
+                    feed_dict = {im: im_arr, quest: quest_arr}
+                    sess.run(output, feed_dict=feed_dict)  # warm up
+                    t = time()
+                    for _ in range(num_iters):
+                        sess.run(output, feed_dict=feed_dict)
+                    times.append((time() - t) / num_iters)
+        print('%10d%12d%12.4f%12.4f' % (num_units, num_active, times[0], times[1]))
 
 
 def soft_attention(im, ctx, embed_dim, n_glimpses=1, keep_prob=1.0, scope=""):
@@ -747,6 +851,13 @@ def select_op(conditon, x, y):
         return tf.where(conditon, x, y)
 
 
+def batch_matmul_op(x, y, adj_x=False, adj_y=False):
+    if tf.__version__ == '0.12.0':
+        return tf.batch_matmul(x, y, adj_x=adj_x, adj_y=adj_y)
+    else:
+        return tf.matmul(x, y, transpose_a=adj_x, transpose_b=adj_y)
+
+
 def unpack_op(value, num=None, axis=0, name='unstack'):
     if tf.__version__ == '0.12.0':
         return tf.unpack(value, num, axis, name)
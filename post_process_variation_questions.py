@@ -1,23 +1,105 @@
 import numpy as np
+from time import time
+from itertools import chain
 from config import VOCAB_CONFIG
 
 END_TOKEN = VOCAB_CONFIG.end_token_id
 START_TOKEN = VOCAB_CONFIG.start_token_id
 
 
-def put_to_array(sentences, pad_token=None, max_length=None):
-    pad_token = pad_token or 0
-    sentence_lengths = np.array([len(s) for s in sentences])
+def _flatten(sentences):
+    """Returns the tokens of all the sentences, and where each starts and ends."""
+    num = len(sentences)
+    offsets = np.zeros(num + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(s) for s in sentences), dtype=np.int64, count=num),
+              out=offsets[1:])
+    tokens = np.fromiter(chain.from_iterable(sentences), dtype=np.int32,
+                         count=offsets[-1])
+    return tokens, offsets
+
+
+def _padded_lengths(offsets, max_length):
+    lengths = np.diff(offsets)
     if max_length is None:
-        max_length = sentence_lengths.max()
+        max_length = lengths.max() if lengths.size else 0
     else:
-        sentence_lengths[sentence_lengths > max_length] = max_length
-    batch_size = len(sentences)
-    token_arrays = np.ones([batch_size, max_length], dtype=np.int32) * pad_token
-    for s, s_len, target in zip(sentences, sentence_lengths, token_arrays):
-        target[:s_len] = s[:s_len]
-    # token_lens = np.array(sentence_lengths, dtype=np.int32)
-    return [token_arrays.astype(np.int32), sentence_lengths.astype(np.int32)]
+        lengths = np.minimum(lengths, max_length)
+    return lengths, max_length
+
+
+def _scatter_rows(token_arrays, tokens, offsets, lengths, pad_token):
+    """token_arrays[i, :lengths[i]] = tokens[offsets[i]:], the rest is padding."""
+    token_arrays.fill(pad_token)
+    starts = np.cumsum(lengths) - lengths
+    rows = np.repeat(np.arange(lengths.size), lengths)
+    cols = np.arange(rows.size) - np.repeat(starts, lengths)
+    token_arrays[rows, cols] = tokens[np.repeat(offsets[:-1], lengths) + cols]
+
+
+def put_to_array(sentences, pad_token=None, max_length=None):
+    tokens, offsets = _flatten(sentences)
+    sentence_lengths, max_length = _padded_lengths(offsets, max_length)
+    token_arrays = np.empty([len(sentences), max_length], dtype=np.int32)
+    _scatter_rows(token_arrays, tokens, offsets, sentence_lengths, pad_token or 0)
+    return [token_arrays, sentence_lengths.astype(np.int32)]
+
+
+class PaddedBatchBuilder(object):
+    """
+    put_to_array into int32 buffers kept from one call to the next. The
+    arrays returned are views of the buffers and are overwritten by the
+    next call, so a builder serves one call site, whose batch is fed to
+    the session before the next one is built.
+    """
+
+    def __init__(self, pad_token=0):
+        self.pad_token = pad_token
+        self._tokens = np.empty(0, dtype=np.int32)
+        self._lengths = np.empty(0, dtype=np.int32)
+
+    def _buffers(self, batch_size, max_length):
+        size = batch_size * max_length
+        if self._tokens.size < size:
+            self._tokens = np.empty(max(size, 2 * self._tokens.size), dtype=np.int32)
+        if self._lengths.size < batch_size:
+            self._lengths = np.empty(max(batch_size, 2 * self._lengths.size),
+                                     dtype=np.int32)
+        return self._tokens[:size].reshape([batch_size, max_length]), \
+            self._lengths[:batch_size]
+
+    def from_flat(self, tokens, offsets, max_length=None, pad_token=None):
+        """Sentence i is tokens[offsets[i]:offsets[i + 1]]."""
+        pad_token = self.pad_token if pad_token is None else pad_token
+        lengths, max_length = _padded_lengths(offsets, max_length)
+        token_arrays, sentence_lengths = self._buffers(lengths.size, max_length)
+        _scatter_rows(token_arrays, tokens, offsets, lengths, pad_token)
+        sentence_lengths[:] = lengths
+        return [token_arrays, sentence_lengths]
+
+    def from_lists(self, sentences, max_length=None, pad_token=None):
+        tokens, offsets = _flatten(sentences)
+        return self.from_flat(tokens, offsets, max_length, pad_token)
+
+
+# the batches of a trainstep are fed before the next step builds new ones,
+# so the RL trainsteps share a builder per call site
+_LM_BATCH_BUILDER = PaddedBatchBuilder()
+_REINFORCE_BATCH_BUILDER = PaddedBatchBuilder()
+
+
+def trainstep_batch_builders():
+    """
+    The builders of the language model batch (wrap_samples_for_language_model)
+    and of the reinforce batch (prepare_reinforce_data) of an RL trainstep.
+    """
+    return _LM_BATCH_BUILDER, _REINFORCE_BATCH_BUILDER
+
+
+def _padded_batch(sentences, pad_token=None, max_length=None, builder=None):
+    if builder is None:
+        return put_to_array(sentences, pad_token, max_length=max_length)
+    return builder.from_lists(sentences, max_length=max_length,
+                              pad_token=pad_token or 0)
 
 
 def post_process_prediction(scores, pathes, add_start_end=True, do_sum=True):
@@ -71,105 +153,133 @@ def find_unique_pathes(scores, pathes, noise=None, use_count=False):
     return outputs
 
 
-def post_process_variation_questions(scores, pathes, _this_batch_size):
-    ivqa_scores, ivqa_pathes = [], []
-    # parse sentences
-    scores, pathes = post_process_prediction(scores, pathes,
-                                             add_start_end=True)
-    # process for each sample
-    num_sampled = int(len(pathes) / _this_batch_size)
-    _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
-    for _s_id in range(_this_batch_size):
-        _index = _noise_offset + _s_id
-        cur_scores = [scores[_idx] for _idx in _index]
-        cur_pathes = [pathes[_idx] for _idx in _index]
+def post_process_prediction_array(scores, pathes, do_sum=True):
+    """
+    post_process_prediction without the loop over rows. Returns the
+    questions with their start and end tokens, zero padded, their lengths
+    and confidences.
+    """
+    num, max_len = pathes.shape
+    is_end_token = np.equal(pathes, END_TOKEN)
+    has_end = np.any(is_end_token, axis=1)
+    pred_len = np.where(has_end, np.argmax(is_end_token, axis=1), max_len)
+    # the end token is kept, with its score
+    keep_len = pred_len + has_end
+    if do_sum:
+        in_path = np.arange(max_len)[np.newaxis, :] < keep_len[:, np.newaxis]
+        confs = np.where(in_path, scores, 0.).sum(axis=1)
+    else:
+        confs = scores[:, 0]
+    lengths = (keep_len + 1).astype(np.int32)
+    tokens = np.zeros([num, max_len + 1], dtype=np.int32)
+    tokens[:, 0] = START_TOKEN
+    tokens[:, 1:] = pathes
+    tokens[np.arange(max_len + 1)[np.newaxis, :] >= lengths[:, np.newaxis]] = 0
+    return tokens, lengths, confs
+
+
+def find_unique_rows(tokens, lengths, groups=None):
+    """
+    Unique questions of each group, tokens being zero padded beyond
+    lengths. Returns the index of the first row of every unique question,
+    ordered by group, and the index of the unique question of every row.
+    """
+    num = tokens.shape[0]
+    groups = np.zeros(num, dtype=np.int32) if groups is None else groups
+    keys = np.concatenate([groups[:, np.newaxis], lengths[:, np.newaxis],
+                           tokens], axis=1).astype(np.int32)
+    keys = np.ascontiguousarray(keys)
+    rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1])))
+    _, first, inverse = np.unique(rows.ravel(), return_index=True,
+                                  return_inverse=True)
+    # np.unique orders by bytes, back to group and sampling order
+    order = np.lexsort((first, groups[first]))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return first[order], rank[inverse.ravel()]
+
+
+def find_unique_pathes_array(scores, tokens, lengths, groups=None):
+    """
+    find_unique_pathes of every group at once. Returns the index of the
+    highest scoring row of every unique question, ordered by group, the
+    number of rows of each, and the index of the unique question of
+    every row.
+    """
+    _, inverse = find_unique_rows(tokens, lengths, groups)
+    order = np.lexsort((-scores, inverse))
+    is_best = np.ones(order.size, dtype=bool)
+    is_best[1:] = inverse[order[1:]] != inverse[order[:-1]]
+    counts = np.bincount(inverse)
+    return order[is_best], counts, inverse
+
+
+def post_process_variation_questions_array(scores, pathes, _this_batch_size,
+                                           do_sum=True, find_unique=True):
+    """
+    Parses the samples, interleaved with stride _this_batch_size, and keeps
+    the highest scoring sample of every unique question of each image.
+    Returns the index of the kept samples, ordered by image, their padded
+    tokens, lengths, confidences, image indices, and counts.
+    """
+    tokens, lengths, confs = post_process_prediction_array(scores, pathes, do_sum)
+    groups = np.arange(tokens.shape[0], dtype=np.int32) % _this_batch_size
+    if find_unique:
+        index, counts, _ = find_unique_pathes_array(confs, tokens, lengths, groups)
+    else:
+        index = np.argsort(groups, kind='mergesort')
+        counts = np.ones(index.size, dtype=np.int64)
+    return index, tokens[index], lengths[index], confs[index], groups[index], counts
 
-        cur_scores, cur_pathes = find_unique_pathes(cur_scores, cur_pathes)
-        ivqa_scores.append(cur_scores)
-        ivqa_pathes.append(cur_pathes)
-    return ivqa_scores, ivqa_pathes
 
+def _split_by_image(values, groups, num_images):
+    bounds = np.searchsorted(groups, np.arange(num_images + 1))
+    return [values[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
 
-def post_process_variation_questions_with_count(scores, pathes, _this_batch_size):
-    ivqa_scores, ivqa_pathes, ivqa_counts = [], [], []
-    # parse sentences
-    scores, pathes = post_process_prediction(scores, pathes,
-                                             add_start_end=True)
-    # process for each sample
-    num_sampled = int(len(pathes) / _this_batch_size)
-    _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
-    for _s_id in range(_this_batch_size):
-        _index = _noise_offset + _s_id
-        cur_scores = [scores[_idx] for _idx in _index]
-        cur_pathes = [pathes[_idx] for _idx in _index]
 
-        cur_scores, cur_pathes, cur_count = find_unique_pathes(cur_scores, cur_pathes, use_count=True)
-        ivqa_scores.append(cur_scores)
-        ivqa_pathes.append(cur_pathes)
-        ivqa_counts.append(cur_count)
-    return ivqa_scores, ivqa_pathes, ivqa_counts
+def _to_nested(outputs, _this_batch_size, noise=None, use_count=False):
+    index, tokens, lengths, confs, groups, counts = outputs
+    pathes = [p[:l].tolist() for p, l in zip(tokens, lengths)]
+    nested = [[s.tolist() for s in _split_by_image(confs, groups, _this_batch_size)],
+              _split_by_image(pathes, groups, _this_batch_size)]
+    if noise is not None:
+        nested.append(_split_by_image(noise[index], groups, _this_batch_size))
+    if use_count:
+        nested.append([c.tolist() for c in _split_by_image(counts, groups,
+                                                           _this_batch_size)])
+    return nested
 
 
-def post_process_variation_questions_with_count_v2(scores, pathes, _this_batch_size):
-    ivqa_scores, ivqa_pathes, ivqa_counts = [], [], []
-    # parse sentences
-    scores, pathes = post_process_prediction(scores, pathes,
-                                             add_start_end=True,
-                                             do_sum=False)
-    # process for each sample
-    num_sampled = int(len(pathes) / _this_batch_size)
-    _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
-    for _s_id in range(_this_batch_size):
-        _index = _noise_offset + _s_id
-        cur_scores = [scores[_idx] for _idx in _index]
-        cur_pathes = [pathes[_idx] for _idx in _index]
+def post_process_variation_questions(scores, pathes, _this_batch_size):
+    outputs = post_process_variation_questions_array(scores, pathes, _this_batch_size)
+    return _to_nested(outputs, _this_batch_size)
 
-        cur_scores, cur_pathes, cur_count = find_unique_pathes(cur_scores, cur_pathes, use_count=True)
-        ivqa_scores.append(cur_scores)
-        ivqa_pathes.append(cur_pathes)
-        ivqa_counts.append(cur_count)
-    return ivqa_scores, ivqa_pathes, ivqa_counts
 
+def post_process_variation_questions_with_count(scores, pathes, _this_batch_size):
+    outputs = post_process_variation_questions_array(scores, pathes, _this_batch_size)
+    return _to_nested(outputs, _this_batch_size, use_count=True)
 
-def process_one(scores, pathes):
-    def shape_equal(shape1, shape2):
-        if len(shape1) != len(shape2):
-            return False
-        for d1, d2 in zip(shape1, shape2):
-            if d1 != d2:
-                return False
-        return True
 
+def post_process_variation_questions_with_count_v2(scores, pathes, _this_batch_size):
+    outputs = post_process_variation_questions_array(scores, pathes, _this_batch_size,
+                                                     do_sum=False)
+    return _to_nested(outputs, _this_batch_size, use_count=True)
+
+
+def process_one(scores, pathes):
     # check shape
-    if not shape_equal(scores.shape, pathes.shape):
+    if scores.shape != pathes.shape:
         scores = np.tile(scores[:, np.newaxis], [1, pathes.shape[1]])
-    # extract pathes
-    scores, pathes = post_process_prediction(scores, pathes)
-    # find unique
-    return find_unique_pathes(scores, pathes)
+    outputs = post_process_variation_questions_array(scores, pathes, 1)
+    scores, pathes = _to_nested(outputs, 1)
+    return [scores[0], pathes[0]]
 
 
 def post_process_variation_questions_noise(scores, pathes, noise, _this_batch_size,
                                            find_unique=True):
-    ivqa_scores, ivqa_pathes, ivqa_noise = [], [], []
-    # parse sentences
-    scores, pathes = post_process_prediction(scores, pathes,
-                                             add_start_end=True)
-    # process for each sample
-    num_sampled = int(len(pathes) / _this_batch_size)
-    _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
-    for _s_id in range(_this_batch_size):
-        _index = _noise_offset + _s_id
-        cur_scores = [scores[_idx] for _idx in _index]
-        cur_pathes = [pathes[_idx] for _idx in _index]
-        cur_noise = noise[_index]
-
-        if find_unique:
-            cur_scores, cur_pathes, cur_noise = find_unique_pathes(cur_scores, cur_pathes, cur_noise)
-        ivqa_scores.append(cur_scores)
-        ivqa_pathes.append(cur_pathes)
-        ivqa_noise.append(cur_noise)
-    return ivqa_scores, ivqa_pathes, ivqa_noise
+    outputs = post_process_variation_questions_array(scores, pathes, _this_batch_size,
+                                                     find_unique=find_unique)
+    return _to_nested(outputs, _this_batch_size, noise=noise)
 
 
 def _parse_gt_questions(capt, capt_len):
@@ -180,12 +290,12 @@ def _parse_gt_questions(capt, capt_len):
 
 
 def wrap_samples_for_language_model(sampled=None, pad_token=0, gts=None,
-                                    max_length=None):
+                                    max_length=None, builder=None):
     pathes = []
     for ps in sampled:
         for p in ps:
             pathes.append(p[1:])  # keep end token
-    outputs = put_to_array(pathes, pad_token, max_length=max_length)
+    outputs = _padded_batch(pathes, pad_token, max_length, builder)
     if gts is not None:
         gt_pathes = _parse_gt_questions(*gts)
         for _gt in gt_pathes:
@@ -196,16 +306,16 @@ def wrap_samples_for_language_model(sampled=None, pad_token=0, gts=None,
 
 
 def wrap_samples_for_language_model_v2(sampled=None, pad_token=0,
-                                       max_length=None):
+                                       max_length=None, builder=None):
     pathes = []
     for ps in sampled:
         for p in ps:
             pathes.append(p[1:])  # keep end token
-    outputs = put_to_array(pathes, pad_token, max_length=max_length)
+    outputs = _padded_batch(pathes, pad_token, max_length, builder)
     return outputs, pathes
 
 
-def prepare_reinforce_data_max(pathes, noise, rewards, pad_token=None):
+def prepare_reinforce_data_max(pathes, noise, rewards, pad_token=None, builder=None):
     idx = 0
     max_noise, max_paths, max_rewards = [], [], []
     for _var_s, _var_n in zip(pathes, noise):
@@ -221,20 +331,20 @@ def prepare_reinforce_data_max(pathes, noise, rewards, pad_token=None):
         idx += _n
     max_noise = np.concatenate(max_noise, axis=0).astype(np.float32)
     max_rewards = np.array(max_rewards, dtype=np.float32)
-    max_path_arr, max_path_len = put_to_array(max_paths, pad_token)
+    max_path_arr, max_path_len = _padded_batch(max_paths, pad_token, builder=builder)
     max_len = max_path_arr.shape[1]
     max_rewards = np.tile(max_rewards[:, np.newaxis], [1, max_len - 1])
     return max_path_arr, max_path_len, max_noise, max_rewards
 
 
-def prepare_reinforce_data(pathes, noise, rewards, pad_token=None):
+def prepare_reinforce_data(pathes, noise, rewards, pad_token=None, builder=None):
     _pathes, _noise = [], []
 
     for _var_s, _var_n in zip(pathes, noise):
         _pathes += _var_s
         _noise += [_var_n]
     _noise = np.concatenate(_noise, axis=0).astype(np.float32)
-    path_arr, path_len = put_to_array(_pathes, pad_token)
+    path_arr, path_len = _padded_batch(_pathes, pad_token, builder=builder)
     max_len = path_arr.shape[1]
     _rewards = np.tile(rewards[:, np.newaxis], [1, max_len - 1])
 
@@ -301,6 +411,48 @@ def concat_vqa_batch(gt_inputs, aug_inputs):
     return outputs
 
 
+def _post_process_variation_questions_loop(scores, pathes, _this_batch_size):
+    ivqa_scores, ivqa_pathes = [], []
+    scores, pathes = post_process_prediction(scores, pathes,
+                                             add_start_end=True)
+    num_sampled = int(len(pathes) / _this_batch_size)
+    _noise_offset = np.arange(0, num_sampled, dtype=np.int32) * _this_batch_size
+    for _s_id in range(_this_batch_size):
+        _index = _noise_offset + _s_id
+        cur_scores = [scores[_idx] for _idx in _index]
+        cur_pathes = [pathes[_idx] for _idx in _index]
+        cur_scores, cur_pathes = find_unique_pathes(cur_scores, cur_pathes)
+        ivqa_scores.append(cur_scores)
+        ivqa_pathes.append(cur_pathes)
+    return ivqa_scores, ivqa_pathes
+
+
+def benchmark_post_process(settings=((64, 100), (256, 1000)), max_len=20,
+                           vocab_size=10, num_runs=3):
+    """
+    Per row loops versus post_process_variation_questions_array, on
+    batch x samples random samples. The small vocabulary gives duplicates.
+    """
+    for batch_size, num_samples in settings:
+        num = batch_size * num_samples
+        pathes = np.random.randint(low=END_TOKEN, high=END_TOKEN + vocab_size,
+                                   size=(num, max_len)).astype(np.int32)
+        scores = np.log(np.random.rand(num, max_len)).astype(np.float32)
+        t = time()
+        for _ in range(num_runs):
+            _, loop_pathes = _post_process_variation_questions_loop(scores, pathes,
+                                                                    batch_size)
+        t_loop = (time() - t) / num_runs
+        t = time()
+        for _ in range(num_runs):
+            outputs = post_process_variation_questions_array(scores, pathes,
+                                                             batch_size)
+        t_array = (time() - t) / num_runs
+        assert (sum([len(p) for p in loop_pathes]) == outputs[0].size)
+        print('%4d x %4d: loop %0.3f sec, array %0.3f sec, %0.1fx' %
+              (batch_size, num_samples, t_loop, t_array, t_loop / t_array))
+
+
 def test_post_process_prediction():
     import pdb
     seq = np.random.randint(low=0, high=100, size=(5, 8))
@@ -335,3 +487,4 @@ def test_post_process_prediction():
 
 if __name__ == '__main__':
     test_post_process_prediction()
+    benchmark_post_process()
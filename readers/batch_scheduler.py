@@ -0,0 +1,100 @@
+import numpy as np
+
+
+class BatchScheduler(object):
+    """
+    Epoch based batch scheduler shared by the prefetch processes.
+
+    Every worker draws the same permutation of the valid ids at each epoch
+    (seeded by seed plus the epoch number, so the workers must share the
+    seed), and keeps the batches whose position modulo num_shards equals
+    its proc_id, so the workers cover an epoch with disjoint batches; with
+    fewer batches than shards, batches are repeated across the shards. With bucket_by_length, the permutation is split
+    into pools of pool_batches batches, each pool is sorted by sequence
+    length and the resulting batches are shuffled, which shrinks the
+    padded length of a batch.
+    """
+
+    def __init__(self, valid_ids, batch_size, proc_id=0, num_shards=1,
+                 lengths=None, bucket_by_length=False, pool_batches=50,
+                 seed=0, report_interval=1000):
+        self._valid_ids = np.asarray(valid_ids)
+        if self._valid_ids.size == 0:
+            raise ValueError('BatchScheduler needs at least one valid id')
+        self._batch_size = batch_size
+        self._proc_id = proc_id
+        self._num_shards = num_shards
+        self._lengths = lengths
+        self._bucket_by_length = bucket_by_length and lengths is not None
+        self._pool_batches = pool_batches
+        self._seed = seed
+        self._report_interval = report_interval
+        self.epoch = -1
+        self._batches = []
+        self._pointer = 0
+        # statistics
+        self.iter = 0
+        self._num_tokens = 0
+        self._num_padded_tokens = 0
+        self._new_epoch()
+
+    def _epoch_batches(self, rng):
+        perm = self._valid_ids[rng.permutation(self._valid_ids.size)]
+        # fill the last batch with samples from the start of the epoch,
+        # cycling through them when there are fewer than a batch
+        num_pad = -perm.size % self._batch_size
+        perm = np.resize(perm, perm.size + num_pad)
+        if self._bucket_by_length:
+            pool_size = self._pool_batches * self._batch_size
+            pools = []
+            for start in range(0, perm.size, pool_size):
+                pool = perm[start:start + pool_size]
+                order = np.argsort(self._lengths[pool], kind='mergesort')
+                pools.append(pool[order])
+            perm = np.concatenate(pools)
+        batches = perm.reshape([-1, self._batch_size])
+        if self._bucket_by_length:
+            batches = batches[rng.permutation(batches.shape[0])]
+        return batches
+
+    def _new_epoch(self):
+        self.epoch += 1
+        rng = np.random.RandomState(self._seed + self.epoch)
+        batches = self._epoch_batches(rng)
+        num_batches = batches.shape[0]
+        shard = np.arange(self._proc_id, max(num_batches, self._num_shards),
+                          self._num_shards) % num_batches
+        self._batches = batches[shard]
+        self._pointer = 0
+
+    def next_batch(self):
+        if self._pointer >= len(self._batches):
+            self._new_epoch()
+        index = self._batches[self._pointer]
+        self._pointer += 1
+        self.iter += 1
+        self._update_statistics(index)
+        return index
+
+    def _update_statistics(self, index):
+        if self._lengths is not None:
+            lengths = self._lengths[index]
+            self._num_tokens += lengths.sum()
+            self._num_padded_tokens += lengths.max() * lengths.size
+        if self.iter % self._report_interval == 0:
+            self.print_statistics()
+
+    @property
+    def padding_ratio(self):
+        if self._num_padded_tokens == 0:
+            return 0.
+        return 1. - self._num_tokens / float(self._num_padded_tokens)
+
+    @property
+    def epoch_progress(self):
+        return self._pointer / float(max(len(self._batches), 1))
+
+    def print_statistics(self):
+        print('BatchScheduler [%d]: epoch %d (%0.1f%%), padding ratio %0.3f' %
+              (self._proc_id, self.epoch, 100. * self.epoch_progress,
+               self.padding_ratio))
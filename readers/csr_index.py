@@ -0,0 +1,70 @@
+import os
+import numpy as np
+from util import load_hdf5, save_hdf5
+
+
+class CSRIndex(object):
+    """
+    Groups the rows of a table by key, in compressed sparse row form.
+
+    The rows of the k-th key are index[offset[k]:offset[k] + count[k]], so
+    a row can be drawn for a whole batch of groups with one vectorized
+    expression, instead of walking a dict of lists per sample.
+    """
+
+    def __init__(self, keys, index, offset, count):
+        self.keys = keys
+        self.index = index
+        self.offset = offset
+        self.count = count
+
+    @classmethod
+    def from_keys(cls, row_keys):
+        row_keys = np.asarray(row_keys)
+        index = np.argsort(row_keys, kind='mergesort').astype(np.int32)
+        keys, count = np.unique(row_keys[index], return_counts=True)
+        count = count.astype(np.int32)
+        offset = (np.cumsum(count) - count).astype(np.int32)
+        return cls(keys, index, offset, count)
+
+    @classmethod
+    def load_or_build(cls, row_keys, data_file):
+        """
+        Same as from_keys, but cached to disk alongside data_file. The cache
+        is rebuilt whenever data_file is newer than it.
+        """
+        cache_file = os.path.splitext(data_file)[0] + '.csr'
+        if os.path.exists(cache_file) and \
+                os.path.getmtime(cache_file) >= os.path.getmtime(data_file):
+            d = load_hdf5(cache_file)
+            return cls(d['keys'], d['index'], d['offset'], d['count'])
+        csr = cls.from_keys(row_keys)
+        # several prefetch processes may build it at once, write atomically
+        tmp_file = '%s.%d' % (cache_file, os.getpid())
+        try:
+            save_hdf5(tmp_file, {'keys': csr.keys, 'index': csr.index,
+                                 'offset': csr.offset, 'count': csr.count})
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError):
+            print('CSRIndex: failed to write cache %s' % cache_file)
+        return csr
+
+    def lookup(self, query_keys):
+        """Returns the group of each key in query_keys."""
+        query_keys = np.asarray(query_keys)
+        groups = np.searchsorted(self.keys, query_keys)
+        groups = np.minimum(groups, self.keys.size - 1).astype(np.int32)
+        missing = self.keys[groups] != query_keys
+        if np.any(missing):
+            raise KeyError(query_keys[missing][0])
+        return groups
+
+    def rows(self, group):
+        start = self.offset[group]
+        return self.index[start:start + self.count[group]]
+
+    def sample(self, groups):
+        """Draws one row uniformly from each group in groups."""
+        groups = np.asarray(groups)
+        rand = np.random.rand(*groups.shape) * self.count[groups]
+        return self.index[self.offset[groups] + rand.astype(np.int32)]
@@ -39,6 +39,12 @@ def _compute_exploitation_ratio(sorted_index, vis_count, ratio=0.1):
     return (r * n_visit_in_topk / float(tot_visit))
 
 
+def _save_statistics(cache_file, stats):
+    tmp_file = '%s.tmp' % cache_file
+    save_hdf5(tmp_file, stats)
+    os.rename(tmp_file, cache_file)
+
+
 class CurriculumSampler(object):
     def __init__(self, batch_size=32, num_samples=None,
                  cand_pool_size=1000, epsilon=0.5, suffix=''):
@@ -72,9 +78,13 @@ class CurriculumSampler(object):
             self._num_visit = np.ones(self._db_size, dtype=np.float32)
         self._num_visit_prev = self._num_visit.copy()
 
-    def backup_statistics(self):
-        save_hdf5(self._cache_file, {'loss': self._loss,
-                                     'num_visit': self._num_visit})
+    def backup_statistics(self, writer=None):
+        stats = {'loss': self._loss.copy(),
+                 'num_visit': self._num_visit.copy()}
+        if writer is None:
+            _save_statistics(self._cache_file, stats)
+        else:  # e.g. the BackgroundWriter of AsyncCheckpointSaver
+            writer.submit(_save_statistics, self._cache_file, stats)
 
     def set_valid_index(self, index):
         self._index = index
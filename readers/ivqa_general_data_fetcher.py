@@ -2,6 +2,10 @@ import numpy as np
 import os
 from util import load_hdf5, load_json, find_image_id_from_fname, get_res5c_feature_root
 from multiprocessing import Process, Queue
+from math import ceil
+from readers.ordered_prefetcher import OrderedPrefetcher
+from readers.batch_scheduler import BatchScheduler
+from readers.csr_index import CSRIndex
 
 if os.path.exists('/usr/data/fl302/data/VQA/ResNet152'):
     FEAT_ROOT = '/usr/data/fl302/data/VQA/ResNet152/resnet_res5c'
@@ -19,7 +23,8 @@ class AttentionDataReader(object):
                  output_feat=True, output_attr=True,
                  output_capt=True, output_qa=False,
                  output_ans_seq=False, attr_type='semantic',
-                 num_process=1, version='v1'):
+                 num_process=1, version='v1',
+                 bucket_by_length=False, seed=None):
         self._data_queue = None
         self._prefetch_procs = []
         self._batch_size = batch_size
@@ -32,9 +37,15 @@ class AttentionDataReader(object):
         self._attr_type = attr_type
         self._n_process = num_process
         self._version = version
+        self._bucket_by_length = bucket_by_length
+        self._seed = seed
 
     def start(self):
         self._data_queue = Queue(10)
+        # the workers shard the same permutations of an epoch
+        seed = self._seed
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - 1)
         for proc_id in range(self._n_process):
             proc = AttentionDataPrefetcher(self._data_queue,
                                            proc_id,
@@ -46,7 +57,10 @@ class AttentionDataReader(object):
                                            self._output_qa,
                                            self._output_ans_seq,
                                            self._attr_type,
-                                           self._version)
+                                           self._version,
+                                           self._n_process,
+                                           self._bucket_by_length,
+                                           seed)
             proc.start()
             self._prefetch_procs.append(proc)
 
@@ -75,7 +89,8 @@ class AttentionDataPrefetcher(Process):
                  subset='trainval', output_im=True,
                  output_attr=True, output_capt=True,
                  output_qa=False, output_ans_seq=False,
-                 attr_type='semantic', version='v1'):
+                 attr_type='semantic', version='v1',
+                 num_shards=1, bucket_by_length=False, seed=0):
         super(AttentionDataPrefetcher, self).__init__()
         self._batch_size = batch_size
         self._proc_id = proc_id
@@ -100,8 +115,8 @@ class AttentionDataPrefetcher(Process):
         # captions
         self._captions = None
         self._caption_len = None
-        self._image_id2capt_index = None
-        self._n_capts_vqa_order = None
+        self._capt_index = None
+        self._vqa_index2capt_group = None
         # attributes
         self._attributes = None
         self._vqa_index2att_index = None
@@ -109,6 +124,11 @@ class AttentionDataPrefetcher(Process):
         self._num = None
         self._valid_ids = None
         self._load_data()
+        self._scheduler = BatchScheduler(self._valid_ids, self._batch_size,
+                                         proc_id, num_shards,
+                                         lengths=self._quest_len,
+                                         bucket_by_length=bucket_by_length,
+                                         seed=seed)
 
     def print_outputs(self):
         print('\n======== output statistic: ===========')
@@ -168,17 +188,8 @@ class AttentionDataPrefetcher(Process):
         self._captions = d['capt_arr']
         self._caption_len = d['capt_len']
         capt_image_ids = d['image_ids']
-        image_id2capt_index = {}
-        for i, image_id in enumerate(capt_image_ids):
-            if image_id in image_id2capt_index:
-                image_id2capt_index[image_id].append(i)
-            else:
-                image_id2capt_index[image_id] = [i]
-        # length check
-        n_capts_vqa_order = [len(image_id2capt_index[image_id])
-                             for image_id in self._vqa_image_ids]
-        self._n_capts_vqa_order = np.array(n_capts_vqa_order, dtype=np.int32)
-        self._image_id2capt_index = image_id2capt_index
+        self._capt_index = CSRIndex.load_or_build(capt_image_ids, data_file)
+        self._vqa_index2capt_group = self._capt_index.lookup(self._vqa_image_ids)
 
     def _load_attributes(self):
         data_file = 'data/attribute_std_mscoco_%s.data' % self._subset
@@ -196,9 +207,7 @@ class AttentionDataPrefetcher(Process):
             self._valid_ids = np.arange(self._num)
 
     def pop_batch(self):
-        index = np.random.choice(self._valid_ids,
-                                 size=self._batch_size,
-                                 replace=False)
+        index = self._scheduler.next_batch()
         outputs = []
         if self._output_im:
             feats = self._load_image_features(index)
@@ -255,12 +264,9 @@ class AttentionDataPrefetcher(Process):
         return self._answer[index]
 
     def _slice_caption(self, quest_index):
-        image_ids = self._vqa_image_ids[quest_index]
         # sample captions
-        n_capts = self._n_capts_vqa_order[quest_index]
-        capt_tmp_inds = [np.random.randint(n) for n in n_capts]
-        capt_index = [self._image_id2capt_index[image_id][capt_i]
-                      for image_id, capt_i in zip(image_ids, capt_tmp_inds)]
+        capt_groups = self._vqa_index2capt_group[quest_index]
+        capt_index = self._capt_index.sample(capt_groups)
         # slice captions
         capt_len = self._caption_len[capt_index]
         max_len = capt_len.max()
@@ -299,8 +305,8 @@ class AttentionTestDataFetcher(object):
         # captions
         self._captions = None
         self._caption_len = None
-        self._image_id2capt_index = None
-        self._n_capts_vqa_order = None
+        self._capt_index = None
+        self._vqa_index2capt_group = None
         # attributes
         self._attributes = None
         self._vqa_index2att_index = None
@@ -311,6 +317,8 @@ class AttentionTestDataFetcher(object):
         #
         self._idx = 0
         self._index = np.arange(self._num)
+        self._num_prefetch_workers = num_process or 0
+        self._prefetcher = None
         self.print_outputs()
 
     def print_outputs(self):
@@ -367,17 +375,8 @@ class AttentionTestDataFetcher(object):
         self._captions = d['capt_arr']
         self._caption_len = d['capt_len']
         capt_image_ids = d['image_ids']
-        image_id2capt_index = {}
-        for i, image_id in enumerate(capt_image_ids):
-            if image_id in image_id2capt_index:
-                image_id2capt_index[image_id].append(i)
-            else:
-                image_id2capt_index[image_id] = [i]
-        # length check
-        n_capts_vqa_order = [len(image_id2capt_index[image_id])
-                             for image_id in self._vqa_image_ids]
-        self._n_capts_vqa_order = np.array(n_capts_vqa_order, dtype=np.int32)
-        self._image_id2capt_index = image_id2capt_index
+        self._capt_index = CSRIndex.load_or_build(capt_image_ids, data_file)
+        self._vqa_index2capt_group = self._capt_index.lookup(self._vqa_image_ids)
 
     def _load_global_image_feature(self):
         subset = 'kptest' if self._subset == 'bs_test' else self._subset
@@ -410,8 +409,30 @@ class AttentionTestDataFetcher(object):
         self._idx += this_batch_size
         return index
 
+    def start(self):
+        if self._num_prefetch_workers > 0 and self._prefetcher is None:
+            num_remaining = int(ceil((self._num - self._idx) / float(self._batch_size)))
+            self._prefetcher = OrderedPrefetcher(self._load_test_batch,
+                                                 self._get_sequencial_index,
+                                                 num_remaining,
+                                                 self._num_prefetch_workers)
+            self._prefetcher.start()
+
+    def stop(self):
+        if self._prefetcher is not None:
+            # rewind to the first batch that was not delivered
+            undelivered = self._prefetcher.stop()
+            self._idx -= sum([len(index) for index in undelivered])
+            self._prefetcher = None
+
     def get_test_batch(self):
+        self.start()
+        if self._prefetcher is not None and self._prefetcher.has_next():
+            return self._prefetcher.pop_batch()
         index = self._get_sequencial_index()
+        return self._load_test_batch(index)
+
+    def _load_test_batch(self, index):
         outputs = []
         if self._output_im:
             feats = self._load_image_features(index)
@@ -458,12 +479,9 @@ class AttentionTestDataFetcher(object):
         return seq, a_len
 
     def _slice_caption(self, quest_index):
-        image_ids = self._vqa_image_ids[quest_index]
         # sample captions
-        n_capts = self._n_capts_vqa_order[quest_index]
-        capt_tmp_inds = [np.random.randint(n) for n in n_capts]
-        capt_index = [self._image_id2capt_index[image_id][capt_i]
-                      for image_id, capt_i in zip(image_ids, capt_tmp_inds)]
+        capt_groups = self._vqa_index2capt_group[quest_index]
+        capt_index = self._capt_index.sample(capt_groups)
         # slice captions
         capt_len = self._caption_len[capt_index]
         max_len = capt_len.max()
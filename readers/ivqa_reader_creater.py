@@ -1,19 +1,20 @@
-# VAQ
-from readers import ivqa_general_data_fetcher
-from readers import ivqa_answer_type_data_fetcher
-from readers import ivqa_full_data_fetcher
-from readers import ivqa_rerank_data_fetcher
-from readers import vqa_general_data_fetcher
-from readers import vqa_general_data_fetcher_v7w
-from readers import vqg_general_data_fetcher
-from readers import ivqa_rl_data_fetcher
-from readers import ivqa_basicplus_data_fetcher
-from readers import vert_base_data_fetcher
-
 _NUM_PREFETCH_PROCESS = 2
+# group training samples of similar question length into the same batch
+_BUCKET_BY_LENGTH = False
 
 
 def _reader_config():
+    # fetcher modules are only imported when a reader is created
+    from readers import ivqa_general_data_fetcher
+    from readers import ivqa_answer_type_data_fetcher
+    from readers import ivqa_full_data_fetcher
+    from readers import ivqa_rerank_data_fetcher
+    from readers import vqa_general_data_fetcher
+    from readers import vqa_general_data_fetcher_v7w
+    from readers import vqg_general_data_fetcher
+    from readers import ivqa_rl_data_fetcher
+    from readers import ivqa_basicplus_data_fetcher
+    from readers import vert_base_data_fetcher
     reader_config = {
         'VQG': {'train_fetcher': ivqa_general_data_fetcher.AttentionDataReader,
                 'test_fetcher': ivqa_general_data_fetcher.AttentionTestDataFetcher,
@@ -46,11 +47,13 @@ def _reader_config():
         'VAQ-Epoch': {'train_fetcher': ivqa_rl_data_fetcher.AttentionDataReader,
                       'test_fetcher': ivqa_rl_data_fetcher.AttentionTestDataFetcher,
                       'use_res5c': False, 'use_attr': True, 'output_answer': True,
-                      'attr_type': 'res152'},
+                      'attr_type': 'res152',
+                      'bucket_by_length': False},
         'VAQ-EpochAtt': {'train_fetcher': ivqa_rl_data_fetcher.AttentionDataReader,
                          'test_fetcher': ivqa_rl_data_fetcher.AttentionTestDataFetcher,
                          'use_res5c': True, 'use_attr': True, 'output_answer': True,
-                         'attr_type': 'res152'},
+                         'attr_type': 'res152',
+                         'bucket_by_length': False},
         'VQG-Var': {'train_fetcher': vqg_general_data_fetcher.AttentionDataReader,
                     'test_fetcher': vqg_general_data_fetcher.AttentionTestDataFetcher,
                     'use_res5c': False, 'use_attr': True, 'output_answer': True,
@@ -127,6 +130,7 @@ def create_reader(model_type, phase='train'):
     output_res5c = model_config['use_res5c']
     output_answer = model_config['output_answer']
     attr_type = model_config['attr_type']
+    bucket_by_length = model_config.get('bucket_by_length', _BUCKET_BY_LENGTH)
     print(model_type)
     print(attr_type)
     output_qa = phase == 'train' or model_type == 'VAQ-CA' or model_type == 'VAQ-Epoch' or model_type == 'VAQ-VIS' \
@@ -136,6 +140,9 @@ def create_reader(model_type, phase='train'):
     #             or 'VQA-VarDS' or 'V7W' in model_type  # or model_type == 'VAQ-SAT'
 
     def _creater_general_reader(batch_size, subset='kptrain', version='v1'):
+        kwargs = {}
+        if phase == 'train' and bucket_by_length:
+            kwargs['bucket_by_length'] = True
         reader = create_fn(batch_size,
                            subset,
                            output_feat=output_res5c,
@@ -145,7 +152,8 @@ def create_reader(model_type, phase='train'):
                            output_ans_seq=output_answer,
                            attr_type=attr_type,
                            num_process=_NUM_PREFETCH_PROCESS,
-                           version=version)
+                           version=version,
+                           **kwargs)
         return reader
 
     return _creater_general_reader
@@ -0,0 +1,55 @@
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+class OrderedPrefetcher(object):
+    """
+    Loads the batches of a sequential (test) fetcher in background threads.
+
+    Batch indices are generated in the calling thread, in order, and each
+    one is handed to load_fn in a thread pool. At most num_prefetch batches
+    are in flight, and pop_batch returns them in the order of the indices,
+    so outputs are identical to loading the batches synchronously. stop
+    returns the indices of the batches that were issued but not delivered,
+    so that the fetcher can rewind to the first of them.
+    """
+
+    def __init__(self, load_fn, index_fn, num_batches, num_workers=2,
+                 num_prefetch=None):
+        self._load_fn = load_fn
+        self._index_fn = index_fn
+        self._num_batches = num_batches
+        self._num_workers = num_workers
+        self._num_prefetch = num_prefetch or 2 * num_workers
+        self._pool = None
+        self._pending = deque()
+        self._num_issued = 0
+
+    def start(self):
+        self._pool = ThreadPool(self._num_workers)
+        self._fill()
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        undelivered = [index for index, _ in self._pending]
+        self._pending.clear()
+        return undelivered
+
+    def _fill(self):
+        while len(self._pending) < self._num_prefetch and \
+                self._num_issued < self._num_batches:
+            index = self._index_fn()
+            self._pending.append((index, self._pool.apply_async(self._load_fn, (index,))))
+            self._num_issued += 1
+
+    def has_next(self):
+        return len(self._pending) > 0
+
+    def pop_batch(self):
+        _, result = self._pending.popleft()
+        outputs = result.get()
+        self._fill()
+        return outputs
@@ -4,6 +4,7 @@ import os
 from util import load_hdf5, load_json
 from multiprocessing import Process, Queue
 from math import ceil
+from readers.ordered_prefetcher import OrderedPrefetcher
 
 # FEAT_ROOT = 'data/resnet_res5c'
 FEAT_ROOT = 'data'
@@ -291,13 +292,15 @@ class RetrievalDataPrefetcher(Process):
 
 
 class RerankTestFetcher(object):
-    def __init__(self, batch_size=32):
+    def __init__(self, batch_size=32, num_workers=2):
         self._batch_size = batch_size
         self._idx = 0
         self._n_cands = 10
         self.load_data()
         self._num = self.quest_ids.size
         self._index = np.arange(self._num)
+        self._num_prefetch_workers = num_workers
+        self._prefetcher = None
 
     def load_data(self):
         self._load_qa_data()
@@ -343,8 +346,30 @@ class RerankTestFetcher(object):
         self._idx += this_batch_size
         return index
 
+    def start(self):
+        if self._num_prefetch_workers > 0 and self._prefetcher is None:
+            num_remaining = int(ceil((self._num - self._idx) / float(self._batch_size)))
+            self._prefetcher = OrderedPrefetcher(self._load_batch,
+                                                 self._get_sequencial_index,
+                                                 num_remaining,
+                                                 self._num_prefetch_workers)
+            self._prefetcher.start()
+
+    def stop(self):
+        if self._prefetcher is not None:
+            # rewind to the first batch that was not delivered
+            undelivered = self._prefetcher.stop()
+            self._idx -= sum([len(index) for index in undelivered])
+            self._prefetcher = None
+
     def pop_batch(self):
+        self.start()
+        if self._prefetcher is not None and self._prefetcher.has_next():
+            return self._prefetcher.pop_batch()
         index = self._get_sequencial_index()
+        return self._load_batch(index)
+
+    def _load_batch(self, index):
         im = self._get_image_feature(index)
         q_arr, q_len, a_arr, a_len = self._get_qa_sequences(index)
         return im, q_arr, q_len, a_arr, a_len
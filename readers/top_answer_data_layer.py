@@ -1,8 +1,9 @@
+import numpy as np
 import tensorflow as tf
 from util import load_hdf5
 
 
-class PinnedDataManager(object):
+class ConstantDataManager(object):
     def __init__(self, data):
         _data = tf.constant(data, dtype=tf.int32)
         data_shape = _data.get_shape().as_list()
@@ -10,6 +11,9 @@ class PinnedDataManager(object):
         self._num_datum = data_shape[0]
         self._data = tf.reshape(_data, [self._num_datum, -1])
 
+    def initialize(self, sess):
+        pass
+
     def get_data_by_index(self, indices):
         batch_data = tf.gather(self._data, indices)
         # pre-precessing and data augmentation
@@ -18,14 +22,42 @@ class PinnedDataManager(object):
         return batch_data
 
 
+class PinnedDataManager(ConstantDataManager):
+    """
+    Same as ConstantDataManager, but the data lives in a non-trainable
+    variable initialised from a placeholder, so the array is not serialised
+    into the GraphDef. The variable is kept out of the variable collections
+    (savers and initialisers skip it), call initialize(sess) once the
+    session is created.
+    """
+
+    def __init__(self, data):
+        self._value = np.asarray(data, dtype=np.int32)
+        data_shape = list(self._value.shape)
+        self._datum_shape = data_shape[1:]
+        self._num_datum = data_shape[0]
+        self._init_value = tf.placeholder(tf.int32, shape=data_shape)
+        self._var = tf.Variable(self._init_value, trainable=False,
+                                collections=[], name='pinned_data')
+        self._data = tf.reshape(self._var, [self._num_datum, -1])
+
+    def initialize(self, sess):
+        sess.run(self._var.initializer,
+                 feed_dict={self._init_value: self._value})
+
+
 class TopAnswerDataLayer(object):
-    def __init__(self, top_ans_file, k):
+    def __init__(self, top_ans_file, k, data_manager=PinnedDataManager):
         print('Answer layer: Loading top answer sequences')
         d = load_hdf5(top_ans_file)
         self.k = k
         self.data_len = d['answer_seq'].shape[-1]
-        self._answer_seq = PinnedDataManager(d['answer_seq'])
-        self._answer_len = PinnedDataManager(d['answer_seq_len'])
+        self._answer_seq = data_manager(d['answer_seq'])
+        self._answer_len = data_manager(d['answer_seq_len'])
+
+    def initialize(self, sess):
+        self._answer_seq.initialize(sess)
+        self._answer_len.initialize(sess)
 
     def get_top_answer_sequences(self, top_k_indices):
         k = tf.shape(top_k_indices)[1]
@@ -80,9 +112,9 @@ def test_top_answer_layer():
 
     top_ans_file = 'data/top_answer2000_sequences.h5'
     answer_pool = TopAnswerDataLayer(top_ans_file, k=4)
+    answer_pool.initialize(tf.get_default_session())
     top_answer_list = load_top_answer_list()
 
-    import numpy as np
     ind = np.random.randint(low=0, high=len(top_answer_list), size=[5, 4],
                             dtype=np.int32)
     top_k_ind = tf.constant(ind, dtype=tf.int32)
@@ -103,6 +135,31 @@ def test_top_answer_layer():
     print('\nFinish test top answer layer\nPassed: %d/%d' % (num_passed, num_test))
 
 
+def benchmark_top_answer_layer(top_ans_file='data/top_answer2000_sequences.h5',
+                               num_repeats=5):
+    import os
+    import tempfile
+    from time import time
+    for data_manager in [ConstantDataManager, PinnedDataManager]:
+        build_time, meta_size = 0., 0
+        for _ in range(num_repeats):
+            t = time()
+            with tf.Graph().as_default():
+                answer_pool = TopAnswerDataLayer(top_ans_file, k=4,
+                                                 data_manager=data_manager)
+                top_k_ind = tf.placeholder(tf.int32, [None, 4])
+                answer_pool.get_top_answer_sequences(top_k_ind)
+                build_time += time() - t
+                meta_file = os.path.join(tempfile.mkdtemp(), 'model.meta')
+                tf.train.export_meta_graph(meta_file)
+                meta_size = os.path.getsize(meta_file)
+        print('%s: build %0.2f ms, meta graph %0.1f KB' % (
+            data_manager.__name__, build_time * 1000. / num_repeats,
+            meta_size / 1024.))
+
+
 if __name__ == '__main__':
-    test_top_answer_layer()
+    with tf.Session().as_default():
+        test_top_answer_layer()
+    benchmark_top_answer_layer()
 
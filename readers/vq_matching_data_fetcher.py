@@ -101,13 +101,6 @@ class AttentionDataPrefetcher(Process):
         self.quest_id2index = {qid: i for i, qid in enumerate(self._quest_ids)}
         vqa_image_ids = [find_image_id_from_fname(im_name) for im_name in self._images]
         self._vqa_image_ids = np.array(vqa_image_ids, dtype=np.int32)
-        image_id2quest_ids = {}
-        for qid, im_id in zip(self._quest_ids, self._vqa_image_ids):
-            if im_id in image_id2quest_ids:  # already create key
-                image_id2quest_ids[im_id].append(qid)
-            else:
-                image_id2quest_ids[im_id] = [qid]
-        self.image_id2quest_ids = image_id2quest_ids
 
         # load QA data
         d = load_hdf5(data_file)
@@ -123,23 +116,22 @@ class AttentionDataPrefetcher(Process):
     def _sample_question_index(self):
         index = np.random.choice(self._valid_ids, size=(self._batch_size,),
                                  replace=False)
-        image_ids = self._vqa_image_ids[index]
-
-        cst_quest_index = []
-        for image_id in image_ids:  # add two contrastive
-            # cst_quest_index.append(self._add_contrastive_question(image_id))
-            cst_quest_index.append(self._add_contrastive_question(image_id))
-        return index, np.array(cst_quest_index, dtype=np.int32)
-
-    def _add_contrastive_question(self, image_id):
-        nn_qids = self.im_nn_qids[image_id]
-        while True:
-            _tmp_qid = int(np.random.choice(self._quest_ids, size=(1,)))
-            if _tmp_qid in nn_qids:
-                continue
-            else:
-                break
-        return self.quest_id2index[_tmp_qid]
+        cst_quest_index = self._add_contrastive_questions(index)
+        return index, cst_quest_index
+
+    def _add_contrastive_questions(self, index):
+        # a question is contrastive if its image is not a neighbour of the
+        # anchor image, rejected samples are redrawn for the whole batch
+        anchor_nns = self._feat_nns[self._vqa_index2feat_index[index]]
+        cst_index = np.zeros_like(index, dtype=np.int32)
+        pending = np.arange(index.size)
+        while pending.size > 0:
+            cand = np.random.randint(self._num, size=pending.size)
+            cand_feat = self._vqa_index2feat_index[cand]
+            is_nn = np.any(anchor_nns[pending] == cand_feat[:, np.newaxis], axis=1)
+            cst_index[pending[~is_nn]] = cand[~is_nn]
+            pending = pending[is_nn]
+        return cst_index
 
     def _load_global_image_feature(self):
         data_file = 'data/res152_std_mscoco_%s.data' % self._subset
@@ -156,14 +148,7 @@ class AttentionDataPrefetcher(Process):
         num = self._feat.shape[0]
         self_index = np.reshape(np.arange(num), [num, 1])
         nns = np.concatenate([self_index, nns], axis=1)  # index of NN
-        im_nn_qids = {}
-        for _nn, _image_id in zip(nns, image_ids):
-            _nn_qids = []
-            for _nn_idx in _nn:
-                _tmp_image_id = image_ids[_nn_idx]
-                _nn_qids += self.image_id2quest_ids[_tmp_image_id]
-            im_nn_qids[_image_id] = {_qid: None for _qid in _nn_qids}
-        self.im_nn_qids = im_nn_qids
+        self._feat_nns = nns
 
     def _load_caption_feature(self):
         data_file = 'data/capt1k_std_mscoco_%s.data' % self._subset
@@ -50,8 +50,8 @@ class AttentionDataReader(object):
             #     idx += 1
             # print('\n Added %d works in %0.2f sec.' % (idx, time()-t))
 
-    def backup_statistics(self):
-        self._sampler.backup_statistics()
+    def backup_statistics(self, writer=None):
+        self._sampler.backup_statistics(writer)
 
     def start(self):
         self._data_queue = Queue(10)
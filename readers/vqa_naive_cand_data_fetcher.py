@@ -2,6 +2,8 @@ import numpy as np
 import os
 from util import load_hdf5, load_json, get_feature_root, find_image_id_from_fname
 from multiprocessing import Process, Queue
+from math import ceil
+from readers.ordered_prefetcher import OrderedPrefetcher
 from readers.curriculum_sampler import CurriculumSampler
 
 _DATA_ROOT = './'
@@ -216,7 +218,7 @@ class AttentionDataPrefetcher(Process):
 class AttentionFetcher(object):
     def __init__(self, batch_size, subset='kptest',
                  feat_type='res5c', version='v2',
-                 var_suffix='var_'):
+                 var_suffix='var_', num_workers=2):
         self._batch_size = batch_size
         self._num_top_ans = 2000
         self._subset = subset
@@ -239,6 +241,8 @@ class AttentionFetcher(object):
         self._idx = 0
         self._index = np.arange(self._num)
         self._is_test = True
+        self._num_prefetch_workers = num_workers
+        self._prefetcher = None
 
     @property
     def num_batches(self):
@@ -247,10 +251,21 @@ class AttentionFetcher(object):
         return int(n)
 
     def start(self):
-        pass
+        if self._num_prefetch_workers > 0 and self._prefetcher is None \
+                and self._is_test:
+            num_remaining = int(ceil((self._num - self._idx) / float(self._batch_size)))
+            self._prefetcher = OrderedPrefetcher(self._load_test_batch,
+                                                 self._get_sequencial_index,
+                                                 num_remaining,
+                                                 self._num_prefetch_workers)
+            self._prefetcher.start()
 
     def stop(self):
-        pass
+        if self._prefetcher is not None:
+            # rewind to the first batch that was not delivered
+            undelivered = self._prefetcher.stop()
+            self._idx -= sum([len(index) for index in undelivered])
+            self._prefetcher = None
 
     def _load_data(self):
         meta_file = os.path.join(_DATA_ROOT,
@@ -323,7 +338,13 @@ class AttentionFetcher(object):
             return self._get_rand_index()
 
     def get_test_batch(self):
+        self.start()
+        if self._prefetcher is not None and self._prefetcher.has_next():
+            return self._prefetcher.pop_batch()
         index = self.get_index()
+        return self._load_test_batch(index)
+
+    def _load_test_batch(self, index):
         image_id = self._vqa_image_ids[index]
         feats = self._slice_image(index)
         q, q_len = self._slice_questions(index)
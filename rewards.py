@@ -1,11 +1,7 @@
-import tensorflow as tf
 import numpy as np
-from models.vqa_soft_attention import AttentionModel as VQAAgent
-from vqa_config import ModelConfig
-from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
 from config import VOCAB_CONFIG
 from inference_utils.question_generator_util import SentenceGenerator
-from bleu_eval.bleu import Bleu
+from lazy_object import LazyObject
 from collections import OrderedDict
 
 # import sys
@@ -17,7 +13,7 @@ import pdb
 END_TOKEN = VOCAB_CONFIG.end_token_id
 START_TOKEN = VOCAB_CONFIG.start_token_id
 
-_SENT = SentenceGenerator(trainset='trainval')
+_SENT = LazyObject(SentenceGenerator, trainset='trainval')
 
 
 def _parse_pred_questions(capt, capt_len):
@@ -106,8 +102,10 @@ class IVQARewards(object):
         self.use_vqa_reward = use_vqa_reward and self.gamma > 0
         # self.cider_scorer = ciderEval('ivqa_train_idxs')
         if metric == 'cider':
+            from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
             self.scorer = ciderEval('v2_ivqa_train_idxs')
         elif metric == 'bleu':
+            from bleu_eval.bleu import Bleu
             self.scorer = Bleu(n=4)
         # self.cider_scorer = CiderD(df='v2_ivqa_train_idxs')
         if self.use_vqa_reward:
@@ -115,6 +113,9 @@ class IVQARewards(object):
                 self._build_vqa_agent()
 
     def _build_vqa_agent(self):
+        import tensorflow as tf
+        from models.vqa_soft_attention import AttentionModel as VQAAgent
+        from vqa_config import ModelConfig
         with tf.variable_scope('vqa_agent'):
             self.vqa_agent = VQAAgent(config=ModelConfig(),
                                       phase='test')
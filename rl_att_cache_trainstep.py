@@ -1,7 +1,10 @@
 from post_process_variation_questions import post_process_variation_questions_noise, prepare_reinforce_data, \
     wrap_samples_for_language_model, _parse_gt_questions, put_to_array, correct_language_model_inputs
+from post_process_variation_questions import trainstep_batch_builders
 import numpy as np
+import step_profiler
 import pdb
+from lazy_object import LazyObject
 
 
 class QuestionContext(object):
@@ -45,25 +48,29 @@ class QuestionContext(object):
         return np.concatenate([arr1, arr2], 0)
 
 
-_Q_CTX = QuestionContext(batch_size=2 * 16, pad_token=15953)
+_Q_CTX = LazyObject(QuestionContext, batch_size=2 * 16, pad_token=15953)
 
 
 def reinforce_trainstep(reader, model, env, sess, task_ops):
-    outputs = reader.pop_batch()
+    lm_builder, reinforce_builder = trainstep_batch_builders()
+    with step_profiler.phase('pop_batch'):
+        outputs = reader.pop_batch()
     quest_ids, res5c, images, quest, quest_len, top_ans, ans, ans_len = outputs
     # random sampling
-    noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
+    with step_profiler.phase('sampling'):
+        noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
     _this_batch_size = images.shape[0]
-    scores, pathes, noise = post_process_variation_questions_noise(scores,
-                                                                   pathes,
-                                                                   noise_vec,
-                                                                   _this_batch_size,
-                                                                   find_unique=False)
-
-    lm_inputs = wrap_samples_for_language_model(sampled=pathes,
-                                                pad_token=model.pad_token - 1,
-                                                gts=[quest, quest_len],
-                                                max_length=20)
+    with step_profiler.phase('post_process'):
+        scores, pathes, noise = post_process_variation_questions_noise(scores,
+                                                                       pathes,
+                                                                       noise_vec,
+                                                                       _this_batch_size,
+                                                                       find_unique=False)
+        lm_inputs = wrap_samples_for_language_model(sampled=pathes,
+                                                    pad_token=model.pad_token - 1,
+                                                    gts=[quest, quest_len],
+                                                    max_length=20,
+                                                    builder=lm_builder)
 
     def _show_examples(arr, arr_len, _rewards, name):
         ps = _parse_gt_questions(arr, arr_len)
@@ -78,12 +85,15 @@ def reinforce_trainstep(reader, model, env, sess, task_ops):
     vqa_inputs = [images, res5c, ans, ans_len, top_ans]
     # lm_inputs = lm_inputs[:2]
     wrapped_sampled = lm_inputs[:2]
-    rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
-                                                           [vqa_inputs, wrapped_sampled,
-                                                            scores, quest_ids])
+    with step_profiler.phase('reward'):
+        rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
+                                                               [vqa_inputs, wrapped_sampled,
+                                                                scores, quest_ids])
 
-    max_path_arr, max_path_len, max_noise, max_rewards = \
-        prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token)
+    with step_profiler.phase('prepare'):
+        max_path_arr, max_path_len, max_noise, max_rewards = \
+            prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token,
+                                   builder=reinforce_builder)
 
     # _show_examples(max_path_arr, max_path_len, is_gt, 'Sampled')
     # pdb.set_trace()
@@ -95,7 +105,7 @@ def reinforce_trainstep(reader, model, env, sess, task_ops):
     avg_reward = max_rewards.mean()
 
     # train op
-    sess_outputs = sess.run(task_ops, feed_dict=model.fill_feed_dict(sess_in))
+    sess_outputs = step_profiler.run(sess, task_ops, model.fill_feed_dict(sess_in))
     sess_outputs += [avg_reward, 'reward']
 
     # update language model
@@ -112,5 +122,6 @@ def reinforce_trainstep(reader, model, env, sess, task_ops):
         # _show_examples(corrected_inputs[2], corrected_inputs[3], np.zeros_like(corrected_inputs[3]), 'Real')
         # pdb.set_trace()
         if num_fake_in_batch > 0:
-            env.lm.trainstep(corrected_inputs)
+            with step_profiler.phase('lm_update'):
+                env.lm.trainstep(corrected_inputs)
     return sess_outputs
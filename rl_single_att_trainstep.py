@@ -1,11 +1,14 @@
 from post_process_variation_questions import post_process_variation_questions_noise, prepare_reinforce_data, \
     wrap_samples_for_language_model, _parse_gt_questions, put_to_array, correct_language_model_inputs
+from post_process_variation_questions import trainstep_batch_builders
 import numpy as np
+import step_profiler
 from var_ivqa_rewards import serialize_path
 import operator
 from collections import defaultdict
 import os
 import pdb
+from lazy_object import LazyObject
 
 
 class QuestionContext(object):
@@ -49,7 +52,7 @@ class QuestionContext(object):
         return np.concatenate([arr1, arr2], 0)
 
 
-_Q_CTX = QuestionContext(batch_size=4, pad_token=15953)
+_Q_CTX = LazyObject(QuestionContext, batch_size=4, pad_token=15953)
 
 
 class VQABelief(object):
@@ -97,12 +100,11 @@ class VQABelief(object):
         print('Iter %d: Find %d unique questions for question %d' %
               (self.iter, valid_len, quest_id))
         exampels = []
-        self.sampled = []
-        for p, v in self.sorted_memory[:valid_len]:
-            # v = self.memory[p]
-            tokens = [int(t) for t in p.split(' ')]
-            sent = env.to_sentence.index_to_question(tokens)
-            self.sampled.append(tokens)
+        self.sampled = [[int(t) for t in p.split(' ')]
+                        for p, _ in self.sorted_memory[:valid_len]]
+        sents = env.to_sentence.index_to_questions(*put_to_array(self.sampled)) \
+            if self.sampled else []
+        for (p, v), sent in zip(self.sorted_memory[:valid_len], sents):
             p_str = '%s (%0.2f)' % (sent, v)
             exampels.append(p_str)
             print(p_str)
@@ -120,6 +122,7 @@ class VQABelief(object):
 
 
 def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief):
+    lm_builder, reinforce_builder = trainstep_batch_builders()
     # reader_outputs = reader.pop_batch()
     # quest_ids, images, quest, quest_len, top_ans, ans, ans_len = reader_outputs
     # select the first image
@@ -134,18 +137,20 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
     # selected = [_reshape_array(v[idx]) for v in reader_outputs]
     res5c, images, quest, quest_len, top_ans, ans, ans_len, quest_ids, image_ids = reader_outputs
     # random sampling
-    noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
+    with step_profiler.phase('sampling'):
+        noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
     _this_batch_size = images.shape[0]
-    scores, pathes, noise = post_process_variation_questions_noise(scores,
-                                                                   pathes,
-                                                                   noise_vec,
-                                                                   _this_batch_size,
-                                                                   find_unique=False)
-
-    lm_inputs = wrap_samples_for_language_model(sampled=pathes,
-                                                pad_token=model.pad_token - 1,
-                                                gts=[quest, quest_len],
-                                                max_length=20)
+    with step_profiler.phase('post_process'):
+        scores, pathes, noise = post_process_variation_questions_noise(scores,
+                                                                       pathes,
+                                                                       noise_vec,
+                                                                       _this_batch_size,
+                                                                       find_unique=False)
+        lm_inputs = wrap_samples_for_language_model(sampled=pathes,
+                                                    pad_token=model.pad_token - 1,
+                                                    gts=[quest, quest_len],
+                                                    max_length=20,
+                                                    builder=lm_builder)
 
     def _show_examples(arr, arr_len, _rewards, name):
         ps = _parse_gt_questions(arr, arr_len)
@@ -160,12 +165,15 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
     vqa_inputs = [images, res5c, ans, ans_len, top_ans]
     # lm_inputs = lm_inputs[:2]
     wrapped_sampled = lm_inputs[:2]
-    rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
-                                                           [vqa_inputs, wrapped_sampled,
-                                                            scores, quest_ids])
+    with step_profiler.phase('reward'):
+        rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
+                                                               [vqa_inputs, wrapped_sampled,
+                                                                scores, quest_ids])
 
-    max_path_arr, max_path_len, max_noise, max_rewards = \
-        prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token)
+    with step_profiler.phase('prepare'):
+        max_path_arr, max_path_len, max_noise, max_rewards = \
+            prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token,
+                                   builder=reinforce_builder)
 
     vqa_scores = rewards_all[:, 0]
     language_scores = rewards_all[:, 2]
@@ -184,7 +192,7 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
     avg_reward = max_rewards.mean()
 
     # train op
-    sess_outputs = sess.run(task_ops, feed_dict=model.fill_feed_dict(sess_in))
+    sess_outputs = step_profiler.run(sess, task_ops, model.fill_feed_dict(sess_in))
     sess_outputs += [avg_reward, 'reward']
 
     # update language model
@@ -202,6 +210,7 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
         # pdb.set_trace()
 
         if min(wrapped_sampled[1].size, wrapped_gt[1].size) > 0:
-            env.lm.trainstep(corrected_inputs)
+            with step_profiler.phase('lm_update'):
+                env.lm.trainstep(corrected_inputs)
     # _VQA_Belief.vertify_vqa(env, vqa_inputs)
     return sess_outputs
@@ -1,9 +1,12 @@
 from post_process_variation_questions import post_process_variation_questions_noise, prepare_reinforce_data, \
     wrap_samples_for_language_model, _parse_gt_questions, put_to_array, correct_language_model_inputs
+from post_process_variation_questions import trainstep_batch_builders
 import numpy as np
+import step_profiler
 from var_ivqa_rewards import serialize_path
 import os
 import pdb
+from lazy_object import LazyObject
 
 
 class QuestionContext(object):
@@ -47,7 +50,7 @@ class QuestionContext(object):
         return np.concatenate([arr1, arr2], 0)
 
 
-_Q_CTX = QuestionContext(batch_size=4, pad_token=15953)
+_Q_CTX = LazyObject(QuestionContext, batch_size=4, pad_token=15953)
 
 
 class VQABelief(object):
@@ -82,17 +85,19 @@ class VQABelief(object):
         # os.system('clear')
         print('Iter %d: Find %d unique questions for question %d' %
               (self.iter, len(self.memory), quest_id))
-        for p in self.memory.keys():
-            v = self.memory[p]
-            tokens = [int(t) for t in p.split(' ')]
-            sent = env.to_sentence.index_to_question(tokens)
-            print('%s (%0.2f)' % (sent, v))
+        paths = self.memory.keys()
+        tokens = [[int(t) for t in p.split(' ')] for p in paths]
+        sents = env.to_sentence.index_to_questions(*put_to_array(tokens)) \
+            if tokens else []
+        for p, sent in zip(paths, sents):
+            print('%s (%0.2f)' % (sent, self.memory[p]))
         mean_score = np.mean(self.memory.values())
         print('Mean VQA score: %0.2f' % mean_score)
         print('\n')
 
 
 def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief):
+    lm_builder, reinforce_builder = trainstep_batch_builders()
     # reader_outputs = reader.pop_batch()
     # quest_ids, images, quest, quest_len, top_ans, ans, ans_len = reader_outputs
     # select the first image
@@ -107,18 +112,20 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
     # selected = [_reshape_array(v[idx]) for v in reader_outputs]
     images, quest, quest_len, top_ans, ans, ans_len, quest_ids, image_ids = reader_outputs
     # random sampling
-    noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
+    with step_profiler.phase('sampling'):
+        noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
     _this_batch_size = images.shape[0]
-    scores, pathes, noise = post_process_variation_questions_noise(scores,
-                                                                   pathes,
-                                                                   noise_vec,
-                                                                   _this_batch_size,
-                                                                   find_unique=False)
-
-    lm_inputs = wrap_samples_for_language_model(sampled=pathes,
-                                                pad_token=model.pad_token - 1,
-                                                gts=[quest, quest_len],
-                                                max_length=20)
+    with step_profiler.phase('post_process'):
+        scores, pathes, noise = post_process_variation_questions_noise(scores,
+                                                                       pathes,
+                                                                       noise_vec,
+                                                                       _this_batch_size,
+                                                                       find_unique=False)
+        lm_inputs = wrap_samples_for_language_model(sampled=pathes,
+                                                    pad_token=model.pad_token - 1,
+                                                    gts=[quest, quest_len],
+                                                    max_length=20,
+                                                    builder=lm_builder)
 
     def _show_examples(arr, arr_len, _rewards, name):
         ps = _parse_gt_questions(arr, arr_len)
@@ -133,12 +140,15 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
     vqa_inputs = [images, ans, ans_len, top_ans]
     # lm_inputs = lm_inputs[:2]
     wrapped_sampled = lm_inputs[:2]
-    rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
-                                                           [vqa_inputs, wrapped_sampled,
-                                                            scores, quest_ids])
+    with step_profiler.phase('reward'):
+        rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
+                                                               [vqa_inputs, wrapped_sampled,
+                                                                scores, quest_ids])
 
-    max_path_arr, max_path_len, max_noise, max_rewards = \
-        prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token)
+    with step_profiler.phase('prepare'):
+        max_path_arr, max_path_len, max_noise, max_rewards = \
+            prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token,
+                                   builder=reinforce_builder)
 
     vqa_scores = rewards_all[:, 0]
     language_scores = rewards_all[:, 2]
@@ -157,7 +167,7 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
     avg_reward = max_rewards.mean()
 
     # train op
-    sess_outputs = sess.run(task_ops, feed_dict=model.fill_feed_dict(sess_in))
+    sess_outputs = step_profiler.run(sess, task_ops, model.fill_feed_dict(sess_in))
     sess_outputs += [avg_reward, 'reward']
 
     # update language model
@@ -175,5 +185,6 @@ def reinforce_trainstep(reader_outputs, model, env, sess, task_ops, _VQA_Belief)
         # pdb.set_trace()
 
         if min(wrapped_sampled[1].size, wrapped_gt[1].size) > 0:
-            env.lm.trainstep(corrected_inputs)
+            with step_profiler.phase('lm_update'):
+                env.lm.trainstep(corrected_inputs)
     return sess_outputs
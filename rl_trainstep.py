@@ -1,37 +1,41 @@
-from post_process_variation_questions import post_process_variation_questions_noise, prepare_reinforce_data, \
-    wrap_samples_for_language_model_v2, _parse_gt_questions, put_to_array, correct_language_model_inputs
+from post_process_variation_questions import _parse_gt_questions, put_to_array, correct_language_model_inputs
 import numpy as np
 import pdb
+import step_profiler
+from unique_sampling import sample_unique_questions
 
 from experience_replay import ReplayBuffer
 
 _replay_buffer = ReplayBuffer(batch_size=16, ratio=2)
 
 
-def reinforce_trainstep(reader, model, env, sess, task_ops):
-    outputs = reader.pop_batch()
+def reinforce_trainstep(reader, model, env, sess, task_ops, max_sampling_rounds=2):
+    with step_profiler.phase('pop_batch'):
+        outputs = reader.pop_batch()
     # pdb.set_trace()
     quest_ids, images, quest, quest_len, top_ans, ans, ans_len = outputs
     # random sampling
-    noise_vec, pathes, scores = model.random_sampling([images, ans, ans_len], sess)
-    _this_batch_size = images.shape[0]
-    scores, pathes, noise = post_process_variation_questions_noise(scores,
-                                                                   pathes,
-                                                                   noise_vec,
-                                                                   _this_batch_size,
-                                                                   find_unique=False)
-    wrapped_sampled, sampled_flat = \
-        wrap_samples_for_language_model_v2(sampled=pathes,
-                                           pad_token=model.pad_token - 1,
-                                           max_length=20)
+    with step_profiler.phase('sampling'):
+        # as many unique questions per image as one draw of the model
+        bundle = sample_unique_questions(model, sess, [images, ans, ans_len],
+                                         max_rounds=max_sampling_rounds)
+    with step_profiler.phase('post_process'):
+        scores, pathes, _ = bundle.nested()
+        wrapped_sampled = bundle.path_array(pad_token=model.pad_token - 1,
+                                            offset=1, max_length=20)
+        sampled_flat = bundle.to_lists(offset=1)  # keep end token
     # compute reward
     vqa_inputs = [images, ans, ans_len, top_ans]
-    rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
-                                                           [vqa_inputs, wrapped_sampled,
-                                                            scores, quest_ids])
+    with step_profiler.phase('reward'):
+        rewards, rewards_all, is_gt, aug_data = env.get_reward(pathes, [quest, quest_len],
+                                                               [vqa_inputs, wrapped_sampled,
+                                                                scores, quest_ids])
 
-    max_path_arr, max_path_len, max_noise, max_rewards = \
-        prepare_reinforce_data(pathes, noise, rewards, pad_token=model.pad_token)
+    with step_profiler.phase('prepare'):
+        max_path_arr, max_path_len = bundle.path_array(pad_token=model.pad_token)
+        max_noise = bundle.noise
+        max_len = max_path_arr.shape[1]
+        max_rewards = np.tile(rewards[:, np.newaxis], [1, max_len - 1])
 
     # _show_examples(max_path_arr, max_path_len, is_gt, 'Sampled')
     # pdb.set_trace()
@@ -43,12 +47,13 @@ def reinforce_trainstep(reader, model, env, sess, task_ops):
     avg_reward = max_rewards.mean()
 
     # train op
-    sess_outputs = sess.run(task_ops, feed_dict=model.fill_feed_dict(sess_in))
+    sess_outputs = step_profiler.run(sess, task_ops, model.fill_feed_dict(sess_in))
     sess_outputs += [avg_reward, 'reward']
 
     # update language model
     lm_scores = rewards_all[:, 2].flatten()
-    _replay_buffer.get_batch()
-    env.lm.trainstep(_replay_buffer.get_batch())
-    _replay_buffer.insert(sampled_flat, lm_scores)
+    with step_profiler.phase('lm_update'):
+        _replay_buffer.get_batch()
+        env.lm.trainstep(_replay_buffer.get_batch())
+        _replay_buffer.insert(sampled_flat, lm_scores)
     return sess_outputs
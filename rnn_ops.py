@@ -1,3 +1,5 @@
+import tensorflow.contrib.slim as slim
+from ops import split_op
 from rnn_compact_ops import *
 
 
@@ -24,3 +26,41 @@ def build_caption_inputs_and_targets(capt, capt_len):
     # length
     length = capt_len - 1
     return inputs, targets, length
+
+
+def build_in_graph_decoding_step(initial_state, word_embed, lstm_cell, vocab_size):
+    """
+    The LSTM step of a beam search inference graph once more, with the
+    states kept in the session: init_state_var copies the initial states to
+    state_var, then each run of topk_words/topk_logprobs extends the beams
+    at rows parent_feed of state_var, writes their new states back in place
+    and returns only the top_k_feed best words of each beam. Builds after
+    the step fed by state_feed, whose RNN and logits variables it reuses.
+    """
+    state_size = sum(lstm_cell.state_size)
+    # one row per beam, resized by every step, not saved with the model
+    state_var = tf.Variable(tf.zeros([0, state_size]), trainable=False,
+                            validate_shape=False, collections=[], name='state_var')
+    tf.assign(state_var, initial_state, validate_shape=False, name='init_state_var')
+    parent_feed = tf.placeholder(dtype=tf.int32, shape=[None], name='parent_feed')
+    top_k = tf.placeholder_with_default(3, shape=[], name='top_k_feed')
+
+    state_in = tf.reshape(tf.gather(state_var, parent_feed), [-1, state_size])
+    feed_c, feed_h = split_op(state_in, num_splits=2, axis=1)
+    with tf.variable_scope('RNN', reuse=True):
+        outputs, state_tuple = lstm_cell(inputs=tf.squeeze(word_embed,
+                                                           squeeze_dims=[1]),
+                                         state=LSTMStateTuple(feed_c, feed_h))
+    update_op = tf.assign(state_var, concat_op(state_tuple, 1),
+                          validate_shape=False)
+
+    outputs = tf.reshape(outputs, [-1, lstm_cell.output_size])
+    logits = slim.fully_connected(outputs, vocab_size, activation_fn=None,
+                                  scope='logits', reuse=True)
+    logprobs = tf.nn.log_softmax(logits)
+    topk_logprobs, topk_words = tf.nn.top_k(logprobs, top_k)
+    with tf.control_dependencies([update_op]):
+        tf.identity(topk_words, name='topk_words')
+        tf.identity(topk_logprobs, name='topk_logprobs')
+        # for clients of the whole distribution
+        tf.exp(logprobs, name='state_var_softmax')
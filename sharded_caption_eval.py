@@ -0,0 +1,179 @@
+"""
+Multi-process drop-in for COCOEvalCap, restricted to the metrics whose
+corpus score can be merged exactly from shards: BLEU (summed n-gram
+statistics), ROUGE_L and CIDEr (means of per-image scores). Image ids are
+split into contiguous shards, each shard is tokenised and scored in a
+worker. CIDEr is the CIDEr-D scorer of the toolkit, as in COCOEvalCap, with
+the document frequencies and the reference length computed once over all
+the references and shared by the forked workers.
+"""
+import sys
+import math
+from multiprocessing import Pool
+import numpy as np
+from util import get_dataset_root
+
+_, toolkit_dir = get_dataset_root()
+sys.path.insert(0, toolkit_dir)
+from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer
+from pycocoevalcap.bleu.bleu_scorer import BleuScorer
+from pycocoevalcap.rouge.rouge import Rouge
+from pycocoevalcap.cider.cider_scorer import CiderScorer
+
+_BLEU_METRICS = ['Bleu_1', 'Bleu_2', 'Bleu_3', 'Bleu_4']
+
+# state inherited by the forked workers
+_SHARED = {}
+
+
+class _CorpusCiderScorer(CiderScorer):
+    """
+    The toolkit CiderScorer, scoring a shard against the document
+    frequencies and reference length of the whole corpus. compute_cider
+    resets ref_len from the references it holds, so the corpus value is
+    pinned here.
+    """
+
+    def __init__(self, document_frequency, ref_len):
+        CiderScorer.__init__(self, n=4, sigma=6.0)
+        self.document_frequency = document_frequency
+        self._corpus_ref_len = ref_len
+
+    @property
+    def ref_len(self):
+        return self._corpus_ref_len
+
+    @ref_len.setter
+    def ref_len(self, value):
+        pass
+
+
+def _tokenize_shard(image_ids):
+    tokenizer = PTBTokenizer()
+    gts = {i: _SHARED['gts'][i] for i in image_ids}
+    res = {i: _SHARED['res'][i] for i in image_ids}
+    return tokenizer.tokenize(gts), tokenizer.tokenize(res)
+
+
+def _score_shard(image_ids):
+    gts, res = _SHARED['gts'], _SHARED['res']
+    outputs = {}
+    if 'Bleu' in _SHARED['scorers']:
+        bleu_scorer = BleuScorer(n=4)
+        for i in image_ids:
+            bleu_scorer += (res[i][0], gts[i])
+        _, scores = bleu_scorer.compute_score(option='closest', verbose=0)
+        totals = {'testlen': bleu_scorer._testlen, 'reflen': bleu_scorer._reflen,
+                  'guess': np.sum([c['guess'] for c in bleu_scorer.ctest], axis=0),
+                  'correct': np.sum([c['correct'] for c in bleu_scorer.ctest], axis=0)}
+        outputs['Bleu'] = (scores, totals)
+    if 'Rouge' in _SHARED['scorers']:
+        rouge = Rouge()
+        outputs['ROUGE_L'] = [rouge.calc_score(res[i], gts[i]) for i in image_ids]
+    if 'CIDEr' in _SHARED['scorers']:
+        cider_scorer = _CorpusCiderScorer(_SHARED['document_frequency'],
+                                          _SHARED['ref_len'])
+        for i in image_ids:
+            cider_scorer += (res[i][0], gts[i])
+        outputs['CIDEr'] = cider_scorer.compute_cider()
+    return outputs
+
+
+def _corpus_bleu(totals, n=4):
+    # same as BleuScorer.compute_score, from the summed statistics
+    tiny, small = 1e-15, 1e-9
+    bleu, bleus = 1., []
+    for k in range(n):
+        bleu *= (float(totals['correct'][k]) + tiny) / (float(totals['guess'][k]) + small)
+        bleus.append(bleu ** (1. / (k + 1)))
+    ratio = (totals['testlen'] + tiny) / (totals['reflen'] + small)
+    if ratio < 1:
+        bleus = [b * math.exp(1 - 1 / ratio) for b in bleus]
+    return bleus
+
+
+class ShardedCOCOEvalCap(object):
+    def __init__(self, coco, cocoRes, num_workers=4):
+        self.evalImgs = []
+        self.eval = {}
+        self.imgToEval = {}
+        self.coco = coco
+        self.cocoRes = cocoRes
+        self.params = {'image_id': coco.getImgIds()}
+        self._num_workers = num_workers
+        self._scorers = ['Bleu', 'Rouge', 'CIDEr']
+
+    def setup_scorer(self, scorers):
+        for scorer in scorers:
+            assert (scorer in ['Bleu', 'Rouge', 'CIDEr']), \
+                'metric %s can not be sharded' % scorer
+        self._scorers = scorers
+
+    def _map(self, func, shards):
+        if self._num_workers <= 1:
+            return [func(shard) for shard in shards]
+        # a new pool per stage, so workers fork with the current _SHARED
+        pool = Pool(self._num_workers)
+        try:
+            return pool.map(func, shards)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _compute_document_frequency(self):
+        cider_scorer = CiderScorer(n=4, sigma=6.0)
+        for refs in _SHARED['gts'].values():
+            cider_scorer += (None, refs)
+        cider_scorer.compute_doc_freq()
+        _SHARED['document_frequency'] = cider_scorer.document_frequency
+        _SHARED['ref_len'] = np.log(float(len(cider_scorer.crefs)))
+
+    def evaluate(self):
+        image_ids = list(self.params['image_id'])
+        num_shards = max(self._num_workers, 1)
+        shards = [s.tolist() for s in np.array_split(image_ids, num_shards) if s.size]
+
+        print('tokenization...')
+        _SHARED.clear()
+        _SHARED['gts'] = {i: self.coco.imgToAnns[i] for i in image_ids}
+        _SHARED['res'] = {i: self.cocoRes.imgToAnns[i] for i in image_ids}
+        gts, res = {}, {}
+        for shard_gts, shard_res in self._map(_tokenize_shard, shards):
+            gts.update(shard_gts)
+            res.update(shard_res)
+        _SHARED.update({'gts': gts, 'res': res, 'scorers': self._scorers})
+        if 'CIDEr' in self._scorers:
+            self._compute_document_frequency()
+
+        print('computing %s score...' % ', '.join(self._scorers))
+        outputs = self._map(_score_shard, shards)
+        _SHARED.clear()
+
+        if 'Bleu' in self._scorers:
+            totals = {}
+            for key in ['testlen', 'reflen', 'guess', 'correct']:
+                totals[key] = sum([out['Bleu'][1][key] for out in outputs])
+            for k, (score, m) in enumerate(zip(_corpus_bleu(totals), _BLEU_METRICS)):
+                scores = [s for out in outputs for s in out['Bleu'][0][k]]
+                self.setEval(score, m)
+                self.setImgToEvalImgs(scores, image_ids, m)
+                print('%s: %0.3f' % (m, score))
+        for m in ['ROUGE_L', 'CIDEr']:
+            if outputs and m in outputs[0]:
+                scores = np.concatenate([out[m] for out in outputs])
+                self.setEval(np.mean(scores), m)
+                self.setImgToEvalImgs(scores, image_ids, m)
+                print('%s: %0.3f' % (m, np.mean(scores)))
+        self.setEvalImgs()
+
+    def setEval(self, score, method):
+        self.eval[method] = score
+
+    def setImgToEvalImgs(self, scores, imgIds, method):
+        for imgId, score in zip(imgIds, scores):
+            if imgId not in self.imgToEval:
+                self.imgToEval[imgId] = {'image_id': imgId}
+            self.imgToEval[imgId][method] = score
+
+    def setEvalImgs(self):
+        self.evalImgs = [eval for imgId, eval in self.imgToEval.items()]
@@ -0,0 +1,137 @@
+"""
+Per-step time breakdown of the feed_train loops.
+
+The training loop opens a StepProfiler, and wraps each phase of a step
+(popping a batch, the session run, writing summaries, saving, ...) in
+phase(name). The durations of every step are appended to a JSON-lines
+file, which is rotated to step_profile.jsonl.1 once it reaches
+max_log_bytes, and percentiles of each phase are reported when training
+stops. With trace_every > 0, the session runs of every trace_every-th step
+are traced and dumped as Chrome trace files (open them in chrome://tracing).
+
+Code called from the loop, e.g. reinforce_trainstep, records its own
+sub-phases through the module level phase and run functions, which do
+nothing when no profiler is active.
+"""
+import os
+import json
+import time
+from array import array
+from contextlib import contextmanager
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+_PERCENTILES = [50, 90, 99]
+
+_active = None
+
+
+class StepProfiler(object):
+    def __init__(self, log_dir, trace_every=0, flush_every=100,
+                 max_log_bytes=64 << 20):
+        self._log_file = os.path.join(log_dir, 'step_profile.jsonl')
+        self._trace_dir = os.path.join(log_dir, 'traces')
+        self._trace_every = trace_every
+        self._flush_every = flush_every
+        self._max_log_bytes = max_log_bytes
+        self._fs = open(self._log_file, 'a')
+        self._durations = {}
+        self._step = None
+        self._step_start = None
+        self._phases = {}
+        self._tracing = False
+        # the module level phase and run record to the latest profiler
+        global _active
+        _active = self
+
+    def begin_step(self, step):
+        self._step = step
+        self._phases = {}
+        self._tracing = self._trace_every > 0 and step % self._trace_every == 0
+        self._step_start = time.time()
+
+    def end_step(self):
+        total = time.time() - self._step_start
+        self._phases['total'] = total
+        for name, duration in self._phases.items():
+            self._durations.setdefault(name, array('d')).append(duration)
+        record = {'step': self._step}
+        record.update(self._phases)
+        self._fs.write(json.dumps(record) + '\n')
+        if self._step % self._flush_every == 0:
+            self._fs.flush()
+            if self._fs.tell() >= self._max_log_bytes:
+                self._rotate_log()
+
+    def _rotate_log(self):
+        # keeps a single previous file, so the log stays below
+        # 2 * max_log_bytes however long the training runs
+        self._fs.close()
+        os.rename(self._log_file, self._log_file + '.1')
+        self._fs = open(self._log_file, 'a')
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            # a phase may be entered several times in a step
+            self._phases[name] = self._phases.get(name, 0.) + time.time() - start
+
+    def run(self, sess, fetches, feed_dict=None, name='session'):
+        with self.phase(name):
+            if not self._tracing:
+                return sess.run(fetches, feed_dict=feed_dict)
+            run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            run_metadata = tf.RunMetadata()
+            outputs = sess.run(fetches, feed_dict=feed_dict, options=run_options,
+                               run_metadata=run_metadata)
+        self._write_trace(run_metadata, name)
+        return outputs
+
+    def _write_trace(self, run_metadata, name):
+        if not tf.gfile.IsDirectory(self._trace_dir):
+            tf.gfile.MakeDirs(self._trace_dir)
+        trace_file = os.path.join(self._trace_dir, 'step_%d_%s.json' % (self._step, name))
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(trace_file, 'w') as fs:
+            fs.write(trace.generate_chrome_trace_format())
+        tf.logging.info('Wrote trace %s' % trace_file)
+
+    def report(self):
+        if 'total' not in self._durations:
+            return
+        total = np.sum(self._durations['total'])
+        lines = ['Step time breakdown over %d steps (sec):' % len(self._durations['total'])]
+        header = ''.join(['%10s' % ('p%d' % p) for p in _PERCENTILES])
+        lines.append('%-16s%8s%s%10s%8s' % ('phase', 'steps', header, 'total', 'share'))
+        for name in sorted(self._durations, key=lambda k: -np.sum(self._durations[k])):
+            d = np.frombuffer(self._durations[name], dtype=np.float64)
+            pcts = ''.join(['%10.4f' % v for v in np.percentile(d, _PERCENTILES)])
+            lines.append('%-16s%8d%s%10.1f%7.1f%%' % (name, d.size, pcts, d.sum(),
+                                                     100. * d.sum() / max(total, 1e-6)))
+        tf.logging.info('\n'.join(lines))
+
+    def close(self):
+        global _active
+        if _active is self:
+            _active = None
+        self._fs.close()
+        self.report()
+
+
+@contextmanager
+def phase(name):
+    if _active is None:
+        yield
+    else:
+        with _active.phase(name):
+            yield
+
+
+def run(sess, fetches, feed_dict=None, name='session'):
+    if _active is None:
+        return sess.run(fetches, feed_dict=feed_dict)
+    return _active.run(sess, fetches, feed_dict, name)
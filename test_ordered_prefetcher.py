@@ -0,0 +1,36 @@
+import numpy as np
+from readers.ivqa_general_data_fetcher import AttentionTestDataFetcher
+
+
+def _create_fetcher(num, batch_size, num_workers):
+    # only the state used by the sequential test batches
+    fetcher = AttentionTestDataFetcher.__new__(AttentionTestDataFetcher)
+    fetcher._num = num
+    fetcher._batch_size = batch_size
+    fetcher._idx = 0
+    fetcher._index = np.arange(num)
+    fetcher._num_prefetch_workers = num_workers
+    fetcher._prefetcher = None
+    fetcher._load_test_batch = lambda index: index.copy()
+    return fetcher
+
+
+def test_stop_mid_epoch_delivers_every_index_once():
+    num, batch_size = 103, 4
+    num_batches = int(np.ceil(num / float(batch_size)))
+    for stop_after in [0, 1, 5, num_batches - 2]:
+        fetcher = _create_fetcher(num, batch_size, num_workers=2)
+        delivered = []
+        for i in range(num_batches):
+            if i == stop_after:
+                fetcher.stop()
+            delivered.append(fetcher.get_test_batch())
+        fetcher.stop()
+        delivered = np.concatenate(delivered)
+        assert np.array_equal(delivered, np.arange(num)), \
+            'stopped after %d batches, delivered %s' % (stop_after, delivered)
+
+
+if __name__ == '__main__':
+    test_stop_mid_epoch_delivers_every_index_once()
+    print('every index delivered exactly once')
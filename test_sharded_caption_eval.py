@@ -0,0 +1,59 @@
+import numpy as np
+from sharded_caption_eval import ShardedCOCOEvalCap
+from eval_vqa_question_oracle import COCOEvalCap
+
+_REFS = {1: ['what color is the cat on the sofa', 'what is the colour of the cat',
+             'is there a cat on the sofa'],
+         2: ['how many people are on the beach', 'how many people are there',
+             'are there people on the beach'],
+         3: ['what is the man holding', 'what is in the hand of the man',
+             'is the man holding an umbrella'],
+         4: ['what sport is being played', 'what game are they playing',
+             'are they playing tennis'],
+         5: ['where is the bus parked', 'what color is the bus',
+             'is the bus parked on the street']}
+
+_CANDS = {1: 'what color is the cat',
+          2: 'how many people are on the sand',
+          3: 'what is the man holding in his hand',
+          4: 'what sport is this',
+          5: 'is the bus red'}
+
+
+class _Captions(object):
+    def __init__(self, captions):
+        self.image_ids = sorted(captions.keys())
+        self.imgToAnns = {}
+        for image_id in self.image_ids:
+            self.imgToAnns[image_id] = [{u'caption': c, u'id': i, u'image_id': image_id}
+                                        for i, c in enumerate(captions[image_id])]
+
+    def getImgIds(self):
+        return self.image_ids
+
+
+def _evaluate(evaluator):
+    evaluator.setup_scorer(['Bleu', 'CIDEr'])
+    evaluator.evaluate()
+    per_image = {e['image_id']: e['CIDEr'] for e in evaluator.evalImgs}
+    return evaluator.eval, per_image
+
+
+def test_sharded_scores_match_coco_eval_cap():
+    gt = _Captions(_REFS)
+    res = _Captions({k: [v] for k, v in _CANDS.items()})
+    scores, per_image = _evaluate(COCOEvalCap(gt, res))
+    for num_workers in [1, 2, 3]:
+        sharded_scores, sharded_per_image = _evaluate(
+            ShardedCOCOEvalCap(gt, res, num_workers=num_workers))
+        for m in ['Bleu_1', 'Bleu_2', 'Bleu_3', 'Bleu_4', 'CIDEr']:
+            assert np.isclose(scores[m], sharded_scores[m]), \
+                '%s differs with %d workers: %0.6f vs %0.6f' % (
+                    m, num_workers, scores[m], sharded_scores[m])
+        for image_id in _REFS:
+            assert np.isclose(per_image[image_id], sharded_per_image[image_id])
+
+
+if __name__ == '__main__':
+    test_sharded_scores_match_coco_eval_cap()
+    print('sharded and COCOEvalCap scores match')
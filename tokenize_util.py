@@ -0,0 +1,98 @@
+"""
+Parallel NLTK tokenisation and vectorized vocabulary encoding for the
+build_*_data scripts. The tokenised corpus is cached on disk, keyed by the
+content hash of the annotation files it came from, so rebuilding the data
+files after a vocabulary change skips tokenisation altogether.
+"""
+import os
+import hashlib
+from multiprocessing import Pool
+from time import time
+import numpy as np
+from nltk.tokenize import word_tokenize
+from util import pickle, unpickle
+from build_cache import md5_file
+
+
+def tokenize_sentence(sentence, start_word='<S>', end_word='</S>'):
+    tokenized = [start_word]
+    tokenized.extend(word_tokenize(str(sentence).lower()))
+    tokenized.append(end_word)
+    return tokenized
+
+
+def _tokenize_chunk(args):
+    sentences, start_word, end_word = args
+    return [None if s is None else tokenize_sentence(s, start_word, end_word)
+            for s in sentences]
+
+
+def _cache_file(source_files, tag, cache_dir):
+    md5 = hashlib.md5(tag)
+    for fpath in sorted(source_files):
+        md5.update(md5_file(fpath))
+    return os.path.join(cache_dir, 'tokenized_%s.pkl' % md5.hexdigest())
+
+
+def parallel_tokenize(sentences, start_word='<S>', end_word='</S>',
+                      num_workers=8, chunk_size=5000):
+    """
+    Tokenises sentences in a pool of num_workers processes, chunk_size
+    sentences per work unit. None entries (missing answers) stay None.
+    """
+    t = time()
+    chunks = [(sentences[i:i + chunk_size], start_word, end_word)
+              for i in range(0, len(sentences), chunk_size)]
+    if num_workers <= 1 or len(chunks) <= 1:
+        outputs = [_tokenize_chunk(chunk) for chunk in chunks]
+    else:
+        pool = Pool(num_workers)
+        try:
+            outputs = pool.map(_tokenize_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    tokenized = [tokens for output in outputs for tokens in output]
+    print('Tokenised %d sentences in %0.2f sec' % (len(tokenized), time() - t))
+    return tokenized
+
+
+def cached_tokenize(source_files, sentences, name='', start_word='<S>', end_word='</S>',
+                    cache_dir='data/token_cache', num_workers=8, chunk_size=5000):
+    """
+    Same as parallel_tokenize, but the result is cached under cache_dir,
+    keyed by the content of source_files (the annotation files sentences
+    were read from), name (e.g. the subset when a file holds several ones)
+    and the start/end words.
+    """
+    tag = '%s|%s|%s|%d' % (name, start_word, end_word, len(sentences))
+    cache_file = _cache_file(source_files, tag, cache_dir)
+    if os.path.exists(cache_file):
+        print('Loading tokenised sentences from %s' % cache_file)
+        return unpickle(cache_file)
+    tokenized = parallel_tokenize(sentences, start_word, end_word,
+                                  num_workers, chunk_size)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_file = '%s.%d' % (cache_file, os.getpid())
+    pickle(tmp_file, tokenized)
+    os.rename(tmp_file, cache_file)
+    return tokenized
+
+
+def encode_tokens(tokenized, word_to_id):
+    """
+    Maps a list of token lists to a zero padded int32 id matrix and the
+    length of each row. Every distinct word is looked up only once.
+    """
+    seq_len = np.array([len(tokens) for tokens in tokenized], dtype=np.int32)
+    flat = np.array([w for tokens in tokenized for w in tokens], dtype=object)
+    max_len = seq_len.max() if seq_len.size else 0
+    arr = np.zeros([seq_len.size, max_len], dtype=np.int32)
+    if flat.size == 0:
+        return arr, seq_len
+    words, inverse = np.unique(flat, return_inverse=True)
+    ids = np.array([word_to_id(w) for w in words], dtype=np.int32)[inverse]
+    mask = np.arange(arr.shape[1])[np.newaxis, :] < seq_len[:, np.newaxis]
+    arr[mask] = ids
+    return arr, seq_len
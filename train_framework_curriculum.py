@@ -1,6 +1,7 @@
 import tensorflow as tf
 import os
 import time
+from async_checkpoint import AsyncCheckpointSaver
 
 
 def train(train_op, train_dir, log_every_n_steps,
@@ -39,13 +40,14 @@ def train(train_op, train_dir, log_every_n_steps,
 
     # start reader
     reader.start()
+    ckpt_saver = AsyncCheckpointSaver(graph, sv_path, saver)
 
     # customized training code
     for itr in range(number_of_steps):
         if itr % 5000 == 0:
             tf.logging.info('Saving model %s\n' % sv_path)
-            saver.save(sess, sv_path, global_step=global_step)
-            reader.backup_statistics()
+            ckpt_saver.save(sess, global_step)
+            reader.backup_statistics(ckpt_saver.writer)
         start_time = time.time()
         if _write_summary and itr % summary_interval == 0:
             total_loss, np_global_step, smp_losses, summary = sess.run([train_op, global_step,
@@ -64,7 +66,8 @@ def train(train_op, train_dir, log_every_n_steps,
 
     # Finish training
     tf.logging.info('Finished training! Saving model to disk.')
-    saver.save(sess, sv_path, global_step=global_step)
+    ckpt_saver.save(sess, global_step)
+    ckpt_saver.close()
 
     # Close
     reader.stop()
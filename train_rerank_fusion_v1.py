@@ -12,6 +12,9 @@ tf.flags.DEFINE_string("train_dir", "/import/vision-ephemeral/fl302/data/model/%
 tf.flags.DEFINE_integer("number_of_steps", 100000000, "Number of training steps.")
 tf.flags.DEFINE_integer("log_every_n_steps", 1,
                         "Frequency at which loss and global step are logged.")
+tf.flags.DEFINE_integer("profile_trace_every", 0,
+                        "Frequency at which a full trace of a training step is "
+                        "written, 0 to disable tracing.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -70,7 +73,8 @@ def train():
         init_fn=model.init_fn,
         saver=saver, reader=reader,
         feed_fn=model.fill_feed_dict,
-        debug_op=None)
+        debug_op=None,
+        profile_trace_every=FLAGS.profile_trace_every)
 
 
 def main(_):
@@ -16,6 +16,9 @@ tf.flags.DEFINE_string("train_dir", "model/%s_var_kptrain_%s",
 tf.flags.DEFINE_integer("number_of_steps", 10000000, "Number of training steps.")
 tf.flags.DEFINE_integer("log_every_n_steps", 1,
                         "Frequency at which loss and global step are logged.")
+tf.flags.DEFINE_integer("profile_trace_every", 0,
+                        "Frequency at which a full trace of a training step is "
+                        "written, 0 to disable tracing.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -84,7 +87,8 @@ def train():
         init_fn=model.init_fn,
         saver=saver, reader=reader,
         feed_fn=model.fill_feed_dict,
-        summary_op=summary_op)
+        summary_op=summary_op,
+        profile_trace_every=FLAGS.profile_trace_every)
 
 
 def main(_):
@@ -18,6 +18,9 @@ tf.flags.DEFINE_string("train_dir", "model/%s_var_rl_att2_restval_%s_r2",
 tf.flags.DEFINE_integer("number_of_steps", 150000, "Number of training steps.")
 tf.flags.DEFINE_integer("log_every_n_steps", 100,
                         "Frequency at which loss and global step are logged.")
+tf.flags.DEFINE_integer("profile_trace_every", 0,
+                        "Frequency at which a full trace of a training step is "
+                        "written, 0 to disable tracing.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -102,7 +105,8 @@ def train():
         reader=reader,
         model=model,
         summary_op=summary_op,
-        env=env)
+        env=env,
+        profile_trace_every=FLAGS.profile_trace_every)
 
 
 def main(_):
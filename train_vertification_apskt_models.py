@@ -17,6 +17,9 @@ tf.flags.DEFINE_string("train_dir", "model/ap_%s_vqa_%s",
 tf.flags.DEFINE_integer("number_of_steps", 1000000, "Number of training steps.")
 tf.flags.DEFINE_integer("log_every_n_steps", 10,
                         "Frequency at which loss and global step are logged.")
+tf.flags.DEFINE_integer("profile_trace_every", 0,
+                        "Frequency at which a full trace of a training step is "
+                        "written, 0 to disable tracing.")
 tf.flags.DEFINE_bool("sample_negative", True,
                      "Use all answer candidates or just two.")
 tf.flags.DEFINE_bool("use_fb_data", True,
@@ -111,7 +114,8 @@ def train():
         init_fn=model.init_fn,
         saver=saver, reader=reader,
         feed_fn=model.fill_feed_dict,
-        summary_op=summary_op)
+        summary_op=summary_op,
+        profile_trace_every=FLAGS.profile_trace_every)
 
 
 def main(_):
@@ -22,6 +22,9 @@ tf.flags.DEFINE_string("train_dir", "model/%s_%s",
 tf.flags.DEFINE_integer("number_of_steps", 1000000, "Number of training steps.")
 tf.flags.DEFINE_integer("log_every_n_steps", 10,
                         "Frequency at which loss and global step are logged.")
+tf.flags.DEFINE_integer("profile_trace_every", 0,
+                        "Frequency at which a full trace of a training step is "
+                        "written, 0 to disable tracing.")
 tf.flags.DEFINE_string("model_trainset", "kprestval",
                        "Which split is the model trained on")
 FLAGS = tf.flags.FLAGS
@@ -98,7 +101,8 @@ def train():
         number_of_steps=FLAGS.number_of_steps,
         init_fn=model.init_fn,
         saver=saver, reader=reader,
-        feed_fn=model.fill_feed_dict)
+        feed_fn=model.fill_feed_dict,
+        profile_trace_every=FLAGS.profile_trace_every)
 
 
 def main(_):
@@ -1,12 +1,14 @@
 import tensorflow as tf
 import os
 import time
+from step_profiler import StepProfiler
+from async_checkpoint import AsyncCheckpointSaver
 
 
 def train(train_op, train_dir, log_every_n_steps,
           graph, global_step, number_of_steps,
           init_fn, saver, reader=None, feed_fn=None,
-          summary_op=None, sync_op=None):
+          summary_op=None, sync_op=None, profile_trace_every=0):
     if reader is None:
         # Run training.
         tf.contrib.slim.learning.train(
@@ -22,13 +24,13 @@ def train(train_op, train_dir, log_every_n_steps,
         feed_train(train_op, train_dir, log_every_n_steps,
                    graph, global_step, number_of_steps,
                    init_fn, saver, reader, feed_fn, summary_op,
-                   sync_op)
+                   sync_op, profile_trace_every)
 
 
 def feed_train(train_op, train_dir, log_every_n_steps,
                graph, global_step, number_of_steps,
                init_fn, saver, reader=None, feed_fn=None,
-               summary_op=None, sync_op=None):
+               summary_op=None, sync_op=None, profile_trace_every=0):
     summary_writer = None
     sess = tf.Session(graph=graph)
     summary_interval = 100
@@ -57,26 +59,37 @@ def feed_train(train_op, train_dir, log_every_n_steps,
 
     # start reader
     reader.start()
+    profiler = StepProfiler(train_dir, trace_every=profile_trace_every)
+    ckpt_saver = AsyncCheckpointSaver(graph, sv_path, saver)
 
     # customized training code
     for itr in range(number_of_steps):
+        profiler.begin_step(itr)
         if itr % 5000 == 0:
             tf.logging.info('Saving model %s\n' % sv_path)
-            saver.save(sess, sv_path, global_step=global_step)
+            with profiler.phase('save'):
+                ckpt_saver.save(sess, global_step)
         if itr % 20000000 == 0:
             if sync_op is not None:
                 tf.logging.info('Synchronising models\n')
-                sess.run(sync_op)
+                with profiler.phase('sync'):
+                    sess.run(sync_op)
         start_time = time.time()
+        with profiler.phase('pop_batch'):
+            batch = reader.pop_batch()
+        with profiler.phase('feed'):
+            feed_dict = feed_fn(batch)
         if _write_summary and itr % summary_interval == 0:
-            total_loss, np_global_step, summary = sess.run([train_op, global_step, summary_op],
-                                                           feed_dict=feed_fn(reader.pop_batch()))
-            summary_writer.add_summary(summary, np_global_step)
+            total_loss, np_global_step, summary = profiler.run(
+                sess, [train_op, global_step, summary_op], feed_dict)
+            with profiler.phase('summary'):
+                summary_writer.add_summary(summary, np_global_step)
         else:
-            total_loss, np_global_step = sess.run([train_op, global_step],
-                                                  feed_dict=feed_fn(reader.pop_batch()))
+            total_loss, np_global_step = profiler.run(sess, [train_op, global_step],
+                                                      feed_dict)
 
         time_elapsed = time.time() - start_time
+        profiler.end_step()
 
         if itr % log_every_n_steps == log_every_n_steps - 1:
             tf.logging.info('global step %d: loss = %.4f (%.2f sec/step)',
@@ -84,8 +97,10 @@ def feed_train(train_op, train_dir, log_every_n_steps,
 
     # Finish training
     tf.logging.info('Finished training! Saving model to disk.')
-    saver.save(sess, sv_path, global_step=global_step)
+    ckpt_saver.save(sess, global_step)
+    ckpt_saver.close()
 
     # Close
+    profiler.close()
     reader.stop()
     sess.close()
@@ -0,0 +1,124 @@
+"""
+Sampling a fixed number of unique questions per image from the variational
+decoders.
+
+model.random_sampling draws a batch of questions per image, interleaved
+with stride batch_size like post_process_variation_questions expects, and
+the number of unique questions among them varies from image to image.
+sample_unique_questions calls it until every image has num_unique unique
+questions, by default as many as one batch draws per image, or max_rounds
+batches were drawn. Questions are compared token by token, for all rows at
+once, and the first draw of a question is kept with its own noise and
+score. The result is a SampleBundle of flat arrays, ordered by image.
+"""
+import numpy as np
+from post_process_variation_questions import post_process_prediction_array, \
+    find_unique_rows
+
+
+def _pad_columns(tokens, width):
+    if tokens.shape[1] >= width:
+        return tokens
+    pad = np.zeros([tokens.shape[0], width - tokens.shape[1]], dtype=tokens.dtype)
+    return np.concatenate([tokens, pad], axis=1)
+
+
+def _select_unique(tokens, lengths, image_index, num_unique):
+    """
+    Indices of the first draw of every (image, question), at most
+    num_unique per image, ordered by image and draw. Rows of an image are
+    in the order they were drawn.
+    """
+    first, _ = find_unique_rows(tokens, lengths, image_index)
+    im = image_index[first]
+    rank = np.arange(im.size) - np.searchsorted(im, im)
+    return first[rank < num_unique]
+
+
+class SampleBundle(object):
+    """
+    Sampled questions of a batch, ordered by image. paths[i, :lengths[i]]
+    is a question with its start and end tokens (unless it reached the
+    maximum length), zero padded, drawn for image image_index[i] with
+    noise[i] and a log probability of scores[i].
+    """
+
+    def __init__(self, paths, lengths, noise, scores, image_index, num_images):
+        self.paths = paths
+        self.lengths = lengths
+        self.noise = noise
+        self.scores = scores
+        self.image_index = image_index
+        self.num_images = num_images
+
+    @property
+    def counts(self):
+        return np.bincount(self.image_index, minlength=self.num_images)
+
+    def path_array(self, pad_token=0, offset=0, max_length=None):
+        """
+        Like put_to_array on the paths with their first offset tokens
+        removed, returns [tokens, lengths].
+        """
+        lengths = self.lengths - offset
+        if max_length is None:
+            width = lengths.max()
+        else:
+            lengths = np.minimum(lengths, max_length)
+            width = max_length
+        arr = np.empty([self.paths.shape[0], width], dtype=np.int32)
+        num_cols = min(width, self.paths.shape[1] - offset)
+        arr[:, :num_cols] = self.paths[:, offset:offset + num_cols]
+        arr[np.arange(width)[np.newaxis, :] >= lengths[:, np.newaxis]] = pad_token
+        return [arr, lengths.astype(np.int32)]
+
+    def to_lists(self, offset=0):
+        return [p[offset:l].tolist() for p, l in zip(self.paths, self.lengths)]
+
+    def nested(self):
+        """The scores, pathes and noise of post_process_variation_questions_noise."""
+        splits = np.cumsum(self.counts)[:-1]
+        pathes = self.to_lists()
+        scores = [s.tolist() for s in np.split(self.scores, splits)]
+        pathes = [pathes[i:j] for i, j in zip(np.r_[0, splits],
+                                               np.r_[splits, len(pathes)])]
+        noise = np.split(self.noise, splits)
+        return scores, pathes, noise
+
+
+def sample_unique_questions(model, sess, inputs, num_unique=None, max_rounds=2):
+    """
+    Draws batches of model.random_sampling(inputs, sess) until each image
+    has num_unique unique questions, or max_rounds batches were drawn, in
+    which case some images have fewer. num_unique defaults to the number
+    of questions the model draws per image. Returns a SampleBundle.
+    """
+    batch_size = inputs[0].shape[0]
+    tokens = lengths = noise = scores = image_index = None
+    for _ in range(max_rounds):
+        noise_vec, pathes, path_scores = model.random_sampling(inputs, sess)
+        new_tokens, new_lengths, new_scores = post_process_prediction_array(path_scores,
+                                                                            pathes)
+        num_new = new_tokens.shape[0]
+        if num_unique is None:
+            num_unique = num_new // batch_size
+        new_image_index = np.arange(num_new, dtype=np.int32) % batch_size
+        if tokens is None:
+            tokens, lengths, noise, scores, image_index = \
+                new_tokens, new_lengths, noise_vec, new_scores, new_image_index
+        else:
+            width = max(tokens.shape[1], new_tokens.shape[1])
+            tokens = np.concatenate([_pad_columns(tokens, width),
+                                     _pad_columns(new_tokens, width)])
+            lengths = np.concatenate([lengths, new_lengths])
+            noise = np.concatenate([noise, noise_vec])
+            scores = np.concatenate([scores, new_scores])
+            image_index = np.concatenate([image_index, new_image_index])
+        keep = _select_unique(tokens, lengths, image_index, num_unique)
+        tokens, lengths, noise, scores, image_index = \
+            [v[keep] for v in [tokens, lengths, noise, scores, image_index]]
+        if np.bincount(image_index, minlength=batch_size).min() >= num_unique:
+            break
+    tokens = tokens[:, :lengths.max()]
+    return SampleBundle(tokens, lengths, noise.astype(np.float32),
+                        scores.astype(np.float32), image_index, batch_size)
@@ -98,6 +98,16 @@ def unpickle(fname):
         return cPickle.load(pkl_file)
 
 
+def iter_unpickle(fname):
+    # read back records dumped one after another into the same file
+    with open(fname, 'rb') as pkl_file:
+        while True:
+            try:
+                yield cPickle.load(pkl_file)
+            except EOFError:
+                return
+
+
 def decode_raw_format_sample(datum, feat_shape):
     datum = tf.decode_raw(datum, out_type=tf.float32)
     return tf.reshape(datum, feat_shape)
@@ -3,16 +3,33 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import numpy as np
 from inference_utils import inference_wrapper_base
 from vqa_model_creater import get_model_creation_fn
 
 
+def _has_operation(graph, name):
+    try:
+        graph.get_operation_by_name(name)
+    except KeyError:
+        return False
+    return True
+
 
 class InferenceWrapper(inference_wrapper_base.InferenceWrapperBase):
-    """Model wrapper class for performing inference with a ShowAndTellModel."""
+    """
+    Model wrapper class for performing inference with a ShowAndTellModel.
+
+    When the decoder built an in-graph decoding step (see
+    rnn_ops.build_in_graph_decoding_step), the LSTM states stay in the
+    session: a caption state is the row of its beam in the state variable,
+    and inference_step_topk only fetches the k best words of each beam and
+    their log-probabilities instead of the whole softmax and states.
+    """
 
     def __init__(self):
         super(InferenceWrapper, self).__init__()
+        self._in_graph_state = False
 
     def build_model(self, model_config):
         model_creator = get_model_creation_fn(model_config.model_type)
@@ -22,12 +39,27 @@ class InferenceWrapper(inference_wrapper_base.InferenceWrapperBase):
 
     def feed_image(self, sess, inputs):
         image, ans = inputs
+        feed_dict = {"image_feed:0": image, "ans_feed:0": ans}
+        self._in_graph_state = _has_operation(sess.graph, "vaq/init_state_var")
+        if self._in_graph_state:
+            sess.run(fetches="vaq/init_state_var", feed_dict=feed_dict)
+            # the single initial beam is in row 0
+            return np.zeros([1], dtype=np.int32)
         initial_state = sess.run(fetches="vaq/initial_state:0",
-                                 feed_dict={"image_feed:0": image,
-                                            "ans_feed:0": ans})
+                                 feed_dict=feed_dict)
         return initial_state
 
     def inference_step(self, sess, input_feed, state_feed):
+        if self._in_graph_state:
+            softmax_output = sess.run(
+                fetches="vaq/state_var_softmax:0",
+                feed_dict={
+                    "input_feed:0": input_feed,
+                    "vaq/parent_feed:0": state_feed,
+                })
+            # the new state of beam i was written to row i
+            state_output = np.arange(len(input_feed), dtype=np.int32)
+            return softmax_output, state_output, None
         softmax_output, state_output = sess.run(
             fetches=["vaq/softmax:0", "vaq/state:0"],
             feed_dict={
@@ -35,3 +67,17 @@ class InferenceWrapper(inference_wrapper_base.InferenceWrapperBase):
                 "vaq/state_feed:0": state_feed,
             })
         return softmax_output, state_output, None
+
+    def inference_step_topk(self, sess, input_feed, state_feed, k):
+        if not self._in_graph_state:
+            return super(InferenceWrapper, self).inference_step_topk(
+                sess, input_feed, state_feed, k)
+        word_ids, logprobs = sess.run(
+            fetches=["vaq/topk_words:0", "vaq/topk_logprobs:0"],
+            feed_dict={
+                "input_feed:0": input_feed,
+                "vaq/parent_feed:0": state_feed,
+                "vaq/top_k_feed:0": k,
+            })
+        new_state = np.arange(len(input_feed), dtype=np.int32)
+        return word_ids, logprobs, new_state, None
@@ -12,6 +12,8 @@ from record_reader import TFRecordDataFetcher
 from w2v_answer_encoder import CandidateAnswerManager
 from vaq_model_generator import create_model_fn
 from inference_utils.question_generator_util import SentenceGenerator
+from mc_batch_util import iterate_mc_batches, pack_mc_batch, question_loss, \
+    segment_argmin, segment_normalise, segment_offsets
 
 tf.flags.DEFINE_string("model_type", "VA-lstm",
                        "Select a model to train.")
@@ -26,6 +28,8 @@ tf.flags.DEFINE_string("input_files", "data/vqa_incept_mscoco_dev.tfrecords",
 tf.flags.DEFINE_string("result_file", "result/vaq_mc_incept_%d.json",
                        "File pattern or comma-separated list of file patterns "
                        "of image files.")
+tf.flags.DEFINE_integer("num_quest_per_batch", 16,
+                        "Number of questions scored in one sess.run.")
 FLAGS = tf.flags.FLAGS
 
 tf.logging.set_verbosity(tf.logging.INFO)
@@ -36,53 +40,6 @@ def restore_model(sess, checkpoint_path):
     saver.restore(sess, checkpoint_path)
 
 
-def padding_sequence(coding):
-    ans_len = np.array([len(e) for e in coding], dtype=np.int64)
-    num = ans_len.size
-    ans_seq = np.zeros([num, ans_len.max()], dtype=np.int64)
-    for a_row, seq in zip(ans_seq, coding):
-        a_row[:len(seq)] = seq
-    return ans_seq, ans_len
-
-
-def build_mc_data_word2vec(reader_outs, word_vec):
-    num_cands = word_vec.shape[0]
-
-    def _duplicate_vector(datum):
-        return np.tile(datum.reshape([1, -1]), [num_cands, 1])
-
-    im_ids, quest_id, im_feat, ans_w2v, quest_ids, ans_ids = reader_outs
-    im_feat = _duplicate_vector(im_feat)
-    quest_in = _duplicate_vector(quest_ids[:-1])
-    quest_targ = _duplicate_vector(quest_ids[1:])
-    quest_mask = np.array(np.ones_like(quest_targ), dtype=np.int64)
-    return im_feat, word_vec, quest_in, quest_targ, quest_mask
-
-
-def build_mc_data_sequence(reader_outs, sequence):
-    num_cands = len(sequence)
-    ans_seq, ans_len = padding_sequence(sequence)
-
-    def _duplicate_vector(datum):
-        return np.tile(datum.reshape([1, -1]), [num_cands, 1])
-
-    im_ids, quest_id, im_feat, ans_w2v, quest_ids, ans_ids = reader_outs
-    im_feat = _duplicate_vector(im_feat)
-    quest_in = _duplicate_vector(quest_ids[:-1])
-    quest_targ = _duplicate_vector(quest_ids[1:])
-    quest_mask = np.array(np.ones_like(quest_targ), dtype=np.int64)
-    return im_feat, ans_seq, ans_len, quest_in, quest_targ, quest_mask
-
-
-def build_mc_reader_proc_fn(coding):
-    if coding == 'word2vec':
-        return build_mc_data_word2vec
-    elif coding == 'sequence':
-        return build_mc_data_sequence
-    else:
-        raise Exception('unknown coding')
-
-
 def test(T=3.0, num_cands=10):
     # Build the inference graph.
     cand_file = 'result/vqa_cands.json'
@@ -96,9 +53,6 @@ def test(T=3.0, num_cands=10):
     # create multiple choice question manger
     oe_manager = CandidateAnswerManager(cand_file, max_num_cands=10)
 
-    # Create reader post-processing function
-    reader_post_proc_fn = build_mc_reader_proc_fn(model_creator.ans_coding)
-
     g = tf.Graph()
     ckpt = tf.train.get_checkpoint_state(FLAGS.checkpoint_dir)
     checkpoint_path = ckpt.model_checkpoint_path
@@ -124,37 +78,42 @@ def test(T=3.0, num_cands=10):
         saver.restore(sess, checkpoint_path)
 
         itr = 0
-        while not reader.eof():
-            outputs = reader.pop_batch()
-            im_ids, quest_id, im_feat, ans_w2v, quest_ids, ans_ids = outputs
-            oe_ans, oe_coding, scores = oe_manager.get_answer_sequence(quest_id)
-            inputs = reader_post_proc_fn(outputs, oe_coding)
-            perplexity, state = sess.run([model.likelihood, model.final_decoder_state],
-                                         feed_dict=model.fill_feed_dict(inputs))
+        batches = iterate_mc_batches(reader, oe_manager.get_answer_sequence,
+                                     FLAGS.num_quest_per_batch)
+        for items in batches:
+            inputs, n_cands, quest_len = pack_mc_batch(items, model_creator.ans_coding)
+            perplexity = sess.run(model.likelihood, feed_dict=model.fill_feed_dict(inputs))
             perplexity = perplexity.reshape(inputs[-1].shape)
-            loss = perplexity[:, :-1].mean(axis=1)
-            weight = np.exp(-loss * T)
-            weight = weight / weight.sum()  # l1 normalise
+            loss = question_loss(perplexity, quest_len)
+            weight = segment_normalise(np.exp(-loss * T), n_cands)  # l1 normalise
+            scores = np.concatenate([cands[2] for _, cands in items])
             score = scores * weight
-            score = score[:num_cands]
-
-            question = to_sentence.index_to_question(quest_ids)
-            answer = to_sentence.index_to_answer(ans_ids)
-            top1_ans = oe_ans[score.argmax()]
-            result.append({u'answer': top1_ans, u'question_id': quest_id})
-
-            if itr % 100 == 0:
-                print('============== %d ============' % itr)
-                print('image id: %d, question id: %d' % (im_ids, quest_id))
-                print('question\t: %s' % question)
-                print('answer\t: %s' % answer)
-                top_k_ids = (-score).argsort()[:3].tolist()
-                print('VQA answer\t: %s' % oe_ans[0])
-                for i, idx in enumerate(top_k_ids):
-                    t_mc_ans = oe_ans[idx]
-                    print('VAQ answer <%d>\t: %s (%0.2f)' % (i, t_mc_ans, weight[idx]))
-
-            itr += 1
+            # only the first num_cands answers of each question are voted
+            offsets = segment_offsets(n_cands)
+            position = np.arange(score.size) - np.repeat(offsets, n_cands)
+            score[position >= num_cands] = -np.inf
+            top1_index = segment_argmin(-score, n_cands)
+
+            for (outputs, (oe_ans, _, _)), start, n, top1 in zip(items, offsets, n_cands,
+                                                               top1_index):
+                im_ids, quest_id, im_feat, ans_w2v, quest_ids, ans_ids = outputs
+                result.append({u'answer': oe_ans[top1], u'question_id': quest_id})
+
+                if itr % 100 == 0:
+                    question = to_sentence.index_to_question(quest_ids)
+                    answer = to_sentence.index_to_answer(ans_ids)
+                    q_score = score[start:start + min(n, num_cands)]
+                    q_weight = weight[start:start + n]
+                    print('============== %d ============' % itr)
+                    print('image id: %d, question id: %d' % (im_ids, quest_id))
+                    print('question\t: %s' % question)
+                    print('answer\t: %s' % answer)
+                    top_k_ids = (-q_score).argsort()[:3].tolist()
+                    print('VQA answer\t: %s' % oe_ans[0])
+                    for i, idx in enumerate(top_k_ids):
+                        t_mc_ans = oe_ans[idx]
+                        print('VAQ answer <%d>\t: %s (%0.2f)' % (i, t_mc_ans, q_weight[idx]))
+                itr += 1
 
         quest_ids = [res[u'question_id'] for res in result]
         # save results
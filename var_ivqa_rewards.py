@@ -1,12 +1,9 @@
 import numpy as np
-from scipy.stats import hmean
-from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
 from config import VOCAB_CONFIG
 from inference_utils.question_generator_util import SentenceGenerator
-from bleu_eval.bleu import Bleu
+from lazy_object import LazyObject
 from collections import OrderedDict
-import tensorflow as tf
-from post_process_variation_questions import put_to_array
+from post_process_variation_questions import PaddedBatchBuilder
 from answer_token_to_top_answers import AnswerTokenToTopAnswer
 from graph_util import find_connected_components
 from uniqueness_reward import UniqueReward
@@ -15,7 +12,7 @@ import pdb
 END_TOKEN = VOCAB_CONFIG.end_token_id
 START_TOKEN = VOCAB_CONFIG.start_token_id
 
-_SENT = SentenceGenerator(trainset='trainval')
+_SENT = LazyObject(SentenceGenerator, trainset='trainval')
 
 
 def _parse_pred_questions(capt, capt_len):
@@ -46,14 +43,21 @@ def supress_cider_score(rewards):
 
 class AttentionVQARewards(object):
     def __init__(self, ckpt_file='model/v1_vqa_VQA/v1_vqa_VQA_best2/model.ckpt-135000',
-                 use_dis_reward=False):
-        self.g = tf.Graph()
+                 use_dis_reward=False, frozen_file=None):
         self.ckpt_file = ckpt_file
+        self.ans2id = AnswerTokenToTopAnswer()
+        self.use_dis_reward = use_dis_reward
+        self._batch_builder = PaddedBatchBuilder()
+        if frozen_file is not None:
+            # exported by export_frozen_models.py
+            from frozen_graph_util import load_frozen_model
+            self.g, self.sess, self.model = load_frozen_model(frozen_file)
+            return
+        import tensorflow as tf
+        self.g = tf.Graph()
         from models.vqa_soft_attention import AttentionModel
         from vqa_config import ModelConfig
         config = ModelConfig()
-        self.ans2id = AnswerTokenToTopAnswer()
-        self.use_dis_reward = use_dis_reward
         with self.g.as_default():
             self.sess = tf.Session()
             self.model = AttentionModel(config, phase='test_broadcast')
@@ -89,7 +93,7 @@ class AttentionVQARewards(object):
                 answer_len_aug.append(ans_len[_idx])
                 top_ans_ids_aug.append(top_ans_ids[_idx])
         # put to arrays
-        arr, arr_len = put_to_array(pathes)
+        arr, arr_len = self._batch_builder.from_lists(pathes)
         images_aug = np.concatenate(images_aug)
         answer_aug = np.concatenate(answer_aug).astype(np.int32)
         top_ans_ids_aug = np.array(top_ans_ids_aug)
@@ -108,15 +112,22 @@ class AttentionVQARewards(object):
 
 class VQARewards(object):
     def __init__(self, ckpt_file='', use_dis_reward=False,
-                 use_attention_model=False):
-        self.g = tf.Graph()
+                 use_attention_model=False, frozen_file=None):
         self.ckpt_file = ckpt_file
         self.use_attention_model = use_attention_model
+        self.ans2id = AnswerTokenToTopAnswer()
+        self.use_dis_reward = use_dis_reward
+        self._batch_builder = PaddedBatchBuilder()
+        if frozen_file is not None:
+            from frozen_graph_util import load_frozen_model
+            self.g, self.sess, self.model = load_frozen_model(frozen_file)
+            return
+        import tensorflow as tf
+        self.g = tf.Graph()
         from models.vqa_base import BaseModel
+        from models.vqa_soft_attention import AttentionModel
         from vqa_config import ModelConfig
         config = ModelConfig()
-        self.ans2id = AnswerTokenToTopAnswer()
-        self.use_dis_reward = use_dis_reward
         with self.g.as_default():
             self.sess = tf.Session()
             if self.use_attention_model:
@@ -156,7 +167,7 @@ class VQARewards(object):
                 answer_len_aug.append(ans_len[_idx])
                 top_ans_ids_aug.append(top_ans_ids[_idx])
         # put to arrays
-        arr, arr_len = put_to_array(pathes)
+        arr, arr_len = self._batch_builder.from_lists(pathes)
         images_aug = np.concatenate(images_aug)
         answer_aug = np.concatenate(answer_aug).astype(np.int32)
         top_ans_ids_aug = np.array(top_ans_ids_aug)
@@ -175,6 +186,7 @@ class VQARewards(object):
 
 class DiversityReward(object):
     def __init__(self, mode='winner_take_all'):
+        from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
         self.scorer = ciderEval('vqa_%s_idxs_end' % 'kptrain')
         self.pred_has_start_end_token = True
         self.use_end_token = True
@@ -276,8 +288,10 @@ class IVQARewards(object):
         self.pred_has_start_end_token = pred_has_start_end_token
         self.use_end_token = use_end_token
         if metric == 'cider':
+            from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
             self.scorer = ciderEval('vqa_%s_idxs_end' % subset)
         elif metric == 'bleu':
+            from bleu_eval.bleu import Bleu
             self.scorer = Bleu(n=4)
         assert (metric == 'cider')
         self.to_sentence = SentenceGenerator(trainset='trainval')
@@ -369,12 +383,14 @@ class IVQARewards(object):
 
 class MixReward(object):
     def __init__(self, thresh=0.3, cider_w=0.6, dis_vqa_reward=False,
-                 attention_vqa=False):
+                 attention_vqa=False, vqa_frozen_file=None):
         if attention_vqa:
-            self.vqa_reward = AttentionVQARewards(use_dis_reward=dis_vqa_reward)
+            self.vqa_reward = AttentionVQARewards(use_dis_reward=dis_vqa_reward,
+                                                  frozen_file=vqa_frozen_file)
         else:
             self.vqa_reward = VQARewards('model/kprestval_VQA-BaseNorm/model.ckpt-26000',
-                                         use_dis_reward=dis_vqa_reward)
+                                         use_dis_reward=dis_vqa_reward,
+                                         frozen_file=vqa_frozen_file)
         self.cider_reward = IVQARewards()
         self.diversity_reward = DiversityReward()
         self.thresh = thresh
@@ -1,9 +1,7 @@
 import numpy as np
-from scipy.stats import hmean
-from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
 from config import VOCAB_CONFIG
 from inference_utils.question_generator_util import SentenceGenerator
-from bleu_eval.bleu import Bleu
+from lazy_object import LazyObject
 from collections import OrderedDict
 import tensorflow as tf
 from post_process_variation_questions import put_to_array
@@ -16,7 +14,7 @@ import pdb
 END_TOKEN = VOCAB_CONFIG.end_token_id
 START_TOKEN = VOCAB_CONFIG.start_token_id
 
-_SENT = SentenceGenerator(trainset='trainval')
+_SENT = LazyObject(SentenceGenerator, trainset='trainval')
 
 
 def _parse_pred_questions(capt, capt_len):
@@ -47,6 +45,7 @@ def supress_cider_score(rewards):
 
 class DiversityReward(object):
     def __init__(self, mode='winner_take_all'):
+        from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
         self.scorer = ciderEval('vqa_%s_idxs_end' % 'kptrain')
         self.pred_has_start_end_token = True
         self.use_end_token = True
@@ -148,8 +147,10 @@ class IVQARewards(object):
         self.pred_has_start_end_token = pred_has_start_end_token
         self.use_end_token = use_end_token
         if metric == 'cider':
+            from pyciderevalcap.fast_eval import CIDErEvalCap as ciderEval
             self.scorer = ciderEval('vqa_%s_idxs_end' % subset)
         elif metric == 'bleu':
+            from bleu_eval.bleu import Bleu
             self.scorer = Bleu(n=4)
         assert (metric == 'cider')
         self.to_sentence = SentenceGenerator(trainset='trainval')
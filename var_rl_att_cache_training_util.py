@@ -3,12 +3,13 @@ import os
 import time
 # from rl_trainstep import reinforce_trainstep
 from rl_att_cache_trainstep import reinforce_trainstep
+from step_profiler import StepProfiler
 
 
 def train(train_op, train_dir, log_every_n_steps,
           graph, global_step, number_of_steps,
           init_fn, saver, reader=None, model=None,
-          summary_op=None, env=None):
+          summary_op=None, env=None, profile_trace_every=0):
     if reader is None:
         # Run training.
         tf.contrib.slim.learning.train(
@@ -24,13 +25,13 @@ def train(train_op, train_dir, log_every_n_steps,
         feed_train(train_op, train_dir, log_every_n_steps,
                    graph, global_step, number_of_steps,
                    init_fn, saver, reader, model, summary_op,
-                   env)
+                   env, profile_trace_every)
 
 
 def feed_train(train_op, train_dir, log_every_n_steps,
                graph, global_step, number_of_steps,
                init_fn, saver, reader=None, model=None,
-               summary_op=None, env=None):
+               summary_op=None, env=None, profile_trace_every=0):
     summary_writer = None
     sess = tf.Session(graph=graph)
     summary_interval = 100
@@ -63,25 +64,31 @@ def feed_train(train_op, train_dir, log_every_n_steps,
 
     # start reader
     reader.start()
+    # reinforce_trainstep records its sub-phases to the active profiler
+    profiler = StepProfiler(train_dir, trace_every=profile_trace_every)
 
     # customized training code
     for itr in range(number_of_steps):
+        profiler.begin_step(itr)
         if itr % 2000 == 0:
             tf.logging.info('Saving model %s\n' % sv_path)
-            saver.save(sess, sv_path, global_step=global_step)
+            with profiler.phase('save'):
+                saver.save(sess, sv_path, global_step=global_step)
         start_time = time.time()
         if _write_summary and itr % summary_interval == 0:
             task_ops = [train_op, global_step, summary_op]
             total_loss, np_global_step, summary, avg_reward, t_str = \
                 reinforce_trainstep(reader, model, env, sess, task_ops)
             if summary:
-                summary_writer.add_summary(summary, np_global_step)
+                with profiler.phase('summary'):
+                    summary_writer.add_summary(summary, np_global_step)
         else:
             task_ops = [train_op, global_step]
             total_loss, np_global_step, avg_reward, t_str = \
                 reinforce_trainstep(reader, model, env, sess, task_ops)
 
         time_elapsed = time.time() - start_time
+        profiler.end_step()
 
         if itr % log_every_n_steps == log_every_n_steps - 1 or itr == 0:
             tf.logging.info('global step %d: avg %s = %.4f (%.2f sec/step)',
@@ -92,5 +99,8 @@ def feed_train(train_op, train_dir, log_every_n_steps,
     saver.save(sess, sv_path, global_step=global_step)
 
     # Close
+    profiler.close()
+    if getattr(env, 'replay_buffer', None) is not None:
+        env.replay_buffer.close()
     reader.stop()
     sess.close()
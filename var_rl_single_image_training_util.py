@@ -4,6 +4,7 @@ import time
 # from rl_trainstep import reinforce_trainstep
 from rl_single_trainstep import reinforce_trainstep
 from rl_single_trainstep import VQABelief
+from step_profiler import StepProfiler
 
 
 def train(train_op, train_dir, log_every_n_steps,
@@ -64,6 +65,9 @@ def feed_train(train_op, train_dir, log_every_n_steps,
 
     # build belief buffer
     _VQA_Belief = VQABelief()
+    # a step is one trainstep on a question, over all the hacked questions
+    profiler = StepProfiler(train_dir)
+    step = 0
     # customized training code
     for itr in range(number_of_steps):
         datum = reader.get_test_batch()
@@ -75,8 +79,11 @@ def feed_train(train_op, train_dir, log_every_n_steps,
         t = time.time()
         while True:
             task_ops = [train_op, global_step]
+            profiler.begin_step(step)
             total_loss, np_global_step, avg_reward, t_str = \
                 reinforce_trainstep(datum, model, env, sess, task_ops, _VQA_Belief)
+            profiler.end_step()
+            step += 1
             if _VQA_Belief.should_terminate():
                 break
         print('Hacking finished in %0.2fs' % (time.time()-t))
@@ -90,5 +97,6 @@ def feed_train(train_op, train_dir, log_every_n_steps,
     # saver.save(sess, sv_path, global_step=global_step)
 
     # Close
+    profiler.close()
     # reader.stop()
     sess.close()
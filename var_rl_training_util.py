@@ -2,12 +2,14 @@ import tensorflow as tf
 import os
 import time
 from rl_trainstep import reinforce_trainstep
+from step_profiler import StepProfiler
+from async_checkpoint import AsyncCheckpointSaver
 
 
 def train(train_op, train_dir, log_every_n_steps,
           graph, global_step, number_of_steps,
           init_fn, saver, reader=None, model=None,
-          summary_op=None, env=None):
+          summary_op=None, env=None, max_sampling_rounds=2, profile_trace_every=0):
     if reader is None:
         # Run training.
         tf.contrib.slim.learning.train(
@@ -23,13 +25,13 @@ def train(train_op, train_dir, log_every_n_steps,
         feed_train(train_op, train_dir, log_every_n_steps,
                    graph, global_step, number_of_steps,
                    init_fn, saver, reader, model, summary_op,
-                   env)
+                   env, max_sampling_rounds, profile_trace_every)
 
 
 def feed_train(train_op, train_dir, log_every_n_steps,
                graph, global_step, number_of_steps,
                init_fn, saver, reader=None, model=None,
-               summary_op=None, env=None):
+               summary_op=None, env=None, max_sampling_rounds=2, profile_trace_every=0):
     summary_writer = None
     sess = tf.Session(graph=graph)
     summary_interval = 100
@@ -62,25 +64,34 @@ def feed_train(train_op, train_dir, log_every_n_steps,
 
     # start reader
     reader.start()
+    # reinforce_trainstep records its sub-phases to the active profiler
+    profiler = StepProfiler(train_dir, trace_every=profile_trace_every)
+    ckpt_saver = AsyncCheckpointSaver(graph, sv_path, saver)
 
     # customized training code
     for itr in range(number_of_steps):
+        profiler.begin_step(itr)
         if itr % 2000 == 0:
             tf.logging.info('Saving model %s\n' % sv_path)
-            saver.save(sess, sv_path, global_step=global_step)
+            with profiler.phase('save'):
+                ckpt_saver.save(sess, global_step)
         start_time = time.time()
         if _write_summary and itr % summary_interval == 0:
             task_ops = [train_op, global_step, summary_op]
             total_loss, np_global_step, summary, avg_reward, t_str = \
-                reinforce_trainstep(reader, model, env, sess, task_ops)
+                reinforce_trainstep(reader, model, env, sess, task_ops,
+                                    max_sampling_rounds)
             if summary:
-                summary_writer.add_summary(summary, np_global_step)
+                with profiler.phase('summary'):
+                    summary_writer.add_summary(summary, np_global_step)
         else:
             task_ops = [train_op, global_step]
             total_loss, np_global_step, avg_reward, t_str = \
-                reinforce_trainstep(reader, model, env, sess, task_ops)
+                reinforce_trainstep(reader, model, env, sess, task_ops,
+                                    max_sampling_rounds)
 
         time_elapsed = time.time() - start_time
+        profiler.end_step()
 
         if itr % log_every_n_steps == log_every_n_steps - 1 or itr == 0:
             tf.logging.info('global step %d: avg %s = %.4f (%.2f sec/step)',
@@ -88,8 +99,10 @@ def feed_train(train_op, train_dir, log_every_n_steps,
 
     # Finish training
     tf.logging.info('Finished training! Saving model to disk.')
-    saver.save(sess, sv_path, global_step=global_step)
+    ckpt_saver.save(sess, global_step)
+    ckpt_saver.close()
 
     # Close
+    profiler.close()
     reader.stop()
     sess.close()
@@ -3,6 +3,7 @@ from ops import concat_op, split_op
 import tensorflow.contrib.slim as slim
 from rnn_ops import create_drop_lstm_cell
 from rnn_ops import build_caption_inputs_and_targets
+from rnn_ops import build_in_graph_decoding_step
 # from greedy_decoding import create_greedy_decoder
 from random_decoding import create_greedy_decoder
 from rnn_compact_ops import *
@@ -128,7 +129,7 @@ def _build_beamsearch_inference_decoder(in_embed, inputs, vocab_size, num_cells,
 
     # build LSTM cell and RNN
     lstm_cell = BasicLSTMCell(num_cells)
-    concat_op(init_state, axis=1, name="initial_state")
+    initial_state = concat_op(init_state, axis=1, name="initial_state")
 
     # word embedding
     with tf.variable_scope('word_embedding'):
@@ -160,6 +161,7 @@ def _build_beamsearch_inference_decoder(in_embed, inputs, vocab_size, num_cells,
     logits = slim.fully_connected(outputs, vocab_size, activation_fn=None,
                                   scope='logits')
     prob = tf.nn.softmax(logits, name="softmax")
+    build_in_graph_decoding_step(initial_state, word_embed, lstm_cell, vocab_size)
     return state
 
 
@@ -213,6 +215,6 @@ def _build_tf_beam_inference_decoder(in_embed, vocab_size, num_cells, start_toke
                                   tokens_to_inputs_fn=_tokens_to_inputs_fn,
                                   outputs_to_score_fn=_output_to_score_fn,
                                   max_len=20,
-                                  output_dense=True,SS
+                                  output_dense=True,
                                   scope='RNN')
     return scores, pathes
@@ -3,6 +3,7 @@ from ops import concat_op, split_op
 import tensorflow.contrib.slim as slim
 from rnn_ops import create_drop_lstm_cell
 from rnn_ops import build_caption_inputs_and_targets
+from rnn_ops import build_in_graph_decoding_step
 # from greedy_decoding import create_greedy_decoder
 from random_decoding import create_greedy_decoder
 from rnn_compact_ops import *
@@ -139,7 +140,7 @@ def _build_beamsearch_inference_decoder(in_embed, inputs, vocab_size, num_cells,
 
     # build LSTM cell and RNN
     lstm_cell = BasicLSTMCell(num_cells)
-    concat_op(init_state, axis=1, name="initial_state")
+    initial_state = concat_op(init_state, axis=1, name="initial_state")
 
     # word embedding
     with tf.variable_scope('word_embedding'):
@@ -171,6 +172,7 @@ def _build_beamsearch_inference_decoder(in_embed, inputs, vocab_size, num_cells,
     logits = slim.fully_connected(outputs, vocab_size, activation_fn=None,
                                   scope='logits')
     prob = tf.nn.softmax(logits, name="softmax")
+    build_in_graph_decoding_step(initial_state, word_embed, lstm_cell, vocab_size)
     return state
 
 
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.io import loadmat
 from util import load_json
 import pdb
 
@@ -8,6 +7,7 @@ _EPS = 1e-8
 
 class VisualFactReward(object):
     def __init__(self):
+        from scipy.io import loadmat
         word2lemma = loadmat('data/quest_token2lemma.mat')['word2lemma']
         self.word2lemma = word2lemma.flatten()
         self.valid_vocab_size = self.word2lemma.size
@@ -1,7 +1,7 @@
-import tensorflow as tf
 import numpy as np
 import os
 import cmd
+from collections import OrderedDict
 from inference_utils.question_generator_util import SentenceGenerator
 from nltk.tokenize import word_tokenize
 from inference_utils import vocabulary
@@ -33,13 +33,28 @@ class SentenceEncoder(object):
         token_len = np.array(tokens.size, dtype=np.int32)
         return tokens.reshape([1, -1]), token_len.flatten()
 
+    def encode_sentences(self, sentences):
+        token_ids = [self._encode_sentence(s) for s in sentences]
+        token_len = np.array([len(ids) for ids in token_ids], dtype=np.int32)
+        max_len = max(token_len.max(), 1) if len(sentences) else 1
+        tokens = np.zeros([len(sentences), max_len], dtype=np.int32)
+        # scatter the flattened ids into the padded array in one go
+        mask = np.arange(max_len)[np.newaxis, :] < token_len[:, np.newaxis]
+        tokens[mask] = [i for ids in token_ids for i in ids]
+        return tokens, token_len
+
     def _encode_sentence(self, sentence):
         tokens = _tokenize_sentence(sentence)
         return [self._vocab.word_to_id(word) for word in tokens]
 
 
 class BaseVQAModel(object):
-    def __init__(self, ckpt_file=None):
+    # models built in the test_broadcast phase take a single image and
+    # broadcast it to all the questions of the batch
+    broadcast_image = False
+
+    # a cached res5c feature map is 1.6 MB, see N2MNWrapper
+    def __init__(self, ckpt_file=None, max_cached_images=64):
         top_ans_file = '../VQA-tensorflow/data/vqa_trainval_top2000_answers.txt'
         self.to_sentence = SentenceGenerator(trainset='trainval',
                                              top_ans_file=top_ans_file)
@@ -48,34 +63,54 @@ class BaseVQAModel(object):
         self.sess = None
         self.name = ''
         self.top_k = 2
+        self._max_cached_images = max_cached_images
+        self._image_cache = OrderedDict()
 
         self.answer_to_top_ans_id = None
 
     def _load_image(self, image_id):
         return None
 
-    def _process_question(self, question):
-        arr, arr_len = self.sent_encoder.encode_sentence(question)
-        return arr, arr_len
+    def encode_image(self, image_id):
+        # bounded LRU cache of the [1, ...] image inputs of the model
+        if image_id in self._image_cache:
+            image = self._image_cache.pop(image_id)
+        else:
+            image = self._load_image(image_id)
+            if len(self._image_cache) >= self._max_cached_images:
+                self._image_cache.popitem(last=False)
+        self._image_cache[image_id] = image
+        return image
+
+    def score_questions(self, image_id, questions):
+        """
+        Scores many questions about the same image in one run, the image
+        is loaded once and kept in the cache for later calls.
+        """
+        image = self.encode_image(image_id)
+        arr, arr_len = self.sent_encoder.encode_sentences(questions)
+        if not self.broadcast_image:
+            image = np.repeat(image, len(questions), axis=0)
+        return self.model.inference(self.sess, [image, arr, arr_len])
+
+    def _scores_to_answers(self, scores):
+        scores[:, -1] = -100
+        ids = scores.argmax(axis=1)
+        answers = [self.to_sentence.index_to_top_answer(id) for id in ids]
+        return answers, scores.max(axis=1)
 
     def inference(self, image_id, question):
-        image = self._load_image(image_id)
-        arr, arr_len = self._process_question(question)
-        scores = self.model.inference(self.sess, [image, arr, arr_len])
+        scores = self.score_questions(image_id, [question])
         self.show_prediction(scores)
         return scores
 
+    def get_scores(self, image_id, questions):
+        scores = self.score_questions(image_id, questions)
+        return self._scores_to_answers(scores)
+
     def get_score(self, image_id, question):
-        image = self._load_image(image_id)
-        arr, arr_len = self._process_question(question)
-        scores = self.model.inference(self.sess, [image, arr, arr_len])
-        # self.show_prediction(scores)
-        scores[:, -1] = -100
-        id = scores.flatten().argmax()
-        # print(id)
-        sc = scores.flatten().max()
-        answer = self.to_sentence.index_to_top_answer(id)
-        return answer, sc
+        answers, scores = self.get_scores(image_id, [question])
+        return answers[0], scores[0]
 
     def query_score(self, image_id, question, answer):
         if self.answer_to_top_ans_id is None:
@@ -83,9 +118,7 @@ class BaseVQAModel(object):
             top_ans = self.to_sentence._top_ans_vocab
             self.answer_to_top_ans_id = {ans: idx for idx, ans in enumerate(top_ans)}
 
-        image = self._load_image(image_id)
-        arr, arr_len = self._process_question(question)
-        scores = self.model.inference(self.sess, [image, arr, arr_len])
+        scores = self.score_questions(image_id, [question])
         scores = scores.flatten()
         if answer in self.answer_to_top_ans_id:
             idx = self.answer_to_top_ans_id[answer]
@@ -105,14 +138,24 @@ class BaseVQAModel(object):
 
 
 class AttentionModel(BaseVQAModel):
-    def __init__(self, ckpt_file='model/v1_vqa_VQA/v1_vqa_VQA_best2/model.ckpt-135000'):
+    broadcast_image = True
+    CKPT_FILE = 'model/v1_vqa_VQA/v1_vqa_VQA_best2/model.ckpt-135000'
+
+    def __init__(self, ckpt_file=None, frozen_file=None):
         BaseVQAModel.__init__(self)
-        self.g = tf.Graph()
+        ckpt_file = ckpt_file or self.CKPT_FILE
         self.ckpt_file = ckpt_file
+        self.name = ' ------- MLB-attention ------- '
+        if frozen_file is not None:
+            # exported by export_frozen_models.py
+            from frozen_graph_util import load_frozen_model
+            self.g, self.sess, self.model = load_frozen_model(frozen_file)
+            return
+        import tensorflow as tf
+        self.g = tf.Graph()
         from models.vqa_soft_attention import AttentionModel
         from vqa_config import ModelConfig
         config = ModelConfig()
-        self.name = ' ------- MLB-attention ------- '
 
         with self.g.as_default():
             self.sess = tf.Session()
@@ -130,16 +173,27 @@ class AttentionModel(BaseVQAModel):
 
 
 class VanillaModel(BaseVQAModel):
-    def __init__(self, ckpt_file='model/kprestval_VQA-BaseNorm/model.ckpt-26000'):
+    CKPT_FILE = 'model/kprestval_VQA-BaseNorm/model.ckpt-26000'
+
+    def __init__(self, ckpt_file=None, frozen_file=None):
         BaseVQAModel.__init__(self)
         self.top_k = 2
-        self.g = tf.Graph()
+        ckpt_file = ckpt_file or self.CKPT_FILE
         self.ckpt_file = ckpt_file
+        self.name = ' ------- DeeperLSTM ------- '
+        if frozen_file is not None:
+            from frozen_graph_util import load_frozen_model
+            self.g, self.sess, self.model = load_frozen_model(frozen_file)
+        else:
+            self._build_model(ckpt_file)
+        self._init_image_cache()
+
+    def _build_model(self, ckpt_file):
+        import tensorflow as tf
+        self.g = tf.Graph()
         from models.vqa_base import BaseModel
         from vqa_config import ModelConfig
         config = ModelConfig()
-        self.name = ' ------- DeeperLSTM ------- '
-
         with self.g.as_default():
             self.sess = tf.Session()
             self.model = BaseModel(config, phase='test')
@@ -148,8 +202,6 @@ class VanillaModel(BaseVQAModel):
             self.saver = tf.train.Saver(var_list=vars)
             self.saver.restore(self.sess, ckpt_file)
 
-        self._init_image_cache()
-
     def _init_image_cache(self):
         from util import load_hdf5
         d = load_hdf5('data/res152_std_mscoco_kptest.data')
@@ -3,6 +3,7 @@ import os
 import re
 from time import time
 from util import load_json, save_json
+from async_checkpoint import BackgroundWriter
 from var_ivqa_rewards import serialize_path
 
 
@@ -37,6 +38,7 @@ class VQAReplayBuffer(object):
         self.sv_dir = sv_dir
         self.sv_format = 'vqa_replay-%d.json'
         self.save_interval = 2500
+        self._writer = BackgroundWriter()
 
     def restore(self):
         ckpts = os.listdir(self.sv_dir)
@@ -77,11 +79,25 @@ class VQAReplayBuffer(object):
             pathes.append(self.memory[str(_id)].keys())
         return pathes
 
-    def save(self):
-        if self.num_call % self.save_interval == 0:
+    def save(self, force=False):
+        if force or self.num_call % self.save_interval == 0:
             print('Saving VQA replay buffers')
-            t = time()
+            self._writer.wait()  # at most one save in flight
+            # snapshot here, the json is written in the background
+            memory = {k: dict(v) for k, v in self.memory.iteritems()}
             sv_file = os.path.join(self.sv_dir, 'vqa_replay.json')
-            save_json(sv_file, {'num_call': self.num_call,
-                                'memory': self.memory})
-            print('File %s saved to disk, total time: %0.2fs' % (sv_file, time() - t))
+            self._writer.submit(_save_replay, sv_file, {'num_call': self.num_call,
+                                                        'memory': memory})
+
+    def close(self):
+        """Saves the final state and waits until it is on disk."""
+        self.save(force=True)
+        self._writer.wait()
+
+
+def _save_replay(sv_file, d):
+    t = time()
+    tmp_file = '%s.tmp' % sv_file
+    save_json(tmp_file, d)
+    os.rename(tmp_file, sv_file)
+    print('File %s saved to disk, total time: %0.2fs' % (sv_file, time() - t))
@@ -9,7 +9,6 @@ except:
     pass
 from inference_utils import vocabulary
 from config import QuestionGeneratorConfig
-import scipy.spatial.distance as ssd
 
 _CONFIG = QuestionGeneratorConfig()
 _IM_ROOT = '/import/vision-ephemeral/fl302/data/VQA/Images/mscoco/'
@@ -30,6 +29,8 @@ class AnswerEncoder(object):
         self._top_answer_file = top_answer_file
         self._top_ans_vocab = None
         self._top_ans_w2v = None
+        self._top_ans_sqr_norm = None
+        self._ans_w2v_cache = {}
         self._ans_word_vocab = None
         self._top_ans_seq = None
         self._max_ans_vocab_size = _CONFIG.ans_vocab_size
@@ -59,11 +60,8 @@ class AnswerEncoder(object):
         self._top_ans_seq = self.encode_to_sequence(self._top_ans_vocab)
 
     def _create_top_ans_word_vector(self):
-        index = []
-        for ans in self._top_ans_vocab:
-            w2v = self._encoder.encode(ans)
-            index.append(w2v.reshape([1, -1]))
-        self._top_ans_w2v = np.concatenate(index)
+        self._top_ans_w2v = self._encoder.encode_batch(self._top_ans_vocab)
+        self._top_ans_sqr_norm = np.square(self._top_ans_w2v).sum(axis=1)
 
     def encode_by_index(self, index):
         if self._top_ans_w2v is None:
@@ -71,12 +69,14 @@ class AnswerEncoder(object):
         return self._top_ans_w2v[index]
 
     def encode_by_answer(self, answers):
-        output = []
-        for ans in answers:
-            if type(ans) != list:
-                ans = _tokenize_sentence(ans)
-            output.append(self._encoder.encode(ans).reshape([1, -1]))
-        return np.concatenate(output)
+        keys = [ans if type(ans) != list else tuple(ans) for ans in answers]
+        missing = list(set([k for k in keys if k not in self._ans_w2v_cache]))
+        if missing:
+            tokenized = [_tokenize_sentence(k) if type(k) != tuple else list(k)
+                         for k in missing]
+            w2v = self._encoder.encode_batch(tokenized)
+            self._ans_w2v_cache.update(zip(missing, w2v))
+        return np.concatenate([self._ans_w2v_cache[k][np.newaxis, :] for k in keys])
 
     def encode_to_sequence(self, ans):
         ans_seq = []
@@ -92,12 +92,33 @@ class AnswerEncoder(object):
     def get_nearest_top_answer_index(self, ans):
         if ans in self._top_answer_to_index:
             return self._top_answer_to_index[ans]
-        # if not in top answers
+        return self.get_nearest_top_answer_indices([ans])[0, 0]
+
+    def get_nearest_top_answer_indices(self, answers, k=1):
+        """
+        Returns a [N, k] array with the k nearest top answers (euclidean
+        distance in word2vec space) of each answer, in increasing distance.
+        When k is 1, answers in the top answer list map to themselves.
+        """
         if self._top_ans_w2v is None:
             self._create_top_ans_word_vector()
-        f = self._encoder.encode(ans)
-        d2 = ssd.cdist(f[np.newaxis, :], self._top_ans_w2v)
-        return d2.flatten().argmin()
+        k = min(k, self._top_ans_w2v.shape[0])
+        exact = [self._top_answer_to_index.get(ans, -1) for ans in answers]
+        index = np.zeros([len(answers), k], dtype=np.int64)
+        query = [i for i, idx in enumerate(exact) if idx < 0 or k > 1]
+        if query:
+            # |f - t|^2 = |f|^2 - 2f.t + |t|^2, |f|^2 doesn't change the ranking
+            f = self._encoder.encode_batch([answers[i] for i in query])
+            d2 = self._top_ans_sqr_norm[np.newaxis, :] - 2. * f.dot(self._top_ans_w2v.T)
+            rows = np.arange(len(query))[:, np.newaxis]
+            top_k = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            order = np.argsort(d2[rows, top_k], axis=1)
+            index[query] = top_k[rows, order]
+        if k == 1:
+            for i, idx in enumerate(exact):
+                if idx >= 0:
+                    index[i, 0] = idx
+        return index
 
     def encode_to_sequence_by_index(self, index):
         if self._top_ans_seq is None:
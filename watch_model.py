@@ -1,5 +1,7 @@
 import os
+import glob
 from time import time, sleep
+from multiprocessing import Pool
 import tensorflow as tf
 import json
 from collections import OrderedDict
@@ -42,16 +44,90 @@ def remove_model_suffix(model_path):
     return model_path
 
 
+def _checkpoint_files(model_path):
+    if os.path.exists(model_path):  # v1
+        return [model_path]
+    # v2, the meta graph is optional
+    return [model_path + suf for suf in _V2_SUFFIX[:2]]
+
+
+def _checkpoint_exists(model_path):
+    return all([os.path.exists(f) for f in _checkpoint_files(model_path)])
+
+
+def _checkpoint_ready(model_path, settle_sec):
+    files = _checkpoint_files(model_path)
+    if not _checkpoint_exists(model_path):
+        return False
+    # wait until the trainer is done writing
+    return time() - max([os.path.getmtime(f) for f in files]) > settle_sec
+
+
+def checkpoint_file_name(fpath, model_path):
+    """
+    fpath with the iteration of the checkpoint model_path before its
+    extension, for the outputs of an eval_fn run in parallel with others.
+    """
+    root, ext = os.path.splitext(fpath)
+    return '%s_%d%s' % (root, get_model_iteration(model_path), ext)
+
+
+# eval_fn of the watcher running in parallel, inherited by the forked
+# workers, so that closures defined in main() can be used
+_EVAL_FN = None
+
+# share of the GPU memory of an evaluation worker
+_GPU_MEMORY_FRACTION = None
+
+
+def eval_session_config():
+    """
+    The config of the sessions created by an eval_fn: a worker evaluating
+    in parallel with others grows into its share of the GPU memory.
+    """
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    if _GPU_MEMORY_FRACTION is not None:
+        config.gpu_options.per_process_gpu_memory_fraction = _GPU_MEMORY_FRACTION
+    return config
+
+
+def _init_eval_worker(memory_fraction):
+    global _GPU_MEMORY_FRACTION
+    _GPU_MEMORY_FRACTION = memory_fraction
+
+
+def _run_eval_fn(model_path):
+    return _EVAL_FN(model_path)
+
+
 class ModelWatcher(object):
+    """
+    Evaluates every checkpoint written to model_dir with eval_fn, keeping
+    the n_keep best ones in a backup directory and the scores in
+    result/res_<experiment>.json. New checkpoints are found by diffing a
+    scan of model_dir with the ones already seen, and queued, so none is
+    skipped while a long evaluation runs. With num_workers > 1, queued
+    checkpoints are evaluated in parallel by a pool of processes forked
+    from the watcher, whose sessions should use eval_session_config() to
+    share the GPU memory, and whose outputs must be named after their
+    checkpoint, see checkpoint_file_name. Results are only ever written by
+    the watcher process.
+    """
+
     def __init__(self, model_dir, eval_fn, save_model=True,
-                 n_keep=2, wait_sec=20, dir_map=None):
+                 n_keep=2, wait_sec=20, dir_map=None, num_workers=1,
+                 settle_sec=10):
         self._model_dir = model_dir
         self._n_keep = n_keep
         self._wait_sec = wait_sec
+        self._settle_sec = settle_sec
         self._model_res_dict = {}
-        self._prev_model = None
+        self._seen = set()
+        self._queue = []
         self._eval_fn = eval_fn
         self._save_model = save_model
+        self._num_workers = num_workers
         self._res_dict = OrderedDict()
         self._dir_map = dir_map
         self._res_file = os.path.join('result/res_%s.json' % self.get_experiment_name())
@@ -64,12 +140,11 @@ class ModelWatcher(object):
     def _load_result_file(self):
         if os.path.exists(self._res_file):
             print('Loading from previous results...')
-            self._res_dict = json.load(open(self._res_file, 'r'))
+            self._res_dict = json.load(open(self._res_file, 'r'), object_pairs_hook=OrderedDict)
             for model in self._res_dict:
                 dst_file = os.path.join(self._model_sv_dir, model)
                 acc = float(self._res_dict[model])
                 self._model_res_dict[dst_file] = acc
-            self._prev_model = self._res_dict.keys()[-1]
             self.print_results()
 
     def _vertify_model_dir(self, model_path):
@@ -79,25 +154,36 @@ class ModelWatcher(object):
         else:
             return model_path
 
-    def _check_for_new_model(self):
+    def _scan_models(self):
+        index_files = glob.glob(os.path.join(self._model_dir, '*.index'))
+        models = set([remove_model_suffix(f) for f in index_files])
         ckpt = tf.train.get_checkpoint_state(self._model_dir)
-        model_path = ckpt.model_checkpoint_path
-        model_path = self._vertify_model_dir(model_path)
-        if model_path == self._prev_model:
-            print('Waiting for new models')
-            sleep(self._wait_sec)
-            return None
-        else:
-            self._prev_model = model_path
-            print('Add new model %s to work list, evaluation starts in 30s' % os.path.basename(model_path))
-            sleep(10)
-            return model_path
+        if ckpt is not None:  # v1 checkpoints, and those of an other directory
+            models.update(ckpt.all_model_checkpoint_paths)
+        return [self._vertify_model_dir(m) for m in models]
+
+    def _check_for_new_models(self):
+        new_models = []
+        for model_path in self._scan_models():
+            model_name = os.path.basename(model_path)
+            if model_name in self._seen or model_name in self._res_dict:
+                continue
+            if not _checkpoint_ready(model_path, self._settle_sec):
+                continue
+            self._seen.add(model_name)
+            new_models.append(model_path)
+        new_models.sort(key=get_model_iteration)
+        for model_path in new_models:
+            print('Add new model %s to work list' % os.path.basename(model_path))
+        self._queue.extend(new_models)
 
     def get_experiment_name(self):
         return os.path.split(self._model_dir)[1]
 
     def write_result_to_file(self):
-        json.dump(self._res_dict, open(self._res_file, 'w'))
+        tmp_file = self._res_file + '.tmp'
+        json.dump(self._res_dict, open(tmp_file, 'w'))
+        os.rename(tmp_file, self._res_file)
 
     def print_results(self):
         # sort by iteration
@@ -124,27 +210,77 @@ class ModelWatcher(object):
                 print('Removing model %s' % model_path)
                 delete_model(model_path)
 
-    def run(self):
+    def _add_result(self, model_path, res_str):
+        if type(res_str) == float:
+            res_str = '%0.3f' % res_str
+        else:
+            assert (self._save_model == False)
+        model_name = os.path.basename(model_path)
+        self._res_dict[model_name] = res_str
+        self.write_result_to_file()
+        self.print_results()
+        self._backup_model(model_path)
+
+    def _run_serial(self):
         while True:
-            model_path = self._check_for_new_model()
-            if model_path is not None:
-                try:
-                    res_str = self._eval_fn(model_path)
-                except Exception, e:
-                    if e is KeyboardInterrupt:
-                        raise
-                    else:
-                        print(str(e))
+            self._check_for_new_models()
+            if not self._queue:
+                print('Waiting for new models')
+                sleep(self._wait_sec)
+                continue
+            model_path = self._pop_model()
+            if model_path is None:
+                continue
+            try:
+                res_str = self._eval_fn(model_path)
+            except Exception, e:
+                print(str(e))
+                continue
+            self._add_result(model_path, res_str)
+
+    def _pop_model(self):
+        model_path = self._queue.pop(0)
+        # e.g. removed by the max_to_keep of the trainer while queued
+        if not _checkpoint_exists(model_path):
+            print('Model %s was deleted before it was evaluated, skipped' %
+                  os.path.basename(model_path))
+            return None
+        return model_path
+
+    def _run_parallel(self):
+        global _EVAL_FN
+        _EVAL_FN = self._eval_fn
+        # a fresh process per checkpoint, so graphs and GPU memory are released
+        pool = Pool(self._num_workers, initializer=_init_eval_worker,
+                    initargs=(1. / self._num_workers,), maxtasksperchild=1)
+        running = OrderedDict()
+        try:
+            while True:
+                self._check_for_new_models()
+                while self._queue and len(running) < self._num_workers:
+                    model_path = self._pop_model()
+                    if model_path is None:
                         continue
-                if type(res_str) == float:
-                    res_str = '%0.3f' % res_str
-                else:
-                    assert (self._save_model == False)
-                model_name = os.path.basename(model_path)
-                self._res_dict[model_name] = res_str
-                self.write_result_to_file()
-                self.print_results()
-                self._backup_model(model_path)
+                    running[model_path] = pool.apply_async(_run_eval_fn, (model_path,))
+                done = [m for m, job in running.items() if job.ready()]
+                for model_path in done:
+                    try:
+                        res_str = running.pop(model_path).get()
+                    except Exception, e:
+                        print('%s: %s' % (os.path.basename(model_path), str(e)))
+                        continue
+                    self._add_result(model_path, res_str)
+                if not done:
+                    sleep(self._wait_sec if not running else 1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def run(self):
+        if self._num_workers > 1:
+            self._run_parallel()
+        else:
+            self._run_serial()
 
 
 if __name__ == '__main__':
@@ -24,7 +24,7 @@ class Word2VecEncoder(object):
         self._num2idx = {str(k): dig2idx[k] for k in range(10)}
         self._word2idx = {k: v for (k, v) in zip(self._vocab, index.tolist())}
 
-    def encode(self, sentence):
+    def _sentence_to_index(self, sentence):
         if sentence is None:
             raise Exception('input can'' be none')
         digits = ''.join(re.findall(r'\d+', ''.join(sentence)))
@@ -38,11 +38,39 @@ class Word2VecEncoder(object):
             except Exception, e:
                 pass
                 # print('Warning: word %s not in dictionary' % word)
+        return index
+
+    def encode(self, sentence):
+        index = self._sentence_to_index(sentence)
         v = self._word_vectors[index].sum(axis=0)
         index = np.array(index)
         n = (index > 0).sum() + EPS
         return v / n
 
+    def encode_batch(self, sentences):
+        """
+        Encode a list of sentences into a [N, D] matrix. Word indices of all
+        sentences are flattened into a single array and summed per sentence
+        with a segment sum, which gives the same result as calling encode on
+        every sentence.
+        """
+        num = len(sentences)
+        dim = self._word_vectors.shape[1]
+        index = [self._sentence_to_index(s) for s in sentences]
+        lengths = np.array([len(idx) for idx in index], dtype=np.int64)
+        v = np.zeros([num, dim], dtype=self._word_vectors.dtype)
+        if lengths.sum() == 0:
+            return v
+        flat = np.fromiter((i for idx in index for i in idx),
+                           dtype=np.int64, count=lengths.sum())
+        segment_ids = np.repeat(np.arange(num), lengths)
+        # reduceat needs non-empty segments, empty sentences stay zero
+        non_empty = np.where(lengths > 0)[0]
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[non_empty]
+        v[non_empty] = np.add.reduceat(self._word_vectors[flat], starts, axis=0)
+        n = np.bincount(segment_ids, weights=(flat > 0), minlength=num) + EPS
+        return v / n[:, np.newaxis].astype(v.dtype)
+
 
 def load_vocabulary(vocab_file):
     with tf.gfile.GFile(vocab_file, mode="r") as f: